@@ -0,0 +1,190 @@
+"""In-memory cache of the run outputs, shared by all the requests of the API process"""
+import logging
+import numpy as np
+import os
+import pandas as pd
+import threading
+import yaml
+
+from collections import OrderedDict
+from typing import Callable
+
+from core.pipelines.artifact_store import load_artifact, load_manifest, run_path
+
+
+# the cache of the process. Created at the first use by get_artifact_cache.
+_cache = None
+
+
+class ArtifactCache:
+    """
+    LRU cache of the outputs of the runs (model, datasets) and of the files built from them (explainers).
+    The size of an item is its memory usage for pandas objects and its file size otherwise: the least recently used
+    items are evicted as soon as the total exceeds max_bytes, whatever the run they belong to.
+    The latest run is resolved through RUNS/LATEST.json, checked at every request: a run published by any process is
+    used from the next request on.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._dct_item = OrderedDict()
+        self._n_bytes = 0
+        self._latest = None
+        self._lock = threading.RLock()
+
+    @property
+    def n_bytes(self) -> int:
+        return self._n_bytes
+
+    def _get(self, key: tuple, fun_load: Callable, fun_size: Callable):
+        """
+        Item of the cache, loaded and stored on a miss.
+        :param key: key of the item.
+        :param fun_load: loads the item.
+        :param fun_size: size in bytes of the loaded item.
+        :return: the item.
+        """
+
+        with self._lock:
+            if key in self._dct_item:
+                self._dct_item.move_to_end(key)
+                return self._dct_item[key][0]
+
+            obj = fun_load()
+            n_bytes = fun_size(obj)
+            self._dct_item[key] = (obj, n_bytes)
+            self._n_bytes += n_bytes
+
+            # the item just loaded is kept even if alone it exceeds the limit
+            while self._n_bytes > self.max_bytes and len(self._dct_item) > 1:
+                key_old, (_, n_old) = self._dct_item.popitem(last=False)
+                self._n_bytes -= n_old
+                logging.debug(f'ARTIFACT CACHE - EVICTED: {key_old}')
+
+            return obj
+
+    def manifest(self, run_id: str = None) -> dict:
+        """
+        Manifest of a run.
+        :param run_id: the run id. None means the latest run.
+        :return: the manifest.
+        """
+
+        if run_id is not None:
+            str_path = run_path(run_id) + 'manifest.json'
+            return self._get(('MANIFEST', run_id), lambda: load_manifest(run_id), lambda _: os.path.getsize(str_path))
+
+        # LATEST.json is replaced, never rewritten in place: its inode and time change with every new run
+        st = os.stat(os.environ['PATH_OUT_MOD'] + 'RUNS/LATEST.json')
+        tpl_version = (st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            if self._latest is None or self._latest[0] != tpl_version:
+                dct_manifest = load_manifest()
+                self._latest = (tpl_version, dct_manifest)
+                logging.info(f'ARTIFACT CACHE - LATEST RUN: {dct_manifest["RUN_ID"]}')
+
+            return self._latest[1]
+
+    def artifact(self, dct_manifest: dict, str_name: str):
+        """
+        Output of a run, as returned by load_artifact. Items are shared by the requests: they must not be modified.
+        :param dct_manifest: manifest of the run, as returned by manifest.
+        :param str_name: name of the output.
+        :return: the output.
+        """
+
+        str_path = run_path(dct_manifest['RUN_ID']) + dct_manifest['ARTIFACTS'][str_name]['PATH']
+
+        def fun_size(obj) -> int:
+            if isinstance(obj, (pd.DataFrame, pd.Series)):
+                return int(np.sum(obj.memory_usage(index=True, deep=True)))
+            return os.path.getsize(str_path)
+
+        return self._get(
+            (dct_manifest['RUN_ID'], str_name), lambda: load_artifact(dct_manifest, str_name), fun_size
+        )
+
+    def file(self, str_path: str, fun_load: Callable):
+        """
+        Object stored in a file outside the runs (e.g. an explainer), reloaded when the file changes.
+        :param str_path: path of the file.
+        :param fun_load: loads the object from the path.
+        :return: the object.
+        """
+
+        st = os.stat(str_path)
+        return self._get(
+            ('FILE', str_path, st.st_ino, st.st_mtime_ns), lambda: fun_load(str_path), lambda _: st.st_size
+        )
+
+    def invalidate(self) -> None:
+        """
+        Forget the latest run, to be called as soon as a new run is published by this process. Items of the previous
+        runs stay until evicted.
+        :return:
+        """
+
+        with self._lock:
+            self._latest = None
+
+        return
+
+    def clear(self) -> None:
+
+        with self._lock:
+            self._dct_item.clear()
+            self._n_bytes = 0
+            self._latest = None
+
+        return
+
+    def preload(self, lst_name: list) -> None:
+        """
+        Load in the cache outputs of the latest run, if any.
+        :param lst_name: names of the outputs.
+        :return:
+        """
+
+        try:
+            dct_manifest = self.manifest()
+        except FileNotFoundError:
+            logging.warning('ARTIFACT CACHE - NO RUN TO PRELOAD')
+            return
+
+        for str_name in lst_name:
+            if str_name in dct_manifest['ARTIFACTS']:
+                self.artifact(dct_manifest, str_name)
+
+        logging.info(f'ARTIFACT CACHE - PRELOADED {lst_name}: {self._n_bytes / 2 ** 20:.1f} MB')
+
+        return
+
+
+def get_artifact_cache() -> ArtifactCache:
+    """
+    Cache of the process, created at the first call with the settings of param_api.yaml. Each process has its own
+    cache, bounded by MAX_MB: background jobs load the run outputs directly instead (see load_artifact).
+    :return: the cache.
+    """
+
+    global _cache
+    if _cache is None:
+        with open('config/param_api.yaml') as f:
+            dct_param_cache = yaml.safe_load(f)['CACHE']
+        _cache = ArtifactCache(max_bytes=int(dct_param_cache['MAX_MB'] * 2 ** 20))
+
+    return _cache
+
+
+def preload_artifact_cache() -> None:
+    """
+    Fill the cache with the outputs of the latest run listed in param_api.yaml, at the startup of the API.
+    :return:
+    """
+
+    with open('config/param_api.yaml') as f:
+        lst_name = yaml.safe_load(f)['CACHE']['PRELOAD']
+
+    get_artifact_cache().preload(lst_name)
+
+    return
@@ -0,0 +1,387 @@
+"""Background jobs of the API: long tasks run in a bounded process pool, out of the event loop"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+import yaml
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Callable
+
+from core.utils.files import tmp_path, write_json
+from core.utils.hashing import hash_content
+from setting.environment import set_env
+from setting.logger import set_logger
+
+
+# state of the worker processes of the pool. Filled by _init_worker and _run_job.
+_dct_worker = {}
+
+# the job engine of the process. Created at the first use by get_job_engine.
+_engine = None
+
+LST_IN_FLIGHT = ['PENDING', 'RUNNING']
+
+
+class JobCancelledError(Exception):
+    """Raised inside a job, at its next progress checkpoint, when its cancellation is requested"""
+
+
+def _job_path(str_job_id: str) -> str:
+    return os.environ['PATH_OUT_JOBS'] + str_job_id
+
+
+def _remove(str_path: str) -> None:
+
+    try:
+        os.remove(str_path)
+    except FileNotFoundError:
+        pass
+
+    return
+
+
+def _acquire_key(str_key_path: str, str_job_id: str) -> bool:
+    """
+    Create a deduplication key holding a job id, unless it exists. The id is written to a temporary file first, then
+    linked to the key: the key never exists without its content, and only one process can create it.
+    :param str_key_path: path of the key.
+    :param str_job_id: the job id.
+    :return: True if the key was created.
+    """
+
+    str_tmp = tmp_path(str_key_path)
+    with open(str_tmp, 'w') as fp:
+        fp.write(str_job_id)
+
+    try:
+        os.link(str_tmp, str_key_path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(str_tmp)
+
+
+def _release_key(str_key_path: str, str_job_id: str) -> None:
+    """
+    Remove a deduplication key if it still holds a job id. The key is first moved to a temporary name, so that a key
+    created meanwhile by another process for another job is put back instead of removed.
+    :param str_key_path: path of the key.
+    :param str_job_id: the job id.
+    :return:
+    """
+
+    str_tmp = tmp_path(str_key_path)
+    try:
+        os.rename(str_key_path, str_tmp)
+    except FileNotFoundError:
+        return
+
+    with open(str_tmp, 'r') as fp:
+        str_held = fp.read()
+    if str_held != str_job_id:
+        try:
+            os.link(str_tmp, str_key_path)
+        except FileExistsError:
+            pass
+    os.remove(str_tmp)
+
+    return
+
+
+def _init_worker() -> None:
+    """
+    Initializer of the process pool: each worker sets the environment and the logger once.
+    :return:
+    """
+
+    set_env()
+    set_logger(level='INFO')
+
+    return
+
+
+def report_progress(progress: float, str_message: str) -> None:
+    """
+    Progress checkpoint of the running job: publish its progress, and stop it if its cancellation was requested.
+    Outside a job it does nothing, so long functions can call it anyway.
+    :param progress: fraction of the job done, from 0 to 1.
+    :param str_message: current step of the job.
+    :return:
+    """
+
+    str_job_id = _dct_worker.get('JOB_ID')
+    if str_job_id is None:
+        return
+
+    if os.path.exists(_job_path(str_job_id) + '.cancel'):
+        raise JobCancelledError(f'JOB {str_job_id} CANCELLED')
+
+    write_json({'PROGRESS': round(float(progress), 4), 'MESSAGE': str_message}, _job_path(str_job_id) + '.progress')
+
+    return
+
+
+def _run_job(str_job_id: str, fun_job: Callable, dct_kwargs: dict):
+    """
+    Execute a job inside a worker of the process pool.
+    :param str_job_id: the job id.
+    :param fun_job: function of the job, defined at module level.
+    :param dct_kwargs: arguments of the function.
+    :return: the result of the function.
+    """
+
+    _dct_worker['JOB_ID'] = str_job_id
+    try:
+        report_progress(0.0, 'STARTED')
+        return fun_job(**dct_kwargs)
+    finally:
+        _dct_worker.pop('JOB_ID', None)
+
+
+def _is_alive(pid: int) -> bool:
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def job_status(str_job_id: str) -> dict:
+    """
+    Status of a job, submitted by any process of the API: PENDING, RUNNING, DONE, FAILED, CANCELLED, or LOST when the
+    process which submitted it ended before the job did.
+    :param str_job_id: the job id.
+    :return: the record of the job, with its progress and, when DONE, its result.
+    """
+
+    try:
+        with open(_job_path(str_job_id) + '.json', 'r') as fp:
+            dct_job = json.load(fp)
+    except FileNotFoundError:
+        raise KeyError(f'JOB {str_job_id} NOT FOUND')
+
+    if dct_job['STATUS'] in LST_IN_FLIGHT:
+        try:
+            with open(_job_path(str_job_id) + '.progress', 'r') as fp:
+                dct_job.update(STATUS='RUNNING', **json.load(fp))
+        except FileNotFoundError:
+            pass
+        dct_job['CANCEL_REQUESTED'] = os.path.exists(_job_path(str_job_id) + '.cancel')
+        if not _is_alive(dct_job['OWNER']):
+            dct_job['STATUS'] = 'LOST'
+
+    return dct_job
+
+
+class JobEngine:
+    """
+    Jobs of an API process, run in a pool of max_workers processes. Job records are files of PATH_OUT_JOBS, so that
+    status, progress, result and cancellation are available from any process of the API (e.g. any gunicorn worker).
+    A job identical to one still in flight (same function and arguments) is not submitted again: its id is returned.
+    Pending jobs are cancelled at once, running ones at their next progress checkpoint.
+    """
+
+    def __init__(self, max_workers: int, max_finished: int = 100):
+        self.max_finished = max_finished
+        # spawned workers: forking a process running the event loop and its threads is not safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker
+        )
+        self._dct_future = {}
+        self._lock = threading.RLock()
+
+    def _in_flight(self, str_key_path: str) -> str:
+        """
+        Id of the in-flight job holding a deduplication key, if any. A key left by a job no longer in flight is removed.
+        The record of a job is written before its key: a key whose record is missing is left by a job never completed.
+        :param str_key_path: path of the key.
+        :return: the job id, or None.
+        """
+
+        try:
+            with open(str_key_path, 'r') as fp:
+                str_job_id = fp.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            if job_status(str_job_id)['STATUS'] in LST_IN_FLIGHT:
+                return str_job_id
+        except KeyError:
+            pass
+
+        _release_key(str_key_path, str_job_id)
+
+        return None
+
+    def submit(self, str_name: str, fun_job: Callable, dct_kwargs: dict) -> str:
+        """
+        Submit a job, unless an identical one is in flight.
+        :param str_name: name of the job.
+        :param fun_job: function of the job, defined at module level. Its result must be json serializable.
+        :param dct_kwargs: json serializable arguments of the function.
+        :return: the job id.
+        """
+
+        str_key = hash_content(str_name, fun_job.__module__, fun_job.__qualname__, dct_kwargs)
+        str_key_path = os.environ['PATH_OUT_JOBS'] + f'KEYS/{str_key}'
+        os.makedirs(os.path.dirname(str_key_path), exist_ok=True)
+
+        with self._lock:
+            str_job_id = self._in_flight(str_key_path)
+            if str_job_id is not None:
+                logging.info(f'JOB {str_name} ALREADY IN FLIGHT: {str_job_id}')
+                return str_job_id
+
+            # the record is written before the key, so that a process reading the key always finds the record
+            str_job_id = f'{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}'
+            write_json(
+                {
+                    'JOB_ID': str_job_id,
+                    'NAME': str_name,
+                    'PARAMS': dct_kwargs,
+                    'STATUS': 'PENDING',
+                    'SUBMITTED': datetime.now().isoformat(timespec='seconds'),
+                    'OWNER': os.getpid(),
+                    'KEY': str_key,
+                },
+                _job_path(str_job_id) + '.json',
+            )
+
+            # the key is created only if missing, so that two processes never hold it at once
+            if not _acquire_key(str_key_path, str_job_id):
+                _remove(_job_path(str_job_id) + '.json')
+                return self._in_flight(str_key_path) or self.submit(str_name, fun_job, dct_kwargs)
+
+            future = self._executor.submit(_run_job, str_job_id, fun_job, dct_kwargs)
+            self._dct_future[str_job_id] = future
+            future.add_done_callback(partial(self._finish, str_job_id))
+
+        logging.info(f'JOB {str_name} SUBMITTED: {str_job_id}')
+        self._prune()
+
+        return str_job_id
+
+    def _finish(self, str_job_id: str, future) -> None:
+        """
+        Store the outcome of a job and release its deduplication key. Called by the pool when the job ends.
+        :param str_job_id: the job id.
+        :param future: the future of the job.
+        :return:
+        """
+
+        with self._lock:
+            dct_job = job_status(str_job_id)
+
+            exc = None if future.cancelled() else future.exception()
+            if future.cancelled() or isinstance(exc, JobCancelledError):
+                dct_job['STATUS'] = 'CANCELLED'
+            elif exc is not None:
+                dct_job.update(STATUS='FAILED', ERROR=f'{type(exc).__name__}: {exc}')
+            else:
+                dct_job.update(STATUS='DONE', PROGRESS=1.0, MESSAGE='DONE', RESULT=future.result())
+            dct_job['FINISHED'] = datetime.now().isoformat(timespec='seconds')
+            dct_job.pop('CANCEL_REQUESTED', None)
+
+            try:
+                write_json(dct_job, _job_path(str_job_id) + '.json')
+            except TypeError as e:
+                dct_job.update(STATUS='FAILED', ERROR=f'RESULT NOT JSON SERIALIZABLE: {e}')
+                dct_job.pop('RESULT')
+                write_json(dct_job, _job_path(str_job_id) + '.json')
+
+            _release_key(os.environ['PATH_OUT_JOBS'] + f'KEYS/{dct_job["KEY"]}', str_job_id)
+            _remove(_job_path(str_job_id) + '.progress')
+            _remove(_job_path(str_job_id) + '.cancel')
+            self._dct_future.pop(str_job_id, None)
+
+        logging.info(f'JOB {str_job_id}: {dct_job["STATUS"]}')
+
+        return
+
+    def cancel(self, str_job_id: str) -> dict:
+        """
+        Request the cancellation of a job, submitted by any process of the API.
+        :param str_job_id: the job id.
+        :return: the status of the job.
+        """
+
+        dct_job = job_status(str_job_id)
+        if dct_job['STATUS'] not in LST_IN_FLIGHT:
+            return dct_job
+
+        # read by the job at its next progress checkpoint, in whatever process it runs
+        open(_job_path(str_job_id) + '.cancel', 'w').close()
+        with self._lock:
+            future = self._dct_future.get(str_job_id)
+        if future is not None:
+            future.cancel()
+
+        return job_status(str_job_id)
+
+    def _prune(self) -> None:
+        """
+        Remove the records of the finished jobs beyond the max_finished most recent ones.
+        :return:
+        """
+
+        lst_finished = []
+        for str_file in os.listdir(os.environ['PATH_OUT_JOBS']):
+            if str_file.endswith('.json'):
+                try:
+                    dct_job = job_status(str_file[:-len('.json')])
+                except (KeyError, ValueError):
+                    continue
+                if 'FINISHED' in dct_job:
+                    lst_finished.append((dct_job['FINISHED'], dct_job['JOB_ID']))
+
+        for _, str_job_id in sorted(lst_finished, reverse=True)[self.max_finished:]:
+            _remove(_job_path(str_job_id) + '.json')
+
+        return
+
+    def shutdown(self) -> None:
+        """
+        Cancel the pending jobs and wait for the running ones.
+        :return:
+        """
+
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+        return
+
+
+def get_job_engine() -> JobEngine:
+    """
+    Job engine of the process, created at the first call with the settings of param_api.yaml.
+    :return: the job engine.
+    """
+
+    global _engine
+    if _engine is None:
+        with open('config/param_api.yaml') as f:
+            dct_param_jobs = yaml.safe_load(f)['JOBS']
+        os.makedirs(os.environ['PATH_OUT_JOBS'], exist_ok=True)
+        _engine = JobEngine(max_workers=dct_param_jobs['MAX_WORKERS'], max_finished=dct_param_jobs['MAX_FINISHED'])
+
+    return _engine
+
+
+def shutdown_job_engine() -> None:
+
+    global _engine
+    if _engine is not None:
+        _engine.shutdown()
+        _engine = None
+
+    return
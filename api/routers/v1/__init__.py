@@ -3,6 +3,7 @@ from . import endpoints_model
 from . import endpoints_shap
 from . import endpoints_lime
 from . import endpoints_safe
+from . import endpoints_jobs
 
 
 def _build_router() -> APIRouter:
@@ -13,6 +14,7 @@ def _build_router() -> APIRouter:
     rt.include_router(endpoints_lime.router, prefix="/LIME")
     rt.include_router(endpoints_shap.router, prefix="/SHAP")
     rt.include_router(endpoints_safe.router, prefix="/SAFE")
+    rt.include_router(endpoints_jobs.router, prefix="/jobs")
     return rt
 
 
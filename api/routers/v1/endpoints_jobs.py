@@ -0,0 +1,88 @@
+from fastapi.routing import APIRouter
+from fastapi.responses import JSONResponse
+from fastapi import HTTPException
+
+from api.jobs import get_job_engine, job_status
+from setting.environment import set_env
+
+
+router = APIRouter(default_response_class=JSONResponse)
+
+
+def _get_status(job_id: str) -> dict:
+
+    set_env()
+
+    try:
+        return job_status(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f'Job {job_id} not found')
+
+
+@router.get(
+    path='/{job_id}/status',
+    summary=' ',
+    description='Status of a job: PENDING, RUNNING, DONE, FAILED, CANCELLED, or LOST when the API process running it '
+                'stopped. The result is included once the job is DONE, the error once it FAILED.',
+    tags=['Jobs']
+)
+async def jobs_status(
+        job_id: str
+):
+
+    return _get_status(job_id)
+
+
+@router.get(
+    path='/{job_id}/progress',
+    summary=' ',
+    description='Progress of a job, from 0 to 1, and its current step.',
+    tags=['Jobs']
+)
+async def jobs_progress(
+        job_id: str
+):
+
+    dct_job = _get_status(job_id)
+
+    return {
+        'JOB_ID': job_id,
+        'STATUS': dct_job['STATUS'],
+        'PROGRESS': dct_job.get('PROGRESS', 0.0),
+        'MESSAGE': dct_job.get('MESSAGE'),
+    }
+
+
+@router.get(
+    path='/{job_id}/result',
+    summary=' ',
+    description='Result of a job. Available only once the job is DONE.',
+    tags=['Jobs']
+)
+async def jobs_result(
+        job_id: str
+):
+
+    dct_job = _get_status(job_id)
+    if dct_job['STATUS'] != 'DONE':
+        dct_adv = {'MESSAGE': 'Job not done', 'STATUS': dct_job['STATUS'], 'ERROR': dct_job.get('ERROR')}
+        raise HTTPException(status_code=409, detail=dct_adv)
+
+    return dct_job['RESULT']
+
+
+@router.post(
+    path='/{job_id}/cancel',
+    summary=' ',
+    description='Cancel a job: a pending job is cancelled at once, a running one at its next progress checkpoint. A '
+                'training checks it between two batches of the hyperparameter search (CHECKPOINTS in param_cv.yaml), '
+                'two steps of the out-of-bag growth, and before the fit and the evaluation of the best model.',
+    tags=['Jobs']
+)
+async def jobs_cancel(
+        job_id: str
+):
+
+    _get_status(job_id)
+
+    return get_job_engine().cancel(job_id)
@@ -1,7 +1,6 @@
 import dill
 import lime
 import lime.lime_tabular
-import pandas as pd
 import os
 
 from fastapi import HTTPException
@@ -9,6 +8,10 @@ from fastapi.routing import APIRouter
 from fastapi.responses import JSONResponse
 # from fastapi import Query
 
+from api.artifact_cache import get_artifact_cache
+from api.jobs import get_job_engine, job_status, report_progress
+from core.pipelines.artifact_store import load_artifact, load_manifest, run_path
+from core.utils.files import tmp_path
 from setting.environment import set_env
 from setting.logger import set_logger
 from core.xai.xai_lime import xai_lime_local, xai_lime_global
@@ -16,21 +19,40 @@ from core.xai.xai_lime import xai_lime_local, xai_lime_global
 router = APIRouter(default_response_class=JSONResponse)
 
 
+def _lime_path(str_run_id: str) -> str:
+    """
+    Path of the LIME explainer of a run, inside the run folder: explainers are never shared between runs.
+    :param str_run_id: the run id.
+    :return: the path of the file.
+    """
+
+    return run_path(str_run_id) + 'LIME/lime_explainer.pickle'
+
+
+def _load_dill(str_path: str):
+    with open(str_path, 'rb') as b:
+        return dill.load(b)
+
+
 @router.get(
     path='/build',
     summary=' ',
     description='',
     tags=['LIME']
 )
-async def lime_build():
+async def lime_build(
+    run_id: str = None
+):
 
     set_env()
     set_logger(level='INFO')
 
-    # load data
+    # load data of the run, the latest one by default, from the cache of the process
     try:
-        # X_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_train.pickle')
-        X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
+        cache = get_artifact_cache()
+        dct_manifest = cache.manifest(run_id)
+        # X_train = cache.artifact(dct_manifest, 'X_train')
+        X_test = cache.artifact(dct_manifest, 'X_test')
     except Exception:
         raise HTTPException(status_code=404, detail=f'Files not found')
 
@@ -43,37 +65,64 @@ async def lime_build():
         mode='classification'
     )
 
-    os.makedirs(os.environ['PATH_OUT_LIME'], exist_ok=True)
-    with open(os.environ['PATH_OUT_LIME'] + 'lime_explainer.pickle', 'wb') as f:
+    str_path = _lime_path(dct_manifest['RUN_ID'])
+    os.makedirs(os.path.dirname(str_path), exist_ok=True)
+    # written to a temporary name and then renamed, so that a partial write is never read
+    str_tmp = tmp_path(str_path)
+    with open(str_tmp, 'wb') as f:
         dill.dump(lime_explainer, f)
+    os.replace(str_tmp, str_path)
 
     return {"message": "Task completed"}
 
 
+def lime_global_job(run_id: str) -> dict:
+    """
+    Global LIME explanation (SP-LIME) of a run, as a background job.
+    :param run_id: the run id.
+    :return: dictionary with the run id.
+    """
+
+    # loaded directly, memory mapped: the job runs in a worker process, which does not share the cache of the API
+    dct_manifest = load_manifest(run_id)
+    lime_explainer = _load_dill(_lime_path(dct_manifest['RUN_ID']))
+    model = load_artifact(dct_manifest, 'model')
+    # X_train = load_artifact(dct_manifest, 'X_train')
+    X_test = load_artifact(dct_manifest, 'X_test')
+
+    report_progress(0.1, 'SP-LIME')
+    xai_lime_global(lime_explainer=lime_explainer, X_test=X_test, model=model)
+
+    return {'RUN_ID': dct_manifest['RUN_ID']}
+
+
 @router.get(
     path='/global',
     summary=' ',
-    description='',
+    description='Submit a background job building the global LIME explanation of a run (the latest one by default). '
+                'Its id is returned: follow it with the /jobs APIs.',
     tags=['LIME']
 )
-async def lime_global():
+async def lime_global(
+    run_id: str = None
+):
 
     set_env()
     set_logger(level='INFO')
 
-    # load data
+    # the run is resolved now: the job explains the latest run at the time of the request
     try:
-        with open(os.environ['PATH_OUT_LIME'] + 'lime_explainer.pickle', 'rb') as b:
-            lime_explainer = dill.load(b)
-        model = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'model.pickle')
-        # X_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_train.pickle')
-        X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
+        dct_manifest = get_artifact_cache().manifest(run_id)
+        if not os.path.exists(_lime_path(dct_manifest['RUN_ID'])):
+            raise FileNotFoundError
     except Exception:
         raise HTTPException(status_code=404, detail=f'Files not found')
 
-    xai_lime_global(lime_explainer=lime_explainer, X_test=X_test, model=model)
+    str_job_id = get_job_engine().submit(
+        str_name='LIME_GLOBAL', fun_job=lime_global_job, dct_kwargs={'run_id': dct_manifest['RUN_ID']}
+    )
 
-    return {"message": "Task completed"}
+    return {"message": "Job submitted", "Job ID": str_job_id, "Status": job_status(str_job_id)['STATUS']}
 
 
 @router.get(
@@ -83,20 +132,22 @@ async def lime_global():
     tags=['LIME']
 )
 async def lime_local(
-    cust_id: int
+    cust_id: int,
+    run_id: str = None
 ):
 
     set_env()
     set_logger(level='INFO')
 
-    # load data
+    # load data of the run, the latest one by default, from the cache of the process
     try:
-        with open(os.environ['PATH_OUT_LIME'] + 'lime_explainer.pickle', 'rb') as b:
-            lime_explainer = dill.load(b)
-        model = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'model.pickle')
-        # X_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_train.pickle')
-        X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
-        test_set = pd.read_csv(os.environ['PATH_OUT_MOD'] + 'test_set.csv', sep=';')
+        cache = get_artifact_cache()
+        dct_manifest = cache.manifest(run_id)
+        lime_explainer = cache.file(_lime_path(dct_manifest['RUN_ID']), _load_dill)
+        model = cache.artifact(dct_manifest, 'model')
+        # X_train = cache.artifact(dct_manifest, 'X_train')
+        X_test = cache.artifact(dct_manifest, 'X_test')
+        test_set = cache.artifact(dct_manifest, 'test_set')
     except Exception:
         raise HTTPException(status_code=404, detail=f'Files not found')
 
@@ -105,8 +156,8 @@ async def lime_local(
     except Exception:
         dct_adv = {
             'MESSAGE': f'Customer with ID={cust_id} not in test dataset. You can try one of the following ones:',
-            'CHURNING': test_set.loc[test_set['MODEL_PRED'] == 1, 'CLIENTNUM'].tolist()[:5],
-            'NOT CHURNING': test_set.loc[test_set['MODEL_PRED'] == 0, 'CLIENTNUM'].tolist()[:5],
+            'CHURNING': test_set.index[test_set['MODEL_PRED'] == 1].tolist()[:5],
+            'NOT CHURNING': test_set.index[test_set['MODEL_PRED'] == 0].tolist()[:5],
         }
         raise HTTPException(status_code=404, detail=dct_adv)
 
@@ -5,6 +5,7 @@ from fastapi.routing import APIRouter
 from fastapi.responses import JSONResponse
 from fastapi import Query
 
+from api.jobs import get_job_engine, job_status, report_progress
 from core.routines.run_all import execute_main
 from setting.environment import set_env
 from setting.logger import set_logger
@@ -12,6 +13,26 @@ from setting.logger import set_logger
 router = APIRouter(default_response_class=JSONResponse)
 
 
+def training_job(split_strategy: str, bln_scale: bool, random_state: int) -> dict:
+    """
+    Training run as a background job.
+    :param split_strategy: how to split the dataset in train and test set.
+    :param bln_scale: if True, train and test set are scaled with normal scaling approach.
+    :param random_state: seed to be set for reproducibility
+    :return: dictionary with the run id and the model parameters.
+    """
+
+    os.makedirs(os.environ['PATH_OUT_MOD'], exist_ok=True)
+
+    return execute_main(
+        str_source='CHURN',
+        split_strategy=split_strategy,
+        bln_scale=bln_scale,
+        random_state=random_state,
+        fun_progress=report_progress,
+    )
+
+
 @router.get(
     path='/training',
     summary=' ',
@@ -20,38 +41,40 @@ router = APIRouter(default_response_class=JSONResponse)
                 '</br>'
                 '`Parameters` </br>'
                 '<ul>'
-                '<li><b>split_strategy:</b> whether to use oversampling or not in the train/test split. </li>'
+                '<li><b>split_strategy:</b> whether to use oversampling or not in the train/test split. With '
+                'OVERSAMPLING_IN_FOLD the oversampling is done inside each fold of the cross validation. </li>'
                 '<li><b>bln_scale:</b> if True, data are scaled with normal scaling approach. </li>'
                 '</ul>'
                 '`Output` </br>'
                 '</br>'
-                'Return a .csv including, for each item of the test set, its features, the actual target and the '
-                'predicted target.',
+                'Submit a background job, whose id is returned: follow it with the /jobs APIs. The job stores a new '
+                'run, with its own id, including the model, train and test sets, and a .csv with, for each item of '
+                'the test set, its features, the actual target and the predicted target. The result of the job is '
+                'the id of the run, to explain that model with the other APIs.',
     tags=['Model']
 )
 async def api_model(
-        split_strategy: str = Query(enum=['OVERSAMPLING', None]),
+        split_strategy: str = Query(enum=['OVERSAMPLING', 'OVERSAMPLING_IN_FOLD', None]),
         bln_scale: bool = Query(enum=[False, True]),
         random_state: int = None
 ):
     """
     Loading data, preparing data and running the classification model
-    :param split_strategy: how to split the dataset in train and test set. Allowed values are None and OVERSAMPLING.
+    :param split_strategy: how to split the dataset in train and test set. Allowed values are None, OVERSAMPLING and
+        OVERSAMPLING_IN_FOLD.
     :param bln_scale: if True, train and test set are scaled with normal scaling approach.
     :param random_state: seed to be set for reproducibility
-    :return: dictionary with the model parameters and the test dataframe with its predictions.
+    :return: id and status of the training job.
     """
 
     set_env()
     set_logger(level='INFO')
 
-    os.makedirs(os.environ['PATH_OUT_MOD'], exist_ok=True)
-
-    model_params = execute_main(
-        str_source='CHURN',
-        split_strategy=split_strategy,
-        bln_scale=bln_scale,
-        random_state=random_state,
+    # the training runs out of the event loop: the API keeps answering in the meantime
+    str_job_id = get_job_engine().submit(
+        str_name='TRAINING',
+        fun_job=training_job,
+        dct_kwargs={'split_strategy': split_strategy, 'bln_scale': bln_scale, 'random_state': random_state},
     )
 
-    return {"message": "Task completed", "Best Model Params": model_params}
+    return {"message": "Job submitted", "Job ID": str_job_id, "Status": job_status(str_job_id)['STATUS']}
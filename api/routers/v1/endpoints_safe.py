@@ -1,5 +1,3 @@
-import json
-import pandas as pd
 import os
 
 from fastapi.routing import APIRouter
@@ -8,6 +6,9 @@ from fastapi import HTTPException
 # from fastapi import Query
 # from fastapi import status, BackgroundTasks
 
+from api.artifact_cache import get_artifact_cache
+from api.jobs import get_job_engine, job_status, report_progress
+from core.pipelines.artifact_store import load_artifact, load_manifest
 from core.xai.xai_safe import xai_safe_global, xai_safe_local
 from setting.environment import set_env
 from setting.logger import set_logger
@@ -16,39 +17,60 @@ from setting.logger import set_logger
 router = APIRouter(default_response_class=JSONResponse)
 
 
+def safe_global_job(run_id: str) -> dict:
+    """
+    Global SAFE explanation of a run, as a background job.
+    :param run_id: the run id.
+    :return: dictionary with the run id.
+    """
+
+    os.makedirs(os.environ['PATH_OUT_SAFE'], exist_ok=True)
+
+    # loaded directly, memory mapped: the job runs in a worker process, which does not share the cache of the API
+    dct_manifest = load_manifest(run_id)
+    model_params = dct_manifest['INFO']['MODEL_PARAMS']
+    X_train = load_artifact(dct_manifest, 'X_train')
+    X_test = load_artifact(dct_manifest, 'X_test')
+    y_train = load_artifact(dct_manifest, 'y_train')
+    y_test = load_artifact(dct_manifest, 'y_test')
+
+    report_progress(0.1, 'RGE')
+    xai_safe_global(
+        X_train=X_train,
+        X_test=X_test,
+        y_train=y_train,
+        y_test=y_test,
+        model_params=model_params,
+    )
+
+    return {'RUN_ID': dct_manifest['RUN_ID']}
+
+
 @router.get(
     path='/global',
     summary=' ',
-    description='',
+    description='Submit a background job building the global SAFE explanation of a run (the latest one by default). '
+                'Its id is returned: follow it with the /jobs APIs.',
     tags=['SAFE']
 )
-async def safe_global():
+async def safe_global(
+    run_id: str = None
+):
 
     set_env()
     set_logger(level='INFO')
-    os.makedirs(os.environ['PATH_OUT_SAFE'], exist_ok=True)
 
-    # load data
+    # the run is resolved now: the job explains the latest run at the time of the request
     try:
-        with open(os.environ['PATH_OUT_MOD'] + 'model_params.json', 'r') as fp:
-            model_params = json.load(fp)
-        X_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_train.pickle')
-        X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
-        y_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'y_train.pickle')
-        y_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'y_test.pickle')
-
+        dct_manifest = get_artifact_cache().manifest(run_id)
     except Exception:
         raise HTTPException(status_code=404, detail=f'Files not found')
 
-    xai_safe_global(
-        X_train=X_train,
-        X_test=X_test,
-        y_train=y_train,
-        y_test=y_test,
-        model_params=model_params,
+    str_job_id = get_job_engine().submit(
+        str_name='SAFE_GLOBAL', fun_job=safe_global_job, dct_kwargs={'run_id': dct_manifest['RUN_ID']}
     )
 
-    return {"message": "Task completed"}
+    return {"message": "Job submitted", "Job ID": str_job_id, "Status": job_status(str_job_id)['STATUS']}
 
 
 @router.get(
@@ -58,30 +80,32 @@ async def safe_global():
     tags=['SAFE']
 )
 async def safe_local(
-    cust_id: int
+    cust_id: int,
+    run_id: str = None
 ):
 
     set_env()
     set_logger(level='INFO')
     os.makedirs(os.environ['PATH_OUT_SAFE'], exist_ok=True)
 
-    # load data
+    # load data of the run, the latest one by default, from the cache of the process
     try:
-        with open(os.environ['PATH_OUT_MOD'] + 'model_params.json', 'r') as fp:
-            model_params = json.load(fp)
-        X_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_train.pickle')
-        X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
-        y_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'y_train.pickle')
-        y_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'y_test.pickle')
-        test_set = pd.read_csv(os.environ['PATH_OUT_MOD'] + 'test_set.csv', sep=';')
+        cache = get_artifact_cache()
+        dct_manifest = cache.manifest(run_id)
+        model_params = dct_manifest['INFO']['MODEL_PARAMS']
+        X_train = cache.artifact(dct_manifest, 'X_train')
+        X_test = cache.artifact(dct_manifest, 'X_test')
+        y_train = cache.artifact(dct_manifest, 'y_train')
+        y_test = cache.artifact(dct_manifest, 'y_test')
+        test_set = cache.artifact(dct_manifest, 'test_set')
     except Exception:
         raise HTTPException(status_code=404, detail=f'Files not found')
 
     if cust_id not in X_test.index:
         dct_adv = {
             'MESSAGE': f'Customer with ID={cust_id} not in test dataset. You can try one of the following ones:',
-            'CHURNING': test_set.loc[test_set['MODEL_PRED'] == 1, 'CLIENTNUM'].tolist()[:5],
-            'NOT CHURNING': test_set.loc[test_set['MODEL_PRED'] == 0, 'CLIENTNUM'].tolist()[:5],
+            'CHURNING': test_set.index[test_set['MODEL_PRED'] == 1].tolist()[:5],
+            'NOT CHURNING': test_set.index[test_set['MODEL_PRED'] == 0].tolist()[:5],
         }
         raise HTTPException(status_code=404, detail=dct_adv)
 
@@ -9,6 +9,10 @@ from fastapi import HTTPException
 # from fastapi import Query
 # from fastapi import status, BackgroundTasks
 
+from api.artifact_cache import get_artifact_cache
+from api.jobs import get_job_engine, job_status, report_progress
+from core.pipelines.artifact_store import load_artifact, load_manifest, run_path
+from core.utils.files import tmp_path
 from core.xai.xai_shap import xai_shap_global
 from core.xai.xai_shap import xai_shap_local
 from setting.environment import set_env
@@ -18,24 +22,28 @@ from setting.logger import set_logger
 router = APIRouter(default_response_class=JSONResponse)
 
 
-@router.get(
-    path='/build',
-    summary=' ',
-    description='',
-    tags=['SHAP']
-)
-async def shap_build():
+def _shap_path(str_run_id: str) -> str:
+    """
+    Folder of the SHAP explanations of a run, inside the run folder: explanations are never shared between runs.
+    :param str_run_id: the run id.
+    :return: the path of the folder.
+    """
 
-    set_env()
-    set_logger(level='INFO')
+    return run_path(str_run_id) + 'SHAP/'
 
-    # load data
-    try:
-        model = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'model.pickle')
-        X_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_train.pickle')
-        X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
-    except Exception:
-        raise HTTPException(status_code=404, detail=f'Files not found')
+
+def shap_build_job(run_id: str) -> dict:
+    """
+    Build of the SHAP explanations of a run, as a background job.
+    :param run_id: the run id.
+    :return: dictionary with the run id.
+    """
+
+    # loaded directly, memory mapped: the job runs in a worker process, which does not share the cache of the API
+    dct_manifest = load_manifest(run_id)
+    model = load_artifact(dct_manifest, 'model')
+    X_train = load_artifact(dct_manifest, 'X_train')
+    X_test = load_artifact(dct_manifest, 'X_test')
 
     # Use the SHAP library to explain the model's predictions
     # WARNING: check_additivity
@@ -45,7 +53,9 @@ async def shap_build():
     # pickle (no problems of approximation). Need still to understand why.
     # This rounding problem does not happen when you use model.predict but the plot will refer to 0/1 target, not prob.
 
+    report_progress(0.1, 'EXPLAINER')
     explainer = shap.TreeExplainer(model, X_train, model_output='probability')
+    report_progress(0.2, 'SHAP VALUES')
     shap_values = explainer(X_test)
     explanations = shap.Explanation(
         shap_values.values[:, :, 1],
@@ -54,12 +64,44 @@ async def shap_build():
         feature_names=X_test.columns
     )
 
-    os.makedirs(os.environ['PATH_OUT_SHAP'], exist_ok=True)
-    pd.to_pickle(explainer, os.environ['PATH_OUT_SHAP'] + 'explainer.pickle')
-    pd.to_pickle(shap_values, os.environ['PATH_OUT_SHAP'] + 'shap_values.pickle')
-    pd.to_pickle(explanations, os.environ['PATH_OUT_SHAP'] + 'explanations.pickle')
+    report_progress(0.9, 'SAVE')
+    str_path_shap = _shap_path(dct_manifest['RUN_ID'])
+    os.makedirs(str_path_shap, exist_ok=True)
+    # files are written to a temporary name and then renamed, so that the local APIs never read a partial write
+    for str_name, obj in [('explainer', explainer), ('shap_values', shap_values), ('explanations', explanations)]:
+        str_path = str_path_shap + f'{str_name}.pickle'
+        str_tmp = tmp_path(str_path)
+        pd.to_pickle(obj, str_tmp)
+        os.replace(str_tmp, str_path)
 
-    return {"message": "Task completed"}
+    return {'RUN_ID': dct_manifest['RUN_ID']}
+
+
+@router.get(
+    path='/build',
+    summary=' ',
+    description='Submit a background job building the SHAP explanations of a run (the latest one by default). Its id '
+                'is returned: follow it with the /jobs APIs.',
+    tags=['SHAP']
+)
+async def shap_build(
+        run_id: str = None
+):
+
+    set_env()
+    set_logger(level='INFO')
+
+    # the run is resolved now: the job explains the latest run at the time of the request
+    try:
+        dct_manifest = get_artifact_cache().manifest(run_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail=f'Files not found')
+
+    str_job_id = get_job_engine().submit(
+        str_name='SHAP_BUILD', fun_job=shap_build_job, dct_kwargs={'run_id': dct_manifest['RUN_ID']}
+    )
+
+    return {"message": "Job submitted", "Job ID": str_job_id, "Status": job_status(str_job_id)['STATUS']}
 
 
 @router.get(
@@ -68,15 +110,19 @@ async def shap_build():
     description='',
     tags=['SHAP']
 )
-async def shap_global():
+async def shap_global(
+        run_id: str = None
+):
 
     set_env()
     set_logger(level='INFO')
 
-    # load data
+    # load data of the run, the latest one by default, from the cache of the process
     try:
-        explanations = pd.read_pickle(os.environ['PATH_OUT_SHAP'] + 'explanations.pickle')
-        X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
+        cache = get_artifact_cache()
+        dct_manifest = cache.manifest(run_id)
+        explanations = cache.file(_shap_path(dct_manifest['RUN_ID']) + 'explanations.pickle', pd.read_pickle)
+        X_test = cache.artifact(dct_manifest, 'X_test')
     except Exception:
         raise HTTPException(status_code=404, detail=f'Files not found')
 
@@ -92,17 +138,20 @@ async def shap_global():
     tags=['SHAP']
 )
 async def shap_local(
-        cust_id: int
+        cust_id: int,
+        run_id: str = None
 ):
 
     set_env()
     set_logger(level='INFO')
 
-    # load data
+    # load data of the run, the latest one by default, from the cache of the process
     try:
-        explanations = pd.read_pickle(os.environ['PATH_OUT_SHAP'] + 'explanations.pickle')
-        X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
-        test_set = pd.read_csv(os.environ['PATH_OUT_MOD'] + 'test_set.csv', sep=';')
+        cache = get_artifact_cache()
+        dct_manifest = cache.manifest(run_id)
+        explanations = cache.file(_shap_path(dct_manifest['RUN_ID']) + 'explanations.pickle', pd.read_pickle)
+        X_test = cache.artifact(dct_manifest, 'X_test')
+        test_set = cache.artifact(dct_manifest, 'test_set')
     except Exception:
         raise HTTPException(status_code=404, detail=f'Files not found')
 
@@ -111,8 +160,8 @@ async def shap_local(
     except Exception:
         dct_adv = {
             'MESSAGE': f'Customer with ID={cust_id} not in test dataset. You can try one of the following ones:',
-            'CHURNING': test_set.loc[test_set['MODEL_PRED'] == 1, 'CLIENTNUM'].tolist()[:5],
-            'NOT CHURNING': test_set.loc[test_set['MODEL_PRED'] == 0, 'CLIENTNUM'].tolist()[:5],
+            'CHURNING': test_set.index[test_set['MODEL_PRED'] == 1].tolist()[:5],
+            'NOT CHURNING': test_set.index[test_set['MODEL_PRED'] == 0].tolist()[:5],
         }
         raise HTTPException(status_code=404, detail=dct_adv)
 
@@ -1,109 +1,118 @@
 import logging
 import numpy as np
 import pandas as pd
-import seaborn as sns
 
-from matplotlib import pyplot as plt
+from core.data.etl_preparation import DataPreparation, clean_categories
 
 # from core.data.etl_utils import category_corr
 
 
-def data_preparation_churn(dtf_load: pd.DataFrame) -> pd.DataFrame:
+class DataPreparationChurn(DataPreparation):
+    """
+    Data preparation for the CHURN dataset.
+    """
+
+    # numeric features too correlated with other ones are dropped (see the correlation matrix)
+    CORR_THRESHOLD = 0.75
+    # rows with missing values (UNKNOWN entries included) are dropped
+    DROPNA = True
+
+    def clean(self, dtf_load: pd.DataFrame) -> pd.DataFrame:
+
+        dtf_work = dtf_load.copy()
+
+        # rename columns
+        dtf_work.columns = [c.strip().upper() for c in dtf_work]
+        dtf_work.rename({'ATTRITION_FLAG': 'TARGET'}, axis=1, inplace=True)
+
+        # creating TARGET variable, when available
+        if 'TARGET' in dtf_work:
+            dtf_work['TARGET'] = np.where(dtf_work['TARGET'] == 'Attrited Customer', 1, 0)
+
+        # set index
+        dtf_work.set_index('CLIENTNUM', inplace=True)
+
+        # columns to drop in the analysis:
+        # GENDER: we want to avoid unfair scenarios
+        # NAIVE_BAYES_CLASSIFIER ... : columns dropped as suggested by the author of the dataset.
+        lst_drop = [
+            # 'GENDER',
+            'NAIVE_BAYES_CLASSIFIER_ATTRITION_FLAG_CARD_CATEGORY_CONTACTS_COUNT_12_MON_DEPENDENT_COUNT_EDUCATION_LEVEL_MONTHS_INACTIVE_12_MON_1',
+            'NAIVE_BAYES_CLASSIFIER_ATTRITION_FLAG_CARD_CATEGORY_CONTACTS_COUNT_12_MON_DEPENDENT_COUNT_EDUCATION_LEVEL_MONTHS_INACTIVE_12_MON_2',
+        ]
+        dtf_work.drop(lst_drop, axis=1, inplace=True, errors='ignore')
+
+        # ENCODING
+        dtf_work['EDUCATION_LEVEL'] = dtf_work['EDUCATION_LEVEL'].map({
+            'Uneducated': 0,
+            'Unknown': np.nan,
+            'High School': 1,
+            'College': 2,
+            'Graduate': 3,
+            'Post-Graduate': 4,
+            'Doctorate': 5,
+        }).astype(float)
+
+        dtf_work['INCOME_CATEGORY'] = dtf_work['INCOME_CATEGORY'].map({
+            'Unknown': np.nan,
+            'Less than $40K': 1,
+            '$40K - $60K': 2,
+            '$60K - $80K': 3,
+            '$80K - $120K': 4,
+            '$120K +': 5,
+        }).astype(float)
+
+        # FORMATTING CATEGORICAL ENTRIES.
+        # NAN values for categorical variables are labeled as UNKNOWN.
+        for c in dtf_work.select_dtypes(include=['object', 'category']).columns:
+            dtf_work[c] = clean_categories(
+                dtf_work[c],
+                lambda ser: ser.str.strip('.').str.upper().mask(lambda x: x == 'UNKNOWN'),
+            )
+
+        return dtf_work
+
+    def select_columns(self, dtf_full: pd.DataFrame) -> list:
+
+        # First resulting column of each categorical feature dropped after the encoding.
+        lst_first = []
+        for k, lst_val in self.vocabulary_.items():
+            logging.debug(f'{k} - DROPPED {lst_val[0]}')
+            lst_first.append(f'{k}_{lst_val[0]}')
+
+        return [c for c in dtf_full if c not in lst_first]
+
+
+def data_preparation_churn(dtf_load: pd.DataFrame, preparation: DataPreparationChurn = None) -> pd.DataFrame:
     """
         Data preparation for the CHURN dataset.
         :param dtf_load: the input dataset to prepare.
+        :param preparation: the preparation to apply. If not fitted yet, it is fit on dtf_load.
         :return: the parsed dataframe.
     """
 
-    dtf_work = dtf_load.copy()
-
-    # rename columns
-    dtf_work.columns = [c.strip().upper() for c in dtf_work]
-    dtf_work.rename({'ATTRITION_FLAG': 'TARGET'}, axis=1, inplace=True)
-
-    # creating TARGET variable
-    dtf_work['TARGET'] = np.where(dtf_work['TARGET'] == 'Attrited Customer', 1, 0)
-
-    # set index
-    dtf_work.set_index('CLIENTNUM', inplace=True)
-
-    # columns to drop in the analysis:
-    # GENDER: we want to avoid unfair scenarios
-    # NAIVE_BAYES_CLASSIFIER ... : columns dropped as suggested by the author of the dataset.
-    lst_drop = [
-        # 'GENDER',
-        'NAIVE_BAYES_CLASSIFIER_ATTRITION_FLAG_CARD_CATEGORY_CONTACTS_COUNT_12_MON_DEPENDENT_COUNT_EDUCATION_LEVEL_MONTHS_INACTIVE_12_MON_1',
-        'NAIVE_BAYES_CLASSIFIER_ATTRITION_FLAG_CARD_CATEGORY_CONTACTS_COUNT_12_MON_DEPENDENT_COUNT_EDUCATION_LEVEL_MONTHS_INACTIVE_12_MON_2',
-    ]
-    dtf_work.drop(lst_drop, axis=1, inplace=True)
-
-    # ENCODING
-    dtf_work['EDUCATION_LEVEL'] = dtf_work['EDUCATION_LEVEL'].map({
-        'Uneducated': 0,
-        'Unknown': np.nan,
-        'High School': 1,
-        'College': 2,
-        'Graduate': 3,
-        'Post-Graduate': 4,
-        'Doctorate': 5,
-    })
-
-    dtf_work['INCOME_CATEGORY'] = dtf_work['INCOME_CATEGORY'].map({
-        'Unknown': np.nan,
-        'Less than $40K': 1,
-        '$40K - $60K': 2,
-        '$60K - $80K': 3,
-        '$80K - $120K': 4,
-        '$120K +': 5,
-    })
-
-    # FORMATTING CATEGORICAL ENTRIES.
-    # NAN values for categorical variables are labeled as UNKNOWN.
-    dct_cat = {}
-    lst_cat = dtf_work.select_dtypes(include='object').columns.tolist()
-
-    # CORRELATION study
-    # dtf_cra = category_corr(dtf_in=dtf_work)
-    dtf_corr = dtf_work[[c for c in dtf_work if (c not in lst_cat) and (c != 'TARGET')]].corr()
-    fig, ax = plt.subplots(figsize=(20, 8))
-    sns.heatmap(dtf_corr, annot=True)
-    plt.xticks(rotation=40, ha='right', rotation_mode='anchor')
-    fig.subplots_adjust(bottom=0.2, right=1)
-    # TODO: fix this path
-    plt.savefig('C:/Users/NMOMBELLI/Desktop/SFDS/CHURN/DATA/CORRELATION_MATRIX.png')
-    plt.close()
-
-    # dropping columns too correlated
-    dtf_work.drop(['AVG_OPEN_TO_BUY', 'TOTAL_TRANS_CT', 'CUSTOMER_AGE'], axis=1, inplace=True)
-
-    for c in lst_cat:
-        dtf_work[c] = dtf_work[c].str.strip('.')
-        dtf_work[c] = dtf_work[c].str.upper()
-        dtf_work.loc[dtf_work[c] == 'UNKNOWN', c] = np.nan
-        dct_cat[c] = set(dtf_work[c]) - {np.nan}
-
-    # NAN evaluation
-    dtf_work.dropna(axis=0, how='any', inplace=True)
-
-    # Casting to dummy variables. First resulting column dropped after the encoding.
-    dtf_work = pd.get_dummies(
-        data=dtf_work,
-        prefix=None,
-        prefix_sep='_',
-        dummy_na=False,
-        columns=lst_cat,
-        sparse=False,
-        drop_first=True,
-        dtype='int'
-    )
-
-    # printing the name of the columns dropped with the encoding
-    for k, lst_val in dct_cat.items():
-        for val in lst_val:
-            if all(val not in c for c in dtf_work):
-                logging.debug(f'{k} - DROPPED {val}')
-
-    # sorting columns
-    dtf_work = dtf_work[sorted(dtf_work.columns)].copy()
-
-    return dtf_work
+    if preparation is None:
+        preparation = DataPreparationChurn()
+
+    dtf_clean = preparation.clean(dtf_load)
+
+    if not preparation.is_fitted():
+
+        preparation.fit_clean(dtf_clean)
+
+        # plotting libraries are imported here, so that preparing data to score does not load them
+        import seaborn as sns
+        from matplotlib import pyplot as plt
+
+        # CORRELATION study
+        # dtf_cra = category_corr(dtf_in=dtf_clean)
+        dtf_corr = preparation.corr_.drop(index='TARGET', columns='TARGET', errors='ignore')
+        fig, ax = plt.subplots(figsize=(20, 8))
+        sns.heatmap(dtf_corr, annot=True)
+        plt.xticks(rotation=40, ha='right', rotation_mode='anchor')
+        fig.subplots_adjust(bottom=0.2, right=1)
+        # TODO: fix this path
+        plt.savefig('C:/Users/NMOMBELLI/Desktop/SFDS/CHURN/DATA/CORRELATION_MATRIX.png')
+        plt.close()
+
+    return preparation.transform_clean(dtf_clean)
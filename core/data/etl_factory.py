@@ -1,5 +1,56 @@
-from core.data.etl_churn import data_preparation_churn
-from core.data.etl_hr import data_preparation_hr
+import importlib
+import os
+import pandas as pd
+import yaml
+
+from importlib.metadata import entry_points
+from typing import Callable, Iterable, Iterator
+
+from core.data.etl_preparation import DataPreparation
+
+
+# entry point group where installed packages can declare new sources
+ENTRY_POINT_GROUP = 'sfds.preparation'
+
+# sources shipped with the repo, used when not declared in ingestion.yaml
+_DCT_BUILTIN = {
+    'HR': {'MODULE': 'core.data.etl_hr', 'FUNCTION': 'data_preparation_hr', 'CLASS': 'DataPreparationHr'},
+    'CHURN': {'MODULE': 'core.data.etl_churn', 'FUNCTION': 'data_preparation_churn', 'CLASS': 'DataPreparationChurn'},
+}
+
+
+def _get_source(str_source: str) -> tuple:
+    """
+    Retrieve the data preparation method and class of the desired source, importing their module only now.
+    Sources are looked up, in order:
+    - in ingestion.yaml, section PREPARATION of the source (MODULE, FUNCTION, CLASS and optional settings such as
+      CORR_THRESHOLD);
+    - among the entry points of group sfds.preparation named as the source. The entry point must refer to a dictionary
+      with keys FUNCTION and CLASS;
+    - among the sources shipped with the repo.
+    :param str_source: name of the source loaded
+    :return: data preparation method and class, and the settings of the preparation declared in ingestion.yaml.
+    """
+
+    with open(os.path.abspath('config/ingestion.yaml'), 'r') as f:
+        dct_prep = (yaml.safe_load(f).get(str_source) or {}).get('PREPARATION')
+
+    if dct_prep is None:
+        lst_ep = entry_points(group=ENTRY_POINT_GROUP, name=str_source)
+        if lst_ep:
+            dct_src = next(iter(lst_ep)).load()
+            return dct_src['FUNCTION'], dct_src['CLASS'], {}
+        dct_prep = _DCT_BUILTIN.get(str_source)
+
+    if dct_prep is None:
+        raise ValueError('CANNOT MAKE DATA PREPARATION FOR', str_source)
+
+    module = importlib.import_module(dct_prep['MODULE'])
+
+    # settings of the preparation overriding the defaults of its class
+    dct_param = {k: v for k, v in dct_prep.items() if k not in ['MODULE', 'FUNCTION', 'CLASS']}
+
+    return getattr(module, dct_prep['FUNCTION']), getattr(module, dct_prep['CLASS']), dct_param
 
 
 def etl_factory(str_source):
@@ -9,11 +60,52 @@ def etl_factory(str_source):
     :return: needed method
     """
 
-    if str_source == 'HR':
-        data_preparation = data_preparation_hr
-    elif str_source == 'CHURN':
-        data_preparation = data_preparation_churn
-    else:
-        raise ValueError('CANNOT MAKE DATA PREPARATION FOR', str_source)
+    data_preparation, _, _ = _get_source(str_source)
 
     return data_preparation
+
+
+def preparation_factory(str_source) -> DataPreparation:
+    """
+    Retrieve a new (not fitted) data preparation object related to the desired source
+    :param str_source: name of the source loaded
+    :return: needed data preparation
+    """
+
+    _, preparation_cls, dct_param = _get_source(str_source)
+
+    preparation = preparation_cls()
+    if 'CORR_THRESHOLD' in dct_param:
+        preparation.corr_threshold = dct_param['CORR_THRESHOLD']
+
+    return preparation
+
+
+def prepare_chunks(
+        iter_chunks: Iterable[pd.DataFrame],
+        data_preparation: Callable,
+        preparation: DataPreparation = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Apply the data preparation chunk by chunk.
+    With a preparation object, it is fit on the first chunk and then applied as it is to the following ones: call its
+    update_stats on all the chunks first, so that its correlation pruning and vocabulary cover the whole file. Without
+    it, each chunk is prepared on its own: the prepared chunks must then share the same columns, which does not hold
+    for a preparation whose output depends on the rows seen (e.g. a column dropped according to a correlation).
+    :param iter_chunks: chunks of the loaded dataset.
+    :param data_preparation: data preparation method, as returned by etl_factory.
+    :param preparation: data preparation object, as returned by preparation_factory.
+    :return: iterator over the prepared chunks.
+    """
+
+    lst_col = None
+    for dtf_chunk in iter_chunks:
+        dtf_chunk = data_preparation(dtf_load=dtf_chunk, preparation=preparation)
+        if lst_col is None:
+            lst_col = dtf_chunk.columns.tolist()
+        elif dtf_chunk.columns.tolist() != lst_col:
+            raise ValueError(
+                'PREPARED CHUNKS WITH DIFFERENT COLUMNS:',
+                sorted(set(dtf_chunk.columns) ^ set(lst_col)),
+            )
+        yield dtf_chunk
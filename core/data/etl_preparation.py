@@ -0,0 +1,282 @@
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+from abc import ABC, abstractmethod
+from typing import Callable
+
+from core.data.etl_utils import CorrelationStats, DummyTargetStats, corr_with_target, select_uncorrelated
+from core.utils.files import tmp_path
+
+
+def clean_categories(ser_in: pd.Series, fun_clean: Callable) -> pd.Series:
+    """
+    Apply a cleaning of the values to a categorical feature.
+    For a pandas categorical, the cleaning is applied to its categories only and the declared vocabulary is kept, so
+    that the result does not depend on the values found in the data.
+    :param ser_in: the feature to clean.
+    :param fun_clean: cleaning of a series of strings. Values turned to NaN are considered missing.
+    :return: the cleaned feature.
+    """
+
+    if not isinstance(ser_in.dtype, pd.CategoricalDtype):
+        return fun_clean(ser_in)
+
+    arr_cat = fun_clean(pd.Series(ser_in.cat.categories)).to_numpy(dtype=object)
+    arr_code = ser_in.cat.codes.to_numpy()
+    arr_val = np.where(arr_code >= 0, arr_cat[arr_code], np.nan)
+
+    return pd.Series(
+        pd.Categorical(arr_val, categories=sorted(set(pd.Series(arr_cat).dropna()))),
+        index=ser_in.index,
+        name=ser_in.name,
+    )
+
+
+class DataPreparation(ABC):
+    """
+    Data preparation fit once on the training data and then applied as it is to any dataset: a daily batch as well as
+    a single customer to score.
+    The fit learns the numeric features too correlated with other ones, the vocabulary of the categorical features
+    and the output columns. The transform does not look at the values found in the data, so its output always has the
+    same columns, in the same order.
+    Subclasses define how a raw dataset is cleaned (clean) and which columns are kept (select_columns).
+    """
+
+    # columns dropped from the analysis after the cleaning
+    DROP = []
+    # if True, rows with missing values among the kept features are dropped
+    DROPNA = False
+    # maximum absolute correlation allowed between two numeric features. None means no pruning.
+    CORR_THRESHOLD = None
+
+    def __init__(self, corr_threshold: float = None):
+        self.corr_threshold = self.CORR_THRESHOLD if corr_threshold is None else corr_threshold
+        self.stats_ = None
+        self.target_stats_ = None
+        self.categories_ = None
+        self.corr_ = None
+        self.drop_ = None
+        self.vocabulary_ = None
+        self.columns_ = None
+
+    @abstractmethod
+    def clean(self, dtf_load: pd.DataFrame) -> pd.DataFrame:
+        """
+        Clean the raw dataset: names, index, target, encodings. Categorical features are left as strings or pandas
+        categoricals, to be turned to dummy variables.
+        :param dtf_load: the raw dataset.
+        :return: the cleaned dataset.
+        """
+
+    @abstractmethod
+    def select_columns(self, dtf_full: pd.DataFrame) -> list:
+        """
+        Columns kept in the output, chosen at fit time.
+        :param dtf_full: the cleaned dataset with all the dummy variables.
+        :return: the columns to keep.
+        """
+
+    def is_fitted(self) -> bool:
+        return self.columns_ is not None
+
+    def update_stats(self, dtf_clean: pd.DataFrame):
+        """
+        Add a chunk of cleaned rows to the correlation statistics of the numeric columns, to the values found in the
+        categorical ones and, when the target is available, to the statistics of their dummy variables with it.
+        Called on all the chunks before the fit, it lets the correlation pruning, the vocabulary and the choice of the
+        dummies see the whole dataset without holding it in memory. Otherwise the fit computes them on the data it
+        receives.
+        :param dtf_clean: a chunk of the cleaned dataset, as returned by clean.
+        :return: the preparation.
+        """
+
+        dtf_work = dtf_clean.drop(self.DROP, axis=1)
+        if self.stats_ is None:
+            self.stats_ = CorrelationStats()
+            self.target_stats_ = DummyTargetStats()
+            self.categories_ = {}
+        self.stats_.update(dtf_work.select_dtypes(include=['number', 'bool']))
+
+        lst_cat = dtf_work.select_dtypes(include=['object', 'category']).columns.tolist()
+        if 'TARGET' in dtf_work:
+            self.target_stats_.update(dtf_work[lst_cat + ['TARGET']])
+
+        for c in lst_cat:
+            if isinstance(dtf_work[c].dtype, pd.CategoricalDtype):
+                self.categories_.setdefault(c, set()).update(dtf_work[c].cat.categories.tolist())
+            else:
+                self.categories_.setdefault(c, set()).update(dtf_work[c].dropna().unique().tolist())
+
+        return self
+
+    def dummy_corr_with_target(self, str_col: str, dtf_full: pd.DataFrame) -> pd.Series:
+        """
+        Correlation with the target of the dummy variables of a categorical feature, for select_columns. It is computed
+        on the rows passed to update_stats (the whole dataset when fit by chunks), before the removal of the rows with
+        missing values; otherwise on dtf_full.
+        :param str_col: the categorical feature.
+        :param dtf_full: the cleaned dataset with all the dummy variables.
+        :return: the correlations, indexed by dummy variable.
+        """
+
+        lst_val = self.vocabulary_[str_col]
+        if self.target_stats_ is not None and self.target_stats_.n:
+            return self.target_stats_.corr(str_col, lst_val)
+
+        return corr_with_target(dtf_full[[f'{str_col}_{v}' for v in lst_val] + ['TARGET']])
+
+    def fit_clean(self, dtf_clean: pd.DataFrame):
+        """
+        Learn the features to prune, the vocabulary and the output columns from a cleaned dataset.
+        When update_stats was called on the whole dataset before, the vocabulary also includes the values found there,
+        so that a value missing from dtf_clean (e.g. the first chunk) is not treated as missing afterwards.
+        :param dtf_clean: the cleaned dataset, as returned by clean.
+        :return: the fitted preparation.
+        """
+
+        dct_seen = {}
+        if self.stats_ is None:
+            self.update_stats(dtf_clean)
+        else:
+            dct_seen = self.categories_
+        self.corr_ = self.stats_.corr()
+
+        self.drop_ = []
+        if self.corr_threshold is not None:
+            self.drop_ = select_uncorrelated(dtf_corr=self.corr_, threshold=self.corr_threshold)
+
+        dtf_work = dtf_clean.drop(self.DROP + self.drop_, axis=1)
+        if self.DROPNA:
+            dtf_work = dtf_work.dropna(axis=0, how='any')
+
+        lst_cat = dtf_work.select_dtypes(include=['object', 'category']).columns.tolist()
+        self.vocabulary_ = {}
+        for c in lst_cat:
+            if isinstance(dtf_work[c].dtype, pd.CategoricalDtype):
+                self.vocabulary_[c] = dtf_work[c].cat.categories.tolist()
+            else:
+                self.vocabulary_[c] = sorted(set(dtf_work[c].dropna().unique().tolist()) | dct_seen.get(c, set()))
+
+        # dummies of the whole vocabulary, found in dtf_clean or not
+        dtf_full = pd.concat(
+            [dtf_work.drop(lst_cat, axis=1)] + [
+                pd.get_dummies(
+                    pd.Categorical(dtf_work[c], categories=self.vocabulary_[c]), prefix=c, prefix_sep='_', dtype='int'
+                ).set_axis(dtf_work.index) for c in lst_cat
+            ],
+            axis=1,
+        )
+
+        self.columns_ = sorted(self.select_columns(dtf_full=dtf_full))
+
+        return self
+
+    def transform_clean(self, dtf_clean: pd.DataFrame) -> pd.DataFrame:
+        """
+        Apply the fitted preparation to a cleaned dataset.
+        Categorical values outside the fitted vocabulary are treated as missing. The TARGET is returned only when
+        found in the data.
+        :param dtf_clean: the cleaned dataset, as returned by clean.
+        :return: the prepared dataset.
+        """
+
+        if not self.is_fitted():
+            raise ValueError('DATA PREPARATION NOT FITTED')
+
+        lst_out = [c for c in self.columns_ if c != 'TARGET' or 'TARGET' in dtf_clean]
+        set_out = set(lst_out)
+        set_dummy = {f'{k}_{v}' for k, lst_val in self.vocabulary_.items() for v in lst_val}
+
+        # position of each value in the vocabulary, -1 when missing or unknown
+        dct_code = {}
+        for k, lst_val in self.vocabulary_.items():
+            ser_val = dtf_clean[k]
+            if isinstance(ser_val.dtype, pd.CategoricalDtype) and ser_val.cat.categories.tolist() == lst_val:
+                dct_code[k] = ser_val.cat.codes.to_numpy()
+            else:
+                dct_code[k] = pd.Index(lst_val).get_indexer(ser_val.to_numpy(dtype=object))
+
+        dct_out = {c: dtf_clean[c].to_numpy() for c in lst_out if c not in set_dummy}
+
+        arr_keep = np.ones(dtf_clean.shape[0], dtype=bool)
+        if self.DROPNA:
+            for arr_val in dct_out.values():
+                arr_keep &= ~pd.isna(arr_val)
+            for arr_code in dct_code.values():
+                arr_keep &= arr_code >= 0
+            if not arr_keep.all():
+                dct_out = {c: arr_val[arr_keep] for c, arr_val in dct_out.items()}
+
+        for k, arr_code in dct_code.items():
+            arr_code = arr_code[arr_keep]
+            for i, v in enumerate(self.vocabulary_[k]):
+                if f'{k}_{v}' in set_out:
+                    dct_out[f'{k}_{v}'] = (arr_code == i).astype(int)
+
+        return pd.DataFrame(dct_out, index=dtf_clean.index[arr_keep], columns=lst_out)
+
+    def fit(self, dtf_load: pd.DataFrame):
+        return self.fit_clean(self.clean(dtf_load))
+
+    def transform(self, dtf_load: pd.DataFrame) -> pd.DataFrame:
+        return self.transform_clean(self.clean(dtf_load))
+
+    def fit_transform(self, dtf_load: pd.DataFrame) -> pd.DataFrame:
+        dtf_clean = self.clean(dtf_load)
+        return self.fit_clean(dtf_clean).transform_clean(dtf_clean)
+
+    def save(self, str_path: str) -> None:
+        """
+        Store the fitted preparation in json format. The file is written to a temporary name and then renamed, so that
+        a partial write is never read.
+        :param str_path: path of the file.
+        :return:
+        """
+
+        if not self.is_fitted():
+            raise ValueError('DATA PREPARATION NOT FITTED')
+
+        os.makedirs(os.path.dirname(str_path) or '.', exist_ok=True)
+        str_tmp = tmp_path(str_path)
+        with open(str_tmp, 'w') as fp:
+            json.dump(
+                {
+                    'CLASS': type(self).__name__,
+                    'CORR_THRESHOLD': self.corr_threshold,
+                    'DROP': self.drop_,
+                    'VOCABULARY': self.vocabulary_,
+                    'COLUMNS': self.columns_,
+                },
+                fp,
+                indent=4,
+            )
+        os.replace(str_tmp, str_path)
+
+        logging.debug(f'DATA PREPARATION SAVED: {str_path}')
+
+        return
+
+    @classmethod
+    def load(cls, str_path: str):
+        """
+        Load a fitted preparation stored with save.
+        :param str_path: path of the file.
+        :return: the fitted preparation.
+        """
+
+        with open(str_path, 'r') as fp:
+            dct_prep = json.load(fp)
+
+        if dct_prep['CLASS'] != cls.__name__:
+            raise ValueError(f'{str_path} STORES A {dct_prep["CLASS"]}, NOT A {cls.__name__}')
+
+        preparation = cls()
+        preparation.corr_threshold = dct_prep['CORR_THRESHOLD']
+        preparation.drop_ = dct_prep['DROP']
+        preparation.vocabulary_ = dct_prep['VOCABULARY']
+        preparation.columns_ = dct_prep['COLUMNS']
+
+        return preparation
@@ -1,7 +1,15 @@
+import logging
 import numpy as np
+import os
 import pandas as pd
 import scipy.stats as ss
 
+from concurrent.futures import ProcessPoolExecutor
+
+
+# data shared with the workers of the process pool. Filled once per worker by _init_worker.
+_dct_worker = {}
+
 
 def cramers_corrected_stat(confusion_matrix):
     """
@@ -19,27 +27,293 @@ def cramers_corrected_stat(confusion_matrix):
     return np.sqrt(phi2corr / min((kcorr-1), (rcorr-1)))
 
 
-def category_corr(dtf_in: pd.DataFrame):
+def _cramers_from_table(arr_obs: np.ndarray) -> float:
+    """
+    Same statistic of cramers_corrected_stat, computed with numpy from a contingency table.
+    Empty rows and columns are removed first, as pd.crosstab does. The chi-squared statistic includes the Yates
+    continuity correction on 2x2 tables, as chi2_contingency does.
+    :param arr_obs: contingency table.
+    :return: the corrected Cramer's V.
+    """
+
+    arr_obs = arr_obs[arr_obs.any(axis=1)][:, arr_obs.any(axis=0)].astype(float)
+    r, k = arr_obs.shape
+    n = arr_obs.sum()
+
+    arr_exp = np.outer(arr_obs.sum(axis=1), arr_obs.sum(axis=0)) / n
+    if (r - 1) * (k - 1) == 1:
+        arr_diff = arr_exp - arr_obs
+        arr_obs = arr_obs + np.minimum(0.5, np.abs(arr_diff)) * np.sign(arr_diff)
+    chi2 = ((arr_obs - arr_exp) ** 2 / arr_exp).sum() if (r - 1) * (k - 1) > 0 else 0.
+
+    phi2corr = max(0, chi2 / n - ((k-1)*(r-1))/(n-1))
+    rcorr = r - ((r-1)**2)/(n-1)
+    kcorr = k - ((k-1)**2)/(n-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(phi2corr / min((kcorr-1), (rcorr-1)))
+
+
+def _cramers_row(arr_code: np.ndarray, arr_size: np.ndarray, i: int) -> np.ndarray:
+    """
+    Cramer's V between column i and the columns following it (upper triangle, diagonal included).
+    :param arr_code: integer codes of the columns, -1 for missing values.
+    :param arr_size: number of distinct values of each column.
+    :param i: position of the column.
+    :return: the statistics, one for each column from i on.
+    """
+
+    arr_out = np.empty(arr_code.shape[1] - i)
+    bln_miss_i = (arr_code[:, i] < 0).any()
+    for j in range(i, arr_code.shape[1]):
+        # rows are indexed by the value of column i, columns by the value of column j
+        arr_flat = arr_code[:, i] * arr_size[j] + arr_code[:, j]
+        if bln_miss_i or (arr_code[:, j] < 0).any():
+            arr_flat = arr_flat[(arr_code[:, i] >= 0) & (arr_code[:, j] >= 0)]
+        arr_obs = np.bincount(arr_flat, minlength=arr_size[i] * arr_size[j]).reshape(arr_size[i], arr_size[j])
+        arr_out[j - i] = _cramers_from_table(arr_obs)
+
+    return arr_out
+
+
+def _init_worker(dct_data: dict) -> None:
+    """
+    Initializer of the process pool: the encoded columns are sent once to each worker instead of once per task.
+    :param dct_data: encoded columns used by _cramers_row.
+    :return:
+    """
+
+    _dct_worker['DATA'] = dct_data
+
+    return
+
+
+def _cramers_row_worker(i: int) -> np.ndarray:
+    """
+    Wrapper of _cramers_row executed inside the workers of the process pool.
+    :param i: position of the column.
+    :return: the statistics of the row.
+    """
+
+    return _cramers_row(_dct_worker['DATA']['CODE'], _dct_worker['DATA']['SIZE'], i)
+
+
+def category_corr(dtf_in: pd.DataFrame, n_jobs: int = 1):
     """
     Compute the correlation between categorical variables using the cramers_corrected_stat method.
+    Each column is integer-encoded once and the contingency tables are built with np.bincount. The statistic is
+    symmetric, so only the upper triangle is computed, optionally spreading its rows across processes.
     :param dtf_in: dataframe to study
+    :param n_jobs: number of processes. 1 means no parallelism, -1 means all the available cores.
     :return: dataframe of the correlations
     """
 
-    lst_cat = dtf_in.select_dtypes(include='object').columns.tolist()
+    if n_jobs == 0 or n_jobs < -1:
+        raise ValueError('n_jobs must be a positive integer or -1')
+
+    lst_cat = dtf_in.select_dtypes(include=['object', 'category']).columns.tolist()
 
     if 'TARGET' in dtf_in:
         lst_cat = lst_cat + ['TARGET']
 
-    lst_cra = []
-    for c1 in lst_cat:
-        for c2 in lst_cat:
-            dct_cra = {'COLUMN_1': c1, 'COLUMN_2': c2}
-            confusion_matrix = pd.crosstab(dtf_in[c1], dtf_in[c2])
-            dct_cra['CRAMER'] = cramers_corrected_stat(confusion_matrix)
-            lst_cra.append(dct_cra)
+    # pd.factorize marks missing values with -1: they are left out of the tables, as pd.crosstab does
+    lst_code = [pd.factorize(dtf_in[c], sort=True)[0] for c in lst_cat]
+    arr_code = np.column_stack(lst_code).astype(np.int64) if lst_code else np.empty((len(dtf_in), 0), np.int64)
+    arr_size = np.array([max(arr.max() + 1, 1) for arr in lst_code], dtype=np.int64)
+    arr_code = np.asfortranarray(arr_code)
+
+    n_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+    if n_workers > 1 and len(lst_cat) > 1:
+        dct_data = {'CODE': arr_code, 'SIZE': arr_size}
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(dct_data,)) as executor:
+            lst_row = list(executor.map(_cramers_row_worker, range(len(lst_cat))))
+    else:
+        lst_row = [_cramers_row(arr_code, arr_size, i) for i in range(len(lst_cat))]
 
-    dtf_cra = pd.DataFrame.from_records(lst_cra)
-    dtf_cra = pd.pivot_table(dtf_cra, index='COLUMN_1', values='CRAMER', columns='COLUMN_2')
+    arr_cra = np.full((len(lst_cat), len(lst_cat)), np.nan)
+    for i, arr_row in enumerate(lst_row):
+        arr_cra[i, i:] = arr_row
+        arr_cra[i:, i] = arr_row
+
+    dtf_cra = pd.DataFrame(arr_cra, index=lst_cat, columns=lst_cat)
+    dtf_cra = dtf_cra.sort_index(axis=0).sort_index(axis=1)
+    dtf_cra.index.name = 'COLUMN_1'
+    dtf_cra.columns.name = 'COLUMN_2'
 
     return dtf_cra
+
+
+class CorrelationStats:
+    """
+    Sufficient statistics of the Pearson correlation matrix (count, means and centered co-moments), updated chunk by
+    chunk, so that the correlation of a table can be computed without holding it in memory.
+    Chunks are merged with the pairwise update of Chan et al., numerically stable also on large tables. Rows with
+    missing values are skipped.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.n = 0
+        self.mean = None
+        self.comoment = None
+
+    def update(self, dtf_chunk: pd.DataFrame):
+        """
+        Add a chunk of rows to the statistics.
+        :param dtf_chunk: numeric chunk. All the chunks must share the same columns.
+        :return: the updated statistics.
+        """
+
+        if self.columns is None:
+            self.columns = dtf_chunk.columns.tolist()
+            self.mean = np.zeros(len(self.columns))
+            self.comoment = np.zeros((len(self.columns), len(self.columns)))
+        elif dtf_chunk.columns.tolist() != self.columns:
+            raise ValueError('CHUNK COLUMNS DIFFERENT FROM THE PREVIOUS ONES')
+
+        arr_x = dtf_chunk.to_numpy(dtype=np.float64)
+        arr_x = arr_x[~np.isnan(arr_x).any(axis=1)]
+        n_b = arr_x.shape[0]
+        if n_b == 0:
+            return self
+
+        mean_b = arr_x.mean(axis=0)
+        arr_x = arr_x - mean_b
+        comoment_b = arr_x.T @ arr_x
+
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.comoment = self.comoment + comoment_b + np.outer(delta, delta) * self.n * n_b / n
+        self.mean = self.mean + delta * n_b / n
+        self.n = n
+
+        return self
+
+    def corr(self) -> pd.DataFrame:
+        """
+        Correlation matrix of the rows seen so far. Constant columns have NaN correlation.
+        :return: dataframe of the correlations
+        """
+
+        arr_std = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arr_corr = self.comoment / np.outer(arr_std, arr_std)
+        np.fill_diagonal(arr_corr, 1.)
+
+        return pd.DataFrame(arr_corr, index=self.columns, columns=self.columns)
+
+
+class DummyTargetStats:
+    """
+    Count of each value of the categorical features and sum of the target over its rows, updated chunk by chunk, so
+    that the Pearson correlation of their dummy variables with the target can be computed without holding the table in
+    memory. A missing value counts as a row with all the dummies at 0, as in pd.get_dummies. Rows with missing target
+    are skipped.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sum = 0.
+        self.sum_sq = 0.
+        self.values = {}
+
+    def update(self, dtf_chunk: pd.DataFrame, str_tgt: str = 'TARGET'):
+        """
+        Add a chunk of rows to the statistics.
+        :param dtf_chunk: chunk with the categorical features and the target.
+        :param str_tgt: name of the target variable.
+        :return: the updated statistics.
+        """
+
+        arr_y = dtf_chunk[str_tgt].to_numpy(dtype=np.float64)
+        arr_keep = ~np.isnan(arr_y)
+        arr_y = arr_y[arr_keep]
+
+        self.n += arr_y.shape[0]
+        self.sum += arr_y.sum()
+        self.sum_sq += (arr_y ** 2).sum()
+
+        for c in dtf_chunk:
+            if c == str_tgt:
+                continue
+            ser_val = pd.Series(dtf_chunk[c].to_numpy(dtype=object)[arr_keep])
+            dtf_val = pd.Series(arr_y).groupby(ser_val, dropna=True).agg(['size', 'sum'])
+            self.values[c] = dtf_val if c not in self.values else self.values[c].add(dtf_val, fill_value=0)
+
+        return self
+
+    def corr(self, str_col: str, lst_val: list) -> pd.Series:
+        """
+        Correlation with the target of the dummy variables of a categorical feature, on the rows seen so far. Dummies
+        of values never seen are constant and have NaN correlation.
+        :param str_col: the categorical feature.
+        :param lst_val: the values of the feature, in order.
+        :return: the correlations, indexed by dummy variable (feature_value).
+        """
+
+        dtf_val = self.values.get(str_col, pd.DataFrame(columns=['size', 'sum'])).reindex(lst_val, fill_value=0)
+        arr_p = dtf_val['size'].to_numpy(dtype=np.float64) / self.n
+        mean_y = self.sum / self.n
+        var_y = self.sum_sq / self.n - mean_y ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arr_cov = dtf_val['sum'].to_numpy(dtype=np.float64) / self.n - arr_p * mean_y
+            arr_corr = arr_cov / np.sqrt(arr_p * (1 - arr_p) * var_y)
+
+        return pd.Series(arr_corr, index=[f'{str_col}_{v}' for v in lst_val])
+
+
+def corr_with_target(dtf_in: pd.DataFrame, str_tgt: str = 'TARGET') -> pd.Series:
+    """
+    Pearson correlation of each column with the target only, without computing the whole correlation matrix.
+    :param dtf_in: numeric dataframe including the target.
+    :param str_tgt: name of the target variable.
+    :return: the correlations, indexed by column.
+    """
+
+    lst_col = [c for c in dtf_in if c != str_tgt]
+    arr_x = dtf_in[lst_col].to_numpy(dtype=np.float64)
+    arr_y = dtf_in[str_tgt].to_numpy(dtype=np.float64)
+
+    arr_x = arr_x - arr_x.mean(axis=0)
+    arr_y = arr_y - arr_y.mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arr_corr = (arr_x.T @ arr_y) / np.sqrt((arr_x ** 2).sum(axis=0) * (arr_y ** 2).sum())
+
+    return pd.Series(arr_corr, index=lst_col)
+
+
+def select_uncorrelated(dtf_corr: pd.DataFrame, threshold: float, str_tgt: str = 'TARGET') -> list:
+    """
+    Columns to drop so that no pair of remaining features has an absolute correlation above threshold.
+    Pairs are visited from the most correlated one: of each pair, the feature less correlated with the target is
+    dropped (the latter in column order on ties, or when the target is not available).
+    :param dtf_corr: correlation matrix, including the target if available.
+    :param threshold: maximum absolute correlation allowed between two features.
+    :param str_tgt: name of the target variable.
+    :return: the columns to drop.
+    """
+
+    lst_feat = [c for c in dtf_corr if c != str_tgt]
+    arr_corr = np.abs(dtf_corr.loc[lst_feat, lst_feat].to_numpy())
+    if str_tgt in dtf_corr:
+        arr_tgt = np.nan_to_num(np.abs(dtf_corr.loc[lst_feat, str_tgt].to_numpy()).round(12))
+    else:
+        arr_tgt = np.zeros(len(lst_feat))
+
+    arr_i, arr_j = np.triu_indices(len(lst_feat), k=1)
+    arr_pair = arr_corr[arr_i, arr_j]
+    arr_sel = np.flatnonzero(arr_pair > threshold)
+    arr_sel = arr_sel[np.argsort(-arr_pair[arr_sel], kind='stable')]
+
+    set_drop = set()
+    lst_drop = []
+    for i, j in zip(arr_i[arr_sel], arr_j[arr_sel]):
+        if i in set_drop or j in set_drop:
+            continue
+        k = i if arr_tgt[i] < arr_tgt[j] else j
+        set_drop.add(k)
+        lst_drop.append(lst_feat[k])
+        logging.debug(
+            f'CORRELATION - DROP {lst_feat[k]} - CORR {lst_feat[i]}/{lst_feat[j]}: {round(arr_corr[i, j], 4)}'
+        )
+
+    return lst_drop
@@ -1,41 +1,286 @@
 import logging
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import json
+import pandas as pd
 
-from sklearn.metrics import accuracy_score, confusion_matrix, precision_score, recall_score, f1_score, roc_auc_score
-from sklearn.metrics import ConfusionMatrixDisplay
+from concurrent.futures import ProcessPoolExecutor
 
 
-def evaluation(y_true: np.array, y_pred: np.array, y_pred_proba: np.array, tpe: str, bln_save: bool):
+# data shared with the workers of the process pool. Filled once per worker by _init_worker.
+_dct_worker = {}
 
-    auc_test = round(roc_auc_score(y_true, y_pred_proba[:, 1]), 4)
-    accuracy_test = round(accuracy_score(y_true, y_pred), 4)
-    precision_test = round(precision_score(y_true, y_pred), 4)
-    recall_test = round(recall_score(y_true, y_pred), 4)
-    f1_score_test = round(f1_score(y_true, y_pred), 4)
+# maximum number of elements of the resample weights matrix built at once by the bootstrap.
+_BOOTSTRAP_MAX_ELEMENTS = 2 ** 22
+
+
+def threshold_table(y_true: np.array, y_score: np.array) -> pd.DataFrame:
+    """
+    Confusion counts, precision, recall and F1 score at every threshold, computed with a single sort of the scores.
+    An instance is predicted as positive when its score is greater than or equal to the threshold.
+    :param y_true: binary target variable.
+    :param y_score: score of the positive class.
+    :return: dataframe with one row for each distinct score, sorted by decreasing threshold.
+    """
+
+    y_true = np.asarray(y_true)
+    y_score = np.asarray(y_score)
+
+    # descending sort: the positives predicted at a threshold are a prefix of the sorted array
+    idx_sort = np.argsort(y_score, kind='mergesort')[::-1]
+    y_score = y_score[idx_sort]
+    y_true = y_true[idx_sort] == 1
+
+    # with ties, only the last instance of each group of equal scores is a valid cut
+    idx_cut = np.r_[np.flatnonzero(np.diff(y_score)), y_score.size - 1]
+
+    arr_tp = np.cumsum(y_true)[idx_cut]
+    arr_fp = idx_cut + 1 - arr_tp
+    n_pos = y_true.sum()
+    n_neg = y_true.size - n_pos
+
+    dtf_ths = pd.DataFrame({
+        'THRESHOLD': y_score[idx_cut],
+        'TP': arr_tp,
+        'FP': arr_fp,
+        'FN': n_pos - arr_tp,
+        'TN': n_neg - arr_fp,
+    })
+
+    # metrics with a zero denominator are set to 0, as sklearn does
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dtf_ths['PRECISION'] = np.nan_to_num(arr_tp / (arr_tp + arr_fp))
+        dtf_ths['RECALL'] = np.nan_to_num(arr_tp / n_pos)
+        dtf_ths['F1-SCORE'] = np.nan_to_num(2 * arr_tp / (n_pos + arr_tp + arr_fp))
+        dtf_ths['FPR'] = np.nan_to_num(arr_fp / n_neg)
+
+    return dtf_ths
+
+
+def auc_from_table(dtf_ths: pd.DataFrame) -> float:
+    """
+    Area under the ROC curve from the threshold table, with the trapezoidal rule (ties handled as roc_auc_score does).
+    :param dtf_ths: threshold table built by threshold_table.
+    :return: the AUC.
+    """
+
+    n_pos = dtf_ths['TP'].iloc[-1]
+    n_neg = dtf_ths['FP'].iloc[-1]
+    if n_pos == 0 or n_neg == 0:
+        raise ValueError('Only one class present in y_true. ROC AUC score is not defined in that case.')
+
+    arr_tpr = np.r_[0, dtf_ths['TP'].to_numpy() / n_pos]
+    arr_fpr = np.r_[0, dtf_ths['FP'].to_numpy() / n_neg]
+
+    return float(np.sum(np.diff(arr_fpr) * (arr_tpr[1:] + arr_tpr[:-1]) / 2))
+
+
+def _init_worker(dct_data: dict) -> None:
+    """
+    Initializer of the process pool: the sorted data are sent once to each worker instead of once per chunk.
+    :param dct_data: sorted data used by _bootstrap_chunk.
+    :return:
+    """
+
+    _dct_worker['DATA'] = dct_data
+
+    return
+
+
+def _bootstrap_chunk(dct_data: dict, seed, n_res: int) -> np.ndarray:
+    """
+    Metrics of a chunk of bootstrap resamples, computed in batch.
+    Each resample is represented by the number of times each instance is drawn: the data are sorted by score once,
+    and the metrics of every resample come from weighted cumulative sums over the same order.
+    :param dct_data: target, predicted labels (sorted by decreasing score) and valid cuts of the threshold table.
+    :param seed: seed of the resamples of the chunk.
+    :param n_res: number of resamples of the chunk.
+    :return: array of shape (n_res, 5) with AUC, ACCURACY, PRECISION, RECALL and F1-SCORE of each resample.
+    """
+
+    y_true = dct_data['Y_TRUE']
+    y_pred = dct_data['Y_PRED']
+    n_obs = y_true.size
+
+    # all the indexes of the chunk drawn at once, then turned to counts per instance
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n_obs, size=(n_res, n_obs)) + n_obs * np.arange(n_res)[:, None]
+    arr_w = np.bincount(idx.ravel(), minlength=n_res * n_obs).reshape(n_res, n_obs)
+    del idx
+
+    # AUC: ROC curve of each resample at the cuts of the original threshold table
+    arr_tp = np.cumsum(arr_w * y_true, axis=1)[:, dct_data['IDX_CUT']]
+    arr_fp = np.cumsum(arr_w * ~y_true, axis=1)[:, dct_data['IDX_CUT']]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arr_tpr = np.column_stack([np.zeros(n_res), arr_tp / arr_tp[:, -1:]])
+        arr_fpr = np.column_stack([np.zeros(n_res), arr_fp / arr_fp[:, -1:]])
+    arr_auc = np.sum(np.diff(arr_fpr, axis=1) * (arr_tpr[:, 1:] + arr_tpr[:, :-1]) / 2, axis=1)
+
+    # confusion counts of the predicted labels
+    n_tp = arr_w @ (y_true & y_pred)
+    n_fp = arr_w @ (~y_true & y_pred)
+    n_fn = arr_w @ (y_true & ~y_pred)
+    n_tn = n_obs - n_tp - n_fp - n_fn
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arr_out = np.column_stack([
+            arr_auc,
+            (n_tp + n_tn) / n_obs,
+            np.nan_to_num(n_tp / (n_tp + n_fp)),
+            np.nan_to_num(n_tp / (n_tp + n_fn)),
+            np.nan_to_num(2 * n_tp / (2 * n_tp + n_fp + n_fn)),
+        ])
+
+    return arr_out
+
+
+def _bootstrap_chunk_worker(tpl_task: tuple) -> np.ndarray:
+    """
+    Wrapper of _bootstrap_chunk executed inside the workers of the process pool.
+    :param tpl_task: seed and number of resamples of the chunk.
+    :return: the metrics of the chunk.
+    """
+
+    return _bootstrap_chunk(_dct_worker['DATA'], *tpl_task)
+
+
+def bootstrap_ci(
+        y_true: np.array,
+        y_pred: np.array,
+        y_score: np.array,
+        n_bootstrap: int = 1000,
+        alpha: float = 0.05,
+        n_jobs: int = 1,
+        random_state: int = None,
+) -> dict:
+    """
+    Percentile bootstrap confidence intervals of AUC, accuracy, precision, recall and F1 score.
+    Resamples are processed in chunks, optionally spread across processes. Each chunk has its own seed derived from
+    random_state, so the intervals do not depend on n_jobs.
+    :param y_true: binary target variable.
+    :param y_pred: predicted target variable.
+    :param y_score: score of the positive class.
+    :param n_bootstrap: number of resamples.
+    :param alpha: the intervals have confidence level 1 - alpha.
+    :param n_jobs: number of processes. 1 means no parallelism, -1 means all the available cores.
+    :param random_state: seed to be set for reproducibility.
+    :return: dictionary with the settings of the bootstrap and the lower and upper bound of each metric.
+    """
+
+    if n_jobs == 0 or n_jobs < -1:
+        raise ValueError('n_jobs must be a positive integer or -1')
+
+    # single sort, shared by all the resamples
+    y_score = np.asarray(y_score)
+    idx_sort = np.argsort(y_score, kind='mergesort')[::-1]
+    y_score = y_score[idx_sort]
+    dct_data = {
+        'Y_TRUE': np.asarray(y_true)[idx_sort] == 1,
+        'Y_PRED': np.asarray(y_pred)[idx_sort] == 1,
+        'IDX_CUT': np.r_[np.flatnonzero(np.diff(y_score)), y_score.size - 1],
+    }
+
+    n_chunk = max(1, _BOOTSTRAP_MAX_ELEMENTS // y_score.size)
+    lst_size = [min(n_chunk, n_bootstrap - start) for start in range(0, n_bootstrap, n_chunk)]
+    lst_seed = np.random.SeedSequence(random_state).spawn(len(lst_size))
+    lst_task = list(zip(lst_seed, lst_size))
+
+    n_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+    if n_workers > 1 and len(lst_task) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(dct_data,)) as executor:
+            lst_res = list(executor.map(_bootstrap_chunk_worker, lst_task))
+    else:
+        lst_res = [_bootstrap_chunk(dct_data, *tpl_task) for tpl_task in lst_task]
+
+    arr_res = np.concatenate(lst_res, axis=0)
+    arr_ci = np.nanpercentile(arr_res, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+
+    dct_ci = {'N_BOOTSTRAP': n_bootstrap, 'CONFIDENCE': 1 - alpha}
+    for i, k in enumerate(['AUC', 'ACCURACY', 'PRECISION', 'RECALL', 'F1-SCORE']):
+        dct_ci[k] = [round(float(arr_ci[0, i]), 4), round(float(arr_ci[1, i]), 4)]
+
+    return dct_ci
+
+
+def evaluation(
+        y_true: np.array,
+        y_pred: np.array,
+        y_pred_proba: np.array,
+        tpe: str,
+        bln_save: bool,
+        bln_plot: bool = True,
+        n_bootstrap: int = 0,
+        alpha: float = 0.05,
+        n_jobs: int = 1,
+        random_state: int = None,
+        str_path_out: str = None,
+) -> pd.DataFrame:
+    """
+    Evaluate the predictions: AUC from the scores, accuracy, precision, recall and F1 score from the predicted labels.
+    All the metrics come from a single sort of the scores and a single count of the labels.
+    :param y_true: binary target variable.
+    :param y_pred: predicted target variable.
+    :param y_pred_proba: predicted probabilities, one column for each class.
+    :param tpe: label of the set evaluated, used in the name of the files saved.
+    :param bln_save: if True, metrics are saved in PATH_OUT_MOD.
+    :param bln_plot: if True (and bln_save is True), the confusion matrix is also saved as png.
+    :param n_bootstrap: number of bootstrap resamples for the confidence intervals of the metrics. 0 means no intervals.
+    :param alpha: the intervals have confidence level 1 - alpha.
+    :param n_jobs: number of processes computing the bootstrap. 1 means no parallelism, -1 means all the cores.
+    :param random_state: seed of the bootstrap, to be set for reproducibility.
+    :param str_path_out: folder where metrics and plot are saved. None means PATH_OUT_MOD.
+    :return: the threshold table, to choose an operating point different from the one of y_pred.
+    """
+
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+
+    dtf_ths = threshold_table(y_true=y_true, y_score=y_pred_proba[:, 1])
+
+    # confusion matrix of the predicted labels: [[TN, FP], [FN, TP]]
+    cm = np.bincount(2 * (y_true == 1) + (y_pred == 1), minlength=4).reshape(2, 2)
+    n_tn, n_fp, n_fn, n_tp = cm.ravel()
 
     dct_eval = {
-        'AUC': auc_test,
-        'ACCURACY': accuracy_test,
-        'PRECISION': precision_test,
-        'RECALL': recall_test,
-        'F1-SCORE': f1_score_test,
+        'AUC': round(auc_from_table(dtf_ths), 4),
+        'ACCURACY': round((n_tp + n_tn) / cm.sum(), 4),
+        'PRECISION': round(n_tp / (n_tp + n_fp), 4) if n_tp + n_fp else 0.0,
+        'RECALL': round(n_tp / (n_tp + n_fn), 4) if n_tp + n_fn else 0.0,
+        'F1-SCORE': round(2 * n_tp / (2 * n_tp + n_fp + n_fn), 4) if n_tp + n_fp + n_fn else 0.0,
     }
+    dct_eval = {k: float(v) for k, v in dct_eval.items()}
+
+    if n_bootstrap:
+        dct_eval['BOOTSTRAP_CI'] = bootstrap_ci(
+            y_true=y_true,
+            y_pred=y_pred,
+            y_score=y_pred_proba[:, 1],
+            n_bootstrap=n_bootstrap,
+            alpha=alpha,
+            n_jobs=n_jobs,
+            random_state=random_state,
+        )
 
     logging.info(f'{tpe} set: {dct_eval}')
 
     if bln_save:
 
+        if str_path_out is None:
+            str_path_out = os.environ['PATH_OUT_MOD']
+
         # save metrics
-        with open(os.environ['PATH_OUT_MOD'] + f'evaluation_{tpe}.json', 'w') as fp:
+        with open(str_path_out + f'evaluation_{tpe}.json', 'w') as fp:
             json.dump(dct_eval, fp, indent=4)
 
-        # Create the confusion matrix
-        cm = confusion_matrix(y_true, y_pred)
-        ConfusionMatrixDisplay(confusion_matrix=cm).plot()
-        plt.savefig(f'{os.environ['PATH_OUT_MOD']}/CONFUSION_MATRIX_{tpe}.png')
-        plt.close()
+        if bln_plot:
 
-    return
+            # plotting libraries are needed only here
+            import matplotlib.pyplot as plt
+            from sklearn.metrics import ConfusionMatrixDisplay
+
+            # Create the confusion matrix
+            ConfusionMatrixDisplay(confusion_matrix=cm).plot()
+            plt.savefig(str_path_out + f'CONFUSION_MATRIX_{tpe}.png')
+            plt.close()
+
+    return dtf_ths
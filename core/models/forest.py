@@ -1,11 +1,345 @@
 import logging
+import numpy as np
+import os
+import pandas as pd
+import sklearn
+import sklearn.metrics
+import tempfile
+import warnings
 import yaml
 
+from imblearn.pipeline import Pipeline
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import RandomizedSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingRandomSearchCV, ParameterSampler, RandomizedSearchCV
+from typing import Callable
 
+from core.utils.files import tmp_path
+from core.utils.hashing import hash_content
 
-def run_random_forest(X_train, y_train, random_state):
+
+def to_shared_memmap(X_train, y_train, str_dir: str, chunk_size: int = 100000) -> tuple:
+    """
+    Dump the train data to .npy files and reopen them as read-only memory maps.
+    joblib sends to its workers only the reference to a memory-mapped file, so all the workers share the same pages
+    instead of receiving a pickled copy each. Features are stored as float32: the forest casts them to float32 anyway.
+    :param X_train: train dataset.
+    :param y_train: target variable for training.
+    :param str_dir: folder where the files are written.
+    :param chunk_size: number of rows written at once, to avoid a full in-memory copy of the data.
+    :return: memory-mapped train dataset and target variable.
+    """
+
+    str_x = os.path.join(str_dir, 'X_train.npy')
+    str_y = os.path.join(str_dir, 'y_train.npy')
+
+    arr_x = np.lib.format.open_memmap(str_x, mode='w+', dtype=np.float32, shape=X_train.shape)
+    for start in range(0, X_train.shape[0], chunk_size):
+        arr_x[start:start + chunk_size] = X_train.iloc[start:start + chunk_size].to_numpy(dtype=np.float32)
+    arr_x.flush()
+    del arr_x
+
+    np.save(str_y, np.asarray(y_train))
+
+    return np.load(str_x, mmap_mode='r'), np.load(str_y, mmap_mode='r')
+
+
+class CheckpointRandomizedSearchCV(RandomizedSearchCV):
+    """
+    Randomized search whose candidates are evaluated in n_checkpoints batches, calling fun_progress before each batch:
+    a job running the search reports its progress, and can be cancelled, between two batches. The candidates are
+    sampled as in RandomizedSearchCV and the results are the same as with a single batch. The callbacks of sklearn are
+    not supported.
+    """
+
+    fun_progress = None
+    n_checkpoints = 1
+
+    def _run_search(self, evaluate_candidates):
+
+        lst_params = list(ParameterSampler(self.param_distributions, self.n_iter, random_state=self.random_state))
+        n_batch = max(1, min(self.n_checkpoints, len(lst_params)))
+
+        for i, arr_pos in enumerate(np.array_split(np.arange(len(lst_params)), n_batch)):
+            if self.fun_progress is not None:
+                self.fun_progress(i / n_batch, f'SEARCH {i + 1}/{n_batch}')
+            evaluate_candidates([lst_params[j] for j in arr_pos])
+
+
+class CheckpointHalvingRandomSearchCV(HalvingRandomSearchCV):
+    """
+    Successive halving calling fun_progress before each round: a job running the search reports its progress, and
+    can be cancelled, between two rounds.
+    """
+
+    fun_progress = None
+
+    def _run_search(self, evaluate_candidates, callback_ctx=None):
+
+        def evaluate_round(candidate_params, *args, **kwargs_eval):
+            # the number of rounds is known only at the end: the progress is the budget of the previous round
+            if self.fun_progress is not None:
+                n_round = len(self.n_resources_)
+                progress = 0.0 if n_round == 1 else self.n_resources_[-2] / self.max_resources_
+                self.fun_progress(progress, f'SEARCH ROUND {n_round} - BUDGET {self.n_resources_[-1]}')
+            return evaluate_candidates(candidate_params, *args, **kwargs_eval)
+
+        # callback_ctx is passed only by the versions of sklearn supporting callbacks
+        if callback_ctx is None:
+            return super()._run_search(evaluate_round)
+        return super()._run_search(evaluate_round, callback_ctx=callback_ctx)
+
+
+def search_cache_key(
+        X_train,
+        y_train,
+        dct_param_rf: dict,
+        dct_param_cv: dict,
+        random_state,
+        dct_cv=None,
+        sampler=None,
+) -> str:
+    """
+    Key of the search cache: content hash of the train data, the folds, the oversampler, the search space and the
+    settings affecting the results. Settings only affecting the execution (parallelism, verbosity, memory mapping,
+    caching, checkpoints) are excluded.
+    :param X_train: train dataset.
+    :param y_train: target variable for training.
+    :param dct_param_rf: search space of the random forest.
+    :param dct_param_cv: settings of the search.
+    :param random_state: seed of the search.
+    :param dct_cv: folds of the train set (positions), as returned by split_data.
+    :param sampler: oversampler applied inside each fold.
+    :return: the key.
+    """
+
+    dct_key = {k: v for k, v in dct_param_cv.items() if k not in ['MEMMAP', 'CACHE', 'CHECKPOINTS']}
+    dct_key['COMMON'] = {k: v for k, v in dct_param_cv['COMMON'].items() if k not in ['n_jobs', 'verbose']}
+
+    lst_sampler = None
+    if sampler is not None:
+        lst_sampler = [type(sampler).__name__, {k: v for k, v in sampler.get_params().items() if k != 'n_jobs'}]
+
+    return hash_content(X_train, y_train, dct_cv, lst_sampler, dct_param_rf, dct_key, random_state, sklearn.__version__)
+
+
+def grow_forest_oob(
+        model: RandomForestClassifier,
+        X_train,
+        y_train,
+        step: int,
+        max_estimators: int,
+        tol: float,
+        patience: int,
+        scoring: str = 'accuracy',
+        fun_progress: Callable = None,
+) -> RandomForestClassifier:
+    """
+    Grow a random forest incrementally (warm start), step trees at a time, tracking the out-of-bag score.
+    The growth stops when the score does not improve more than tol for patience steps in a row, or when max_estimators
+    is reached. The trees added after the best score are discarded.
+    :param model: the forest to grow. Its n_estimators is ignored.
+    :param X_train: train dataset.
+    :param y_train: target variable for training.
+    :param step: number of trees added at each step.
+    :param max_estimators: maximum number of trees.
+    :param tol: minimum improvement of the out-of-bag score.
+    :param patience: number of steps without improvement before stopping.
+    :param scoring: metric of the out-of-bag score, as named in sklearn.metrics without _score (e.g. f1, accuracy).
+    :param fun_progress: if set, called with the fraction of max_estimators grown before each step.
+    :return: the grown forest.
+    """
+
+    # the metric is computed here from the out-of-bag predictions, as sklearn does: passing it to the forest as
+    # oob_score would leave a function among the parameters of the model, which must stay json serializable
+    fun_score = getattr(sklearn.metrics, f'{scoring}_score')
+    model = clone(model).set_params(
+        warm_start=True,
+        bootstrap=True,
+        oob_score=True,
+        n_estimators=step,
+    )
+
+    best_score = -np.inf
+    best_n = step
+    n_wait = 0
+
+    while True:
+
+        if fun_progress is not None:
+            n_next = model.get_params()['n_estimators']
+            fun_progress(n_next / max_estimators, f'OOB_GROWTH {n_next}/{max_estimators}')
+
+        # every step fits the same full train set, so the class_weight presets are computed on the same data: the
+        # warning raised by sklearn for presets combined with warm start does not apply here.
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='class_weight presets')
+            model.fit(X_train, y_train)
+        n_trees = model.get_params()['n_estimators']
+        oob_score = fun_score(y_train, model.classes_[np.argmax(model.oob_decision_function_, axis=1)])
+        logging.debug(f'OOB_GROWTH - TREES: {n_trees} - OOB {scoring}: {oob_score}')
+
+        if oob_score > best_score + tol:
+            best_score = oob_score
+            best_n = n_trees
+            arr_oob_best = model.oob_decision_function_.copy()
+            n_wait = 0
+        else:
+            n_wait = n_wait + 1
+
+        if n_wait >= patience or n_trees + step > max_estimators:
+            break
+
+        model.set_params(n_estimators=n_trees + step)
+
+    logging.info(f'OOB_GROWTH - TREES SELECTED: {best_n} - OOB {scoring}: {best_score}')
+
+    # trees are independent: keeping the first best_n ones gives the forest as it was when the best score was reached,
+    # and so its out-of-bag attributes are the ones of that step. oob_score_ is the score with the chosen metric.
+    model.estimators_ = model.estimators_[:best_n]
+    model.set_params(n_estimators=best_n, warm_start=False)
+    model.oob_score_ = best_score
+    model.oob_decision_function_ = arr_oob_best
+
+    return model
+
+
+def run_search(
+        X_train,
+        y_train,
+        dct_param_rf: dict,
+        dct_param_cv: dict,
+        random_state,
+        dct_cv: dict = None,
+        sampler=None,
+        fun_progress: Callable = None,
+) -> tuple:
+    """
+    Search the best hyperparameters of the random forest with the engine set in param_cv.yaml.
+    :param X_train: train dataset.
+    :param y_train: target variable for training.
+    :param dct_param_rf: search space of the random forest.
+    :param dct_param_cv: settings of the search.
+    :param random_state: seed to be set for reproducibility.
+    :param dct_cv: folds of the train set (positions), as returned by split_data. None means the COMMON cv.
+    :param sampler: if set, oversampler fit on the training part of each fold only, so that the validation scores are
+        not biased by synthetic samples built from validation rows. The best model is then fit on the oversampled full
+        training set.
+    :param fun_progress: if set, called with the fraction done and the current step: in the search between two batches
+        of candidates (CHECKPOINTS in param_cv.yaml) or two rounds, then before the fit of the best model.
+    :return: best hyperparameters, cv_results_ of the search and the best model fit on the full training set.
+    """
+
+    str_engine = dct_param_cv['ENGINE']
+    if str_engine not in ['RANDOM', 'HALVING']:
+        raise ValueError("ENGINE not in ['RANDOM', 'HALVING']")
+
+    logging.info(f'SEARCH ENGINE: {str_engine}')
+
+    dct_param_rf = dct_param_rf.copy()
+
+    dct_common = dct_param_cv['COMMON'].copy()
+    if dct_cv is not None:
+        dct_common['cv'] = [(item['TRAIN'], item['VALIDATION']) for item in dct_cv.values()]
+
+    # Create a random forest classifier
+    rf = RandomForestClassifier(random_state=random_state)
+
+    # with OOB_GROWTH the number of trees is chosen afterwards: configurations are compared with the smallest one
+    if dct_param_cv['OOB_GROWTH']['ENABLED']:
+        if str_engine == 'HALVING' and dct_param_cv['HALVING']['resource'] == 'n_estimators':
+            raise ValueError('OOB_GROWTH IS NOT COMPATIBLE WITH HALVING ON n_estimators')
+        rf.set_params(n_estimators=min(dct_param_rf.pop('n_estimators')))
+
+    # with an oversampler, the forest is the last step of a pipeline: its parameters are prefixed by the step name
+    estimator = rf
+    str_prefix = ''
+    if sampler is not None:
+        estimator = Pipeline([('OVERSAMPLING', sampler), ('FOREST', rf)])
+        str_prefix = 'FOREST__'
+
+    if str_engine == 'RANDOM':
+
+        # Use random search to find the best hyperparameters
+        rand_search = CheckpointRandomizedSearchCV(
+            estimator,
+            param_distributions={str_prefix + k: v for k, v in dct_param_rf.items()},
+            random_state=random_state,
+            **dct_common,
+            **dct_param_cv['RANDOM'],
+        )
+
+    else:
+
+        dct_halving = dct_param_cv['HALVING'].copy()
+
+        # when the budget is a parameter of the forest, it is not searched anymore: its range bounds the budget.
+        if dct_halving['resource'] != 'n_samples':
+            lst_budget = dct_param_rf.pop(dct_halving['resource'])
+            dct_halving.setdefault('min_resources', min(lst_budget))
+            dct_halving.setdefault('max_resources', max(lst_budget))
+            dct_halving['resource'] = str_prefix + dct_halving['resource']
+
+        # Use successive halving to find the best hyperparameters
+        rand_search = CheckpointHalvingRandomSearchCV(
+            estimator,
+            param_distributions={str_prefix + k: v for k, v in dct_param_rf.items()},
+            random_state=random_state,
+            **dct_common,
+            **dct_halving,
+        )
+
+    # Fit the random search object to the data.
+    # With MEMMAP the workers read the train data from a shared read-only file: the best model is then refit here on
+    # the original dataset, so that it keeps the feature names. With OOB_GROWTH the best model is grown afterwards.
+    # With an oversampler the best model is fit afterwards on the oversampled dataset, as a plain forest.
+    bln_refit = not (dct_param_cv['MEMMAP'] or dct_param_cv['OOB_GROWTH']['ENABLED'] or sampler is not None)
+    rand_search.set_params(refit=bln_refit)
+
+    # the search takes the first 80% of the progress, the fit of the best model the rest
+    if fun_progress is not None:
+        rand_search.fun_progress = lambda progress, str_message: fun_progress(0.8 * progress, str_message)
+    rand_search.n_checkpoints = dct_param_cv['CHECKPOINTS']
+
+    if dct_param_cv['MEMMAP']:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as str_dir:
+            X_train_mm, y_train_mm = to_shared_memmap(X_train=X_train, y_train=y_train, str_dir=str_dir)
+            rand_search.fit(X_train_mm, y_train_mm)
+            del X_train_mm, y_train_mm
+    else:
+        rand_search.fit(X_train, y_train)
+
+    best_params = {k[len(str_prefix):]: v for k, v in rand_search.best_params_.items()}
+
+    if fun_progress is not None:
+        fun_progress(0.8, 'FIT')
+
+    if sampler is not None:
+        X_train, y_train = sampler.fit_resample(X_train, y_train)
+
+    # Create a variable for the best model.
+    # Attention point:
+    # thanks to parameter refit=True in the search, the best_estimator_ is already fit on the full training set.
+    if dct_param_cv['OOB_GROWTH']['ENABLED']:
+        # the best configuration is grown until the out-of-bag score flattens
+        model = grow_forest_oob(
+            model=clone(rf).set_params(**best_params),
+            X_train=X_train,
+            y_train=y_train,
+            scoring=dct_param_cv['COMMON']['scoring'],
+            fun_progress=None if fun_progress is None else lambda p, m: fun_progress(0.8 + 0.2 * p, m),
+            **{k: v for k, v in dct_param_cv['OOB_GROWTH'].items() if k != 'ENABLED'}
+        )
+    elif not bln_refit:
+        model = clone(rf).set_params(**best_params).fit(X_train, y_train)
+    else:
+        model = rand_search.best_estimator_
+
+    return best_params, rand_search.cv_results_, model
+
+
+def run_random_forest(X_train, y_train, random_state, dct_cv: dict = None, sampler=None, fun_progress: Callable = None):
 
     logging.info(f'TRAINING_PHASE STARTED')
 
@@ -15,32 +349,64 @@ def run_random_forest(X_train, y_train, random_state):
     with open('config/param_cv.yaml') as f:
         dct_param_cv = yaml.safe_load(f)
 
-    # Create a random forest classifier
-    rf = RandomForestClassifier(random_state=random_state)
+    # the cache is used only with a fixed seed: without it, the search is not meant to be repeatable
+    str_cache = None
+    if dct_param_cv['CACHE'] and random_state is not None:
+        str_key = search_cache_key(X_train, y_train, dct_param_rf, dct_param_cv, random_state, dct_cv, sampler)
+        str_cache = os.environ['PATH_OUT_CACHE'] + f'SEARCH/{str_key}/'
 
-    # Use random search to find the best hyperparameters
-    rand_search = RandomizedSearchCV(
-        rf,
-        param_distributions=dct_param_rf,
-        random_state=random_state,
-        refit=True,
-        **dct_param_cv
-    )
+    if str_cache is not None and os.path.exists(str_cache + 'search.pickle'):
+
+        logging.info(f'SEARCH CACHE HIT: {str_cache}')
+        dct_search = pd.read_pickle(str_cache + 'search.pickle')
+        best_params = dct_search['BEST_PARAMS']
+        dct_cv_results = dct_search['CV_RESULTS']
+
+        if os.path.exists(str_cache + 'model.pickle'):
+            model = pd.read_pickle(str_cache + 'model.pickle')
+        else:
+            X_fit, y_fit = (X_train, y_train) if sampler is None else sampler.fit_resample(X_train, y_train)
+            if dct_param_cv['OOB_GROWTH']['ENABLED']:
+                model = grow_forest_oob(
+                    model=RandomForestClassifier(random_state=random_state).set_params(**best_params),
+                    X_train=X_fit,
+                    y_train=y_fit,
+                    scoring=dct_param_cv['COMMON']['scoring'],
+                    fun_progress=fun_progress,
+                    **{k: v for k, v in dct_param_cv['OOB_GROWTH'].items() if k != 'ENABLED'}
+                )
+            else:
+                model = RandomForestClassifier(random_state=random_state).set_params(**best_params).fit(X_fit, y_fit)
+
+    else:
 
-    # Fit the random search object to the data
-    rand_search.fit(X_train, y_train)
+        best_params, dct_cv_results, model = run_search(
+            X_train=X_train,
+            y_train=y_train,
+            dct_param_rf=dct_param_rf,
+            dct_param_cv=dct_param_cv,
+            random_state=random_state,
+            dct_cv=dct_cv,
+            sampler=sampler,
+            fun_progress=fun_progress,
+        )
+
+    # files are written to a temporary name and then renamed, so that a partial write is never read as a hit
+    if str_cache is not None:
+        os.makedirs(str_cache, exist_ok=True)
+        # temporary names are unique, so that two searches storing the same key never write to the same file
+        for str_name, obj in [('search', {'BEST_PARAMS': best_params, 'CV_RESULTS': dct_cv_results}), ('model', model)]:
+            str_path = str_cache + f'{str_name}.pickle'
+            if not os.path.exists(str_path):
+                str_tmp = tmp_path(str_path)
+                pd.to_pickle(obj, str_tmp)
+                os.replace(str_tmp, str_path)
 
-    dct_cv_results = rand_search.cv_results_
     logging.debug(f'CV - mean_train_score: {dct_cv_results["mean_train_score"]}')
     logging.debug(f'CV - mean_test_score: {dct_cv_results["mean_test_score"]}')
 
     # Print the best hyperparameters
-    logging.info(f'Best hyperparameters: {rand_search.best_params_}')
-
-    # Create a variable for the best model.
-    # Attention point:
-    # thanks to parameter refit=True in RandomizedSearchCV, the best_estimator_ is already fit on the full training set.
-    model = rand_search.best_estimator_
+    logging.info(f'Best hyperparameters: {best_params}')
 
     logging.info(f'TRAINING_PHASE COMPLETED')
 
@@ -1,12 +1,478 @@
 import logging
 import numpy as np
+import os
 import pandas as pd
 import statsmodels.api as sm
 
+from concurrent.futures import ProcessPoolExecutor
+from scipy.special import expit
+from scipy.stats import norm, rankdata
 # from sklearn.metrics import f1_score
 from sklearn.metrics import roc_auc_score
 
-from core.pipelines.scaling import scaling_data
+from core.pipelines.scaling import FeatureScaler
+from core.utils.files import tmp_path
+from core.utils.hashing import hash_content
+
+
+# data shared with the workers of the process pool. Filled once per worker by _init_worker.
+_dct_worker = {}
+
+# maximum number of elements of the stacked design matrices fitted at once by the IRLS solver.
+_IRLS_MAX_ELEMENTS = 2 ** 24
+
+
+def _build_fold_cache(X_train: pd.DataFrame, y_train: pd.Series, dct_cv: dict, bln_scale: bool) -> dict:
+    """
+    Precompute, once for the whole stepwise procedure, the float arrays of every fold.
+    Standard scaling acts column by column, so scaling all the columns of a fold once gives the same values obtained
+    scaling any subset of them: the models of every iteration just take the columns needed by integer position.
+    Arrays are stored in Fortran order, so that each column is contiguous in memory.
+    :param X_train: train dataset.
+    :param y_train: target variable for training.
+    :param dct_cv: dictionary with the indexes needed to create the folds during the cross validation phase, as
+        returned by split_data.
+    :param bln_scale: if True, data are scaled via standard scaling approach.
+    :return: dictionary with the position of each column and, for each fold, train and validation arrays.
+    """
+
+    lst_col = X_train.columns.tolist()
+    arr_y = y_train.to_numpy(dtype=float)
+
+    dct_cache = {'POSITION': {c: i for i, c in enumerate(lst_col)}, 'FOLDS': {}}
+
+    for k, item in dct_cv.items():
+
+        X_train_tmp = X_train.iloc[item['TRAIN']]
+        # always a copy: to_numpy may return a read-only view of the data, which the scaling would modify
+        arr_train = np.array(X_train_tmp.to_numpy(dtype=float), order='F')
+        arr_valid = np.array(X_train.iloc[item['VALIDATION']].to_numpy(dtype=float), order='F')
+
+        if bln_scale:
+            # scaler fit on the train part of the fold only, applied in place to the float arrays
+            scaler = FeatureScaler().fit(X_train_tmp)
+            scaler.transform_array(arr_train)
+            scaler.transform_array(arr_valid)
+
+        dct_cache['FOLDS'][k] = {
+            'X_TRAIN': arr_train,
+            'X_VALID': arr_valid,
+            'Y_TRAIN': arr_y[item['TRAIN']],
+            'Y_VALID': arr_y[item['VALIDATION']],
+        }
+
+    return dct_cache
+
+
+def _init_worker(dct_cache: dict) -> None:
+    """
+    Initializer of the process pool: the fold cache is sent once to each worker instead of once per task.
+    :param dct_cache: fold cache built by _build_fold_cache.
+    :return:
+    """
+
+    _dct_worker['CACHE'] = dct_cache
+
+    return
+
+
+def _fit_logit_pvalue(dct_cache: dict, lst_col: list, k, maxiter: int) -> tuple:
+    """
+    Fit a logistic model on the train part of a fold.
+    :param dct_cache: fold cache built by _build_fold_cache.
+    :param lst_col: columns to use in the model.
+    :param k: label of the fold.
+    :param maxiter: maximum number of iterations.
+    :return: the fitted model (None if the fit failed) and its pvalues (nan if the fit failed).
+    """
+
+    dct_fold = dct_cache['FOLDS'][k]
+    idx_col = [dct_cache['POSITION'][c] for c in lst_col]
+
+    try:
+        lgt_class = sm.Logit(dct_fold['Y_TRAIN'], dct_fold['X_TRAIN'][:, idx_col])
+        model = lgt_class.fit(disp=False, maxiter=maxiter)
+    except Exception as e:
+        logging.error(f"CV ERROR - pvalues to nan - {e}")
+        return None, pd.Series(np.nan, index=lst_col)
+
+    return model, pd.Series(model.pvalues, index=lst_col)
+
+
+def _fit_logit_fold(dct_cache: dict, lst_col: list, k, maxiter: int) -> dict:
+    """
+    Fit a logistic model on the train part of a fold and evaluate it on the validation part.
+    A failure of the metric (e.g. a validation part with a single class) does not discard the pvalues of the fit.
+    :param dct_cache: fold cache built by _build_fold_cache.
+    :param lst_col: columns to use in the model.
+    :param k: label of the fold.
+    :param maxiter: maximum number of iterations.
+    :return: dictionary with the pvalues and the metric of the fold.
+    """
+
+    dct_tmp_cv = {'ITER': k, 'METRIC': np.nan}
+
+    model, dct_tmp_cv['PVALUE'] = _fit_logit_pvalue(dct_cache, lst_col, k, maxiter)
+    if model is None:
+        return dct_tmp_cv
+
+    dct_fold = dct_cache['FOLDS'][k]
+    idx_col = [dct_cache['POSITION'][c] for c in lst_col]
+
+    try:
+        y_pred = model.predict(dct_fold['X_VALID'][:, idx_col])
+        dct_tmp_cv['METRIC'] = roc_auc_score(dct_fold['Y_VALID'], y_pred)
+    except Exception as e:
+        logging.error(f"CV ERROR - metric to nan - {e}")
+
+    return dct_tmp_cv
+
+
+def _solve_batch(arr_a: np.ndarray, arr_b: np.ndarray) -> tuple:
+    """
+    Solve a batch of linear systems. Singular systems do not stop the others: they are flagged instead.
+    :param arr_a: matrices of the systems, shape (n_models, n_feat, n_feat).
+    :param arr_b: known terms of the systems, shape (n_models, n_feat) or (n_models, n_feat, n_rhs).
+    :return: solutions of the systems (nan for the singular ones) and boolean array of the solved systems.
+    """
+
+    bln_vec = arr_b.ndim == 2
+    if bln_vec:
+        arr_b = arr_b[..., None]
+
+    bln_ok = np.ones(arr_a.shape[0], dtype=bool)
+    try:
+        arr_sol = np.linalg.solve(arr_a, arr_b)
+    except np.linalg.LinAlgError:
+        arr_sol = np.full(arr_b.shape, np.nan)
+        for i in range(arr_a.shape[0]):
+            try:
+                arr_sol[i] = np.linalg.solve(arr_a[i], arr_b[i])
+            except np.linalg.LinAlgError:
+                bln_ok[i] = False
+
+    if bln_vec:
+        arr_sol = arr_sol[..., 0]
+
+    return arr_sol, bln_ok
+
+
+def _logit_hessian(arr_x: np.ndarray, arr_w: np.ndarray, arr_beta: np.ndarray) -> tuple:
+    """
+    Probabilities and (minus) hessian of the log-likelihood for a batch of logistic models.
+    :param arr_x: design matrices, shape (n_models, n_obs, n_feat).
+    :param arr_w: weights of the observations, shape (n_models, n_obs).
+    :param arr_beta: coefficients, shape (n_models, n_feat).
+    :return: probabilities, shape (n_models, n_obs), and hessians, shape (n_models, n_feat, n_feat).
+    """
+
+    arr_mu = expit(np.einsum('mnp,mp->mn', arr_x, arr_beta))
+    arr_hess = np.einsum('mnp,mnq->mpq', arr_x * (arr_w * arr_mu * (1 - arr_mu))[..., None], arr_x)
+
+    return arr_mu, arr_hess
+
+
+def _irls_logit_batch(
+        arr_x: np.ndarray,
+        arr_y: np.ndarray,
+        arr_w: np.ndarray = None,
+        arr_beta: np.ndarray = None,
+        maxiter: int = 5000,
+        tol: float = 1e-8,
+) -> tuple:
+    """
+    Fit a batch of logistic models at once with the Newton-Raphson (IRLS) method used by statsmodels Logit.
+    The models of the batch share the number of observations and features: models with fewer observations are padded
+    with rows having weight 0.
+    :param arr_x: design matrices, shape (n_models, n_obs, n_feat).
+    :param arr_y: target variables, shape (n_models, n_obs) or (n_obs,) when shared by all the models.
+    :param arr_w: weights of the observations (0 or 1), same shape of arr_y. None means all ones.
+    :param arr_beta: starting coefficients (warm start), shape (n_models, n_feat). None means all zeros.
+    :param maxiter: maximum number of iterations.
+    :param tol: convergence is reached when all the coefficients change less than tol.
+    :return: coefficients, Wald pvalues and boolean array of the models correctly fitted.
+    """
+
+    n_mod, n_obs, n_feat = arr_x.shape
+    arr_y = np.broadcast_to(arr_y, (n_mod, n_obs))
+    arr_w = np.ones((n_mod, n_obs)) if arr_w is None else np.broadcast_to(arr_w, (n_mod, n_obs))
+    arr_beta = np.zeros((n_mod, n_feat)) if arr_beta is None else np.array(arr_beta, dtype=float)
+
+    bln_ok = np.ones(n_mod, dtype=bool)
+    bln_act = np.ones(n_mod, dtype=bool)
+
+    for _ in range(maxiter):
+
+        idx = np.flatnonzero(bln_act)
+        if idx.size == 0:
+            break
+
+        arr_mu, arr_hess = _logit_hessian(arr_x[idx], arr_w[idx], arr_beta[idx])
+        arr_grad = np.einsum('mnp,mn->mp', arr_x[idx], arr_w[idx] * (arr_y[idx] - arr_mu))
+
+        arr_step, bln_solved = _solve_batch(arr_hess, arr_grad)
+        bln_solved &= np.isfinite(arr_step).all(axis=1)
+        arr_beta[idx[bln_solved]] += arr_step[bln_solved]
+
+        bln_ok[idx[~bln_solved]] = False
+        bln_act[idx[~bln_solved]] = False
+        bln_act[idx[bln_solved & (np.abs(arr_step).max(axis=1, initial=0) < tol)]] = False
+
+    if bln_act.any():
+        logging.debug(f'IRLS - {bln_act.sum()} MODELS NOT CONVERGED AFTER {maxiter} ITERATIONS')
+
+    # Wald test: the covariance matrix is the inverse of the hessian in the estimated coefficients
+    arr_pvalue = np.full((n_mod, n_feat), np.nan)
+    idx = np.flatnonzero(bln_ok)
+    if idx.size:
+        _, arr_hess = _logit_hessian(arr_x[idx], arr_w[idx], arr_beta[idx])
+        arr_cov, bln_inv = _solve_batch(arr_hess, np.broadcast_to(np.eye(n_feat), arr_hess.shape))
+        arr_se = np.sqrt(np.diagonal(arr_cov, axis1=1, axis2=2))
+        arr_pvalue[idx] = 2 * norm.sf(np.abs(arr_beta[idx] / arr_se))
+        bln_ok[idx[~bln_inv]] = False
+
+    arr_beta[~bln_ok] = np.nan
+
+    return arr_beta, arr_pvalue, bln_ok
+
+
+def _auc_batch(arr_y: np.ndarray, arr_score: np.ndarray) -> np.ndarray:
+    """
+    ROC AUC of a batch of scores via the Mann-Whitney statistic (ties get the average rank, as in roc_auc_score).
+    :param arr_y: binary target variable, shape (n_obs,).
+    :param arr_score: scores to evaluate, shape (n_models, n_obs).
+    :return: the AUC of each model, shape (n_models,).
+    """
+
+    bln_pos = arr_y == 1
+    n_pos = bln_pos.sum()
+    n_neg = arr_y.size - n_pos
+    arr_rank = rankdata(arr_score, axis=1)
+
+    return (arr_rank[:, bln_pos].sum(axis=1) - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+
+def _fit_irls_fold_frw(
+        dct_cache: dict,
+        lst_col_sel: list,
+        lst_col_tst: list,
+        k,
+        maxiter: int,
+        arr_beta_sel: np.ndarray = None,
+) -> list:
+    """
+    Fit, on the same fold, the models obtained adding each candidate to the selected columns.
+    The candidates are stacked and fitted in batch by the IRLS solver.
+    :param dct_cache: fold cache built by _build_fold_cache.
+    :param lst_col_sel: columns already selected.
+    :param lst_col_tst: candidate columns.
+    :param k: label of the fold.
+    :param maxiter: maximum number of iterations.
+    :param arr_beta_sel: coefficients of the selected columns fitted at the previous iteration (warm start).
+    :return: list with, for each candidate, the pvalues, the metric and the coefficients of the fold.
+    """
+
+    dct_fold = dct_cache['FOLDS'][k]
+    arr_pos_sel = np.array([dct_cache['POSITION'][c] for c in lst_col_sel], dtype=int)
+    arr_pos_tst = np.array([dct_cache['POSITION'][c] for c in lst_col_tst], dtype=int)
+
+    n_sel = len(lst_col_sel)
+    arr_beta0 = np.zeros(n_sel + 1)
+    if arr_beta_sel is not None and np.isfinite(arr_beta_sel).all():
+        arr_beta0[:n_sel] = arr_beta_sel
+
+    # candidates are processed in chunks to bound the size of the stacked design matrices
+    n_chunk = max(1, _IRLS_MAX_ELEMENTS // (dct_fold['X_TRAIN'].shape[0] * (n_sel + 1)))
+
+    lst_res = []
+    for start in range(0, len(lst_col_tst), n_chunk):
+
+        arr_pos = arr_pos_tst[start:start + n_chunk]
+        idx_col = np.column_stack([np.broadcast_to(arr_pos_sel, (arr_pos.size, n_sel)), arr_pos])
+
+        arr_beta, arr_pvalue, bln_ok = _irls_logit_batch(
+            arr_x=dct_fold['X_TRAIN'][:, idx_col].transpose(1, 0, 2),
+            arr_y=dct_fold['Y_TRAIN'],
+            arr_beta=np.broadcast_to(arr_beta0, (arr_pos.size, n_sel + 1)),
+            maxiter=maxiter,
+        )
+        arr_score = expit(np.einsum('nmp,mp->mn', dct_fold['X_VALID'][:, idx_col], arr_beta))
+        arr_metric = _auc_batch(dct_fold['Y_VALID'], arr_score)
+
+        for i, col in enumerate(lst_col_tst[start:start + n_chunk]):
+            lst_col_tmp = lst_col_sel + [col]
+            if not bln_ok[i]:
+                logging.error(f"CV ERROR - pvalue and metric to nan - IRLS failed for {lst_col_tmp}")
+            lst_res.append({
+                'ITER': k,
+                'PVALUE': pd.Series(arr_pvalue[i], index=lst_col_tmp),
+                'METRIC': arr_metric[i] if bln_ok[i] else np.nan,
+                'COEF': arr_beta[i],
+            })
+
+    return lst_res
+
+
+def _fit_irls_back(dct_cache: dict, lst_col: list, maxiter: int, dct_beta: dict) -> tuple:
+    """
+    Fit, on every fold, the model using the columns desired. The folds are stacked and fitted in batch by the IRLS
+    solver: folds with fewer observations are padded with rows having weight 0.
+    :param dct_cache: fold cache built by _build_fold_cache.
+    :param lst_col: columns to use in the model.
+    :param maxiter: maximum number of iterations.
+    :param dct_beta: for each fold, the coefficients fitted at the previous iteration, as pd.Series (warm start).
+    :return: dictionary with the pvalues of each fold and dictionary with the coefficients of each fold.
+    """
+
+    dct_folds = dct_cache['FOLDS']
+    idx_col = [dct_cache['POSITION'][c] for c in lst_col]
+
+    n_max = max(dct_fold['X_TRAIN'].shape[0] for dct_fold in dct_folds.values())
+    arr_x = np.zeros((len(dct_folds), n_max, len(lst_col)))
+    arr_y = np.zeros((len(dct_folds), n_max))
+    arr_w = np.zeros((len(dct_folds), n_max))
+    arr_beta0 = np.zeros((len(dct_folds), len(lst_col)))
+
+    for i, (k, dct_fold) in enumerate(dct_folds.items()):
+        n_obs = dct_fold['X_TRAIN'].shape[0]
+        arr_x[i, :n_obs] = dct_fold['X_TRAIN'][:, idx_col]
+        arr_y[i, :n_obs] = dct_fold['Y_TRAIN']
+        arr_w[i, :n_obs] = 1
+        if k in dct_beta and dct_beta[k].notna().all():
+            arr_beta0[i] = dct_beta[k].reindex(lst_col).to_numpy()
+
+    arr_beta, arr_pvalue, bln_ok = _irls_logit_batch(arr_x, arr_y, arr_w, arr_beta0, maxiter=maxiter)
+
+    dct_pvalue = {}
+    dct_coef = {}
+    for i, k in enumerate(dct_folds):
+        if not bln_ok[i]:
+            logging.error(f"CV ERROR - pvalues to nan - IRLS failed on fold {k}")
+        dct_pvalue[k] = pd.Series(arr_pvalue[i], index=lst_col)
+        dct_coef[k] = pd.Series(arr_beta[i], index=lst_col)
+
+    return dct_pvalue, dct_coef
+
+
+def _score_test_fold(
+        dct_cache: dict,
+        lst_col_sel: list,
+        lst_col_tst: list,
+        k,
+        maxiter: int,
+        arr_beta_sel: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Rao score test, on the train part of a fold, for adding each candidate to the model fitted on the selected columns.
+    Only the current model is fitted: the statistics of all the candidates come from its residuals and weights.
+    :param dct_cache: fold cache built by _build_fold_cache.
+    :param lst_col_sel: columns already selected.
+    :param lst_col_tst: candidate columns.
+    :param k: label of the fold.
+    :param maxiter: maximum number of iterations.
+    :param arr_beta_sel: coefficients of the selected columns fitted at the previous iteration (warm start).
+    :return: the chi-squared statistic (1 degree of freedom) of each candidate. nan if the current model fails.
+    """
+
+    dct_fold = dct_cache['FOLDS'][k]
+    arr_z = dct_fold['X_TRAIN'][:, [dct_cache['POSITION'][c] for c in lst_col_tst]]
+    arr_y = dct_fold['Y_TRAIN']
+
+    if lst_col_sel:
+        arr_x = dct_fold['X_TRAIN'][:, [dct_cache['POSITION'][c] for c in lst_col_sel]]
+        arr_beta, _, bln_ok = _irls_logit_batch(
+            arr_x=arr_x[None],
+            arr_y=arr_y,
+            arr_beta=None if arr_beta_sel is None or not np.isfinite(arr_beta_sel).all() else arr_beta_sel[None],
+            maxiter=maxiter,
+        )
+        if not bln_ok[0]:
+            return np.full(len(lst_col_tst), np.nan)
+        arr_mu, arr_hess = _logit_hessian(arr_x[None], np.ones((1, arr_y.size)), arr_beta)
+        arr_mu, arr_hess = arr_mu[0], arr_hess[0]
+    else:
+        arr_x = np.empty((arr_y.size, 0))
+        arr_mu = np.full(arr_y.size, 0.5)
+        arr_hess = np.empty((0, 0))
+
+    # score and its variance, net of the information already carried by the selected columns
+    arr_v = arr_mu * (1 - arr_mu)
+    arr_score = arr_z.T @ (arr_y - arr_mu)
+    arr_cross = arr_x.T @ (arr_z * arr_v[:, None])
+    arr_var = (arr_z * arr_z * arr_v[:, None]).sum(axis=0)
+    if lst_col_sel:
+        arr_var = arr_var - (arr_cross * np.linalg.solve(arr_hess, arr_cross)).sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arr_stat = np.where(arr_var > 0, arr_score ** 2 / arr_var, np.nan)
+
+    return arr_stat
+
+
+def _run_tasks(executor, lst_task: list, dct_cache: dict, n_workers: int) -> list:
+    """
+    Run fold-level fits, serially or in the process pool. The results are in the same order as the tasks.
+    :param executor: the process pool, None to run serially.
+    :param lst_task: list of tuples with the function to run and its arguments, fold cache excluded.
+    :param dct_cache: fold cache built by _build_fold_cache.
+    :param n_workers: number of processes in the pool.
+    :return: list with the output of each task.
+    """
+
+    if executor is None:
+        return [fun(dct_cache, *tpl_args) for fun, tpl_args in lst_task]
+
+    chunksize = max(1, len(lst_task) // (4 * n_workers))
+
+    return list(executor.map(_run_worker, lst_task, chunksize=chunksize))
+
+
+def _run_worker(tpl_task: tuple):
+    """
+    Run a fold-level fit inside the workers of the process pool, using the fold cache sent by _init_worker.
+    :param tpl_task: tuple with the function to run and its arguments, fold cache excluded.
+    :return: the output of the function.
+    """
+
+    fun, tpl_args = tpl_task
+
+    return fun(_dct_worker['CACHE'], *tpl_args)
+
+
+def _save_checkpoint(path_checkpoint: str, dct_ckpt: dict) -> None:
+    """
+    Write the checkpoint of a stepwise procedure. The file is replaced atomically, so that a worker dying while writing
+    leaves the previous checkpoint intact.
+    :param path_checkpoint: path of the checkpoint file.
+    :param dct_ckpt: state of the procedure to persist.
+    :return:
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(path_checkpoint)), exist_ok=True)
+    str_tmp = tmp_path(path_checkpoint)
+    pd.to_pickle(dct_ckpt, str_tmp)
+    os.replace(str_tmp, path_checkpoint)
+
+    return
+
+
+def _load_checkpoint(path_checkpoint: str, str_hash: str):
+    """
+    Read the checkpoint of a stepwise procedure, if it exists and it was produced with the same inputs.
+    :param path_checkpoint: path of the checkpoint file.
+    :param str_hash: content hash of the inputs of the current run.
+    :return: the state persisted, or None.
+    """
+
+    if not os.path.exists(path_checkpoint):
+        return None
+
+    dct_ckpt = pd.read_pickle(path_checkpoint)
+    if dct_ckpt.get('HASH') != str_hash:
+        logging.warning(f'CHECKPOINT {path_checkpoint} IGNORED - INPUTS CHANGED')
+        return None
+
+    return dct_ckpt
 
 
 def stepwise_logit_frw(
@@ -18,6 +484,9 @@ def stepwise_logit_frw(
         maxiter: int = 5000,
         ths_delta_gain: float = 0.01,
         scoring: str = 'roc_auc',
+        n_jobs: int = 1,
+        solver: str = 'statsmodels',
+        n_screen: int = None,
 ) -> dict:
     """
     Stepwise Forward procedure for feature selection.
@@ -29,113 +498,144 @@ def stepwise_logit_frw(
     ths_delta_gain.
     :param X_train: train dataset.
     :param y_train: target variable for training.
-    :param dct_cv: dictionary with the indexes needed to create the folds during the cross validation phase.
+    :param dct_cv: dictionary with the indexes needed to create the folds during the cross validation phase, as
+        returned by split_data.
     :param bln_scale: if True, data are scaled via standard scaling approach.
     :param pvalue: significance level of the test.
     :param maxiter: maximum number of iterations.
     :param ths_delta_gain: minimum level of increment needed to add the feature to the model.
     :param scoring: metric to evaluate the increment. Allowed values are roc_auc and f1_score.
+    :param n_jobs: number of processes fitting the (candidate, fold) models in parallel. 1 means no parallelism,
+        -1 means all the available cores. The results do not depend on the number of processes.
+    :param solver: how to fit the logistic models. Allowed values are statsmodels (one Logit per candidate and fold)
+        and irls (all the candidates of a fold fitted in batch, warm started from the previous iteration).
+    :param n_screen: if set, at each iteration all the candidates are ranked by the median (across folds) of the Rao
+        score test statistic of the current model, and only the best n_screen are refitted in cross validation.
+        None means that all the candidates are refitted.
     :return: dictionary with the statistics of the model.
     """
 
     if scoring not in ['f1', 'roc_auc']:
         raise ValueError('PLEASE SELECT A PROPER METRIC')
+    if solver not in ['statsmodels', 'irls']:
+        raise ValueError("solver not in ['statsmodels', 'irls']")
+    if n_screen is not None and n_screen < 1:
+        raise ValueError('n_screen must be None or a positive integer')
+    if n_jobs == 0 or n_jobs < -1:
+        raise ValueError('n_jobs must be a positive integer or -1')
+
+    # folds are scaled and turned to arrays once for all the iterations
+    dct_cache = _build_fold_cache(X_train=X_train, y_train=y_train, dct_cv=dct_cv, bln_scale=bln_scale)
+
+    # the pool is created once and reused across all the iterations. It is shut down whatever happens.
+    executor = None
+    n_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(dct_cache,),
+        )
 
     lst_col_tst = X_train.columns.tolist()
     lst_col_sel = []
     dct_out = {'ALL_FEATURES': lst_col_tst}
     dct_metric = {'ITER_0': 0}
+    dct_beta = {}
     bln_go = True
     counter = 1
 
-    while bln_go:
-
-        dct_out[counter] = {}
-
-        lst_model_tmp = []
-        logging.debug(f"ITER {counter} - SELECTED: {lst_col_sel} - TO TEST: {lst_col_tst}")
-
-        for col in lst_col_tst:
-
-            logging.debug(f"ITER {counter} - TESTING: {col}")
-            lst_col_tmp = lst_col_sel + [col]
-            lst_tmp_cv = []
-
-            # CROSS VALIDATION
-            for k, item in dct_cv.items():
-
-                dct_tmp_cv = {'ITER': k}
-
-                idx_train = item['TRAIN']
-                idx_valid = item['VALIDATION']
-
-                X_train_tmp = X_train.iloc[idx_train].copy()
-                X_train_tmp = X_train_tmp[lst_col_tmp].copy()
-
-                X_test_tmp = X_train.iloc[idx_valid].copy()
-                X_test_tmp = X_test_tmp[lst_col_tmp].copy()
-
-                y_train_tmp = y_train.iloc[idx_train].copy()
-                y_test_tmp = y_train.iloc[idx_valid].copy()
-
-                if bln_scale:
-                    X_train_tmp, X_test_tmp = scaling_data(X_train=X_train_tmp, X_test=X_test_tmp)
-
-                try:
-                    lgt_class = sm.Logit(y_train_tmp, X_train_tmp)
-                    model = lgt_class.fit(disp=False, maxiter=maxiter)
-                    y_pred = model.predict(X_test_tmp)
-                    dct_tmp_cv['PVALUE'] = model.pvalues
-                    dct_tmp_cv['METRIC'] = roc_auc_score(y_test_tmp, y_pred)
-                except Exception as e:
-                    logging.error(f"CV ERROR - pvalue to nan and metric to 0.5 - {e}")
-                    dct_tmp_cv['PVALUE'] = [np.nan] * len(X_train_tmp.columns)
-                    dct_tmp_cv['METRIC'] = np.nan
-
-                lst_tmp_cv.append(dct_tmp_cv)
-
-            dtf_sum = pd.DataFrame.from_records({dct['ITER']: dct['PVALUE'] for dct in lst_tmp_cv})
-            dtf_sum['MEDIAN'] = dtf_sum.apply(
-                lambda x: x.median() if x.notna().sum() >= len(dct_cv) / 2 else np.nan, axis=1
-            )
-            dtf_sum.sort_values(by='MEDIAN', ascending=False, inplace=True)
-
-            if all(dtf_sum['MEDIAN'] <= pvalue):
-                metric = pd.Series([dct['METRIC'] for dct in lst_tmp_cv]).median()
+    try:
+        while bln_go:
+
+            dct_out[counter] = {}
+
+            lst_model_tmp = []
+            logging.debug(f"ITER {counter} - SELECTED: {lst_col_sel} - TO TEST: {lst_col_tst}")
+
+            # SCREENING: candidates ranked by the score test, only the best ones go to the cross validation
+            lst_col_fit = lst_col_tst
+            if n_screen is not None and len(lst_col_tst) > n_screen:
+                lst_task = [(_score_test_fold, (lst_col_sel, lst_col_tst, k, maxiter, dct_beta.get(k))) for k in dct_cv]
+                ser_stat = pd.Series(np.nanmedian(_run_tasks(executor, lst_task, dct_cache, n_workers), axis=0))
+                ser_stat.index = lst_col_tst
+                lst_col_fit = ser_stat.sort_values(ascending=False, na_position='last').index[:n_screen].tolist()
+                logging.debug(f"ITER {counter} - SCREENED: {lst_col_fit}")
+
+            # CROSS VALIDATION: results are kept in the same order as the tasks, candidate by candidate and fold by
+            # fold. statsmodels: one task for each (candidate, fold) pair. irls: one task for each fold, fitting all
+            # candidates.
+            if solver == 'irls':
+                lst_task = [
+                    (_fit_irls_fold_frw, (lst_col_sel, lst_col_fit, k, maxiter, dct_beta.get(k))) for k in dct_cv
+                ]
             else:
-                logging.debug(f"{col} - PVALUES NOT RELIABLE")
-                metric = 0
-
-            dct_tmp_cv = {
-                'COLUMNS': lst_col_tmp,
-                'TESTED': col,
-                'METRIC_NAME': scoring,
-                'METRIC_VALUE': metric,
-            }
-
-            lst_model_tmp.append(dct_tmp_cv)
-
-        lst_model_tmp = sorted(lst_model_tmp, key=lambda d: d['METRIC_VALUE'], reverse=True)
-        best_model = lst_model_tmp[0]
-        dct_metric[f'ITER_{counter}'] = best_model['METRIC_VALUE']
-        flt_gain = dct_metric[f'ITER_{counter}'] - dct_metric[f'ITER_{counter - 1}']
-
-        best_col = best_model['TESTED']
-        dct_out[counter]['GAIN'] = flt_gain
-
-        if flt_gain <= ths_delta_gain:
-            logging.debug(f'STOPPING the loop at ITER {counter} - not provided at least {ths_delta_gain} for {scoring}')
-            dct_out[counter]['WINNER'] = None
-            bln_go = False
-        else:
-            logging.debug(f"ITER: {counter} - Winner: {best_col} - NEW {scoring}: {dct_metric[f'ITER_{counter}']}")
-            lst_col_sel.append(best_col)
-            lst_col_tst.remove(best_col)
-            dct_out[counter]['WINNER'] = best_col
-            if not lst_col_tst:
+                lst_task = [
+                    (_fit_logit_fold, (lst_col_sel + [col], k, maxiter)) for col in lst_col_fit for k in dct_cv
+                ]
+
+            lst_res = _run_tasks(executor, lst_task, dct_cache, n_workers)
+
+            if solver == 'irls':
+                lst_res = [lst_fold[i] for i in range(len(lst_col_fit)) for lst_fold in lst_res]
+
+            for i, col in enumerate(lst_col_fit):
+
+                logging.debug(f"ITER {counter} - TESTING: {col}")
+                lst_col_tmp = lst_col_sel + [col]
+                lst_tmp_cv = lst_res[i * len(dct_cv):(i + 1) * len(dct_cv)]
+
+                dtf_sum = pd.DataFrame.from_records({dct['ITER']: dct['PVALUE'] for dct in lst_tmp_cv})
+                dtf_sum['MEDIAN'] = dtf_sum.apply(
+                    lambda x: x.median() if x.notna().sum() >= len(dct_cv) / 2 else np.nan, axis=1
+                )
+                dtf_sum.sort_values(by='MEDIAN', ascending=False, inplace=True)
+
+                if all(dtf_sum['MEDIAN'] <= pvalue):
+                    metric = pd.Series([dct['METRIC'] for dct in lst_tmp_cv]).median()
+                else:
+                    logging.debug(f"{col} - PVALUES NOT RELIABLE")
+                    metric = 0
+
+                dct_tmp_cv = {
+                    'COLUMNS': lst_col_tmp,
+                    'TESTED': col,
+                    'METRIC_NAME': scoring,
+                    'METRIC_VALUE': metric,
+                }
+
+                lst_model_tmp.append(dct_tmp_cv)
+
+            lst_model_tmp = sorted(lst_model_tmp, key=lambda d: d['METRIC_VALUE'], reverse=True)
+            best_model = lst_model_tmp[0]
+            dct_metric[f'ITER_{counter}'] = best_model['METRIC_VALUE']
+            flt_gain = dct_metric[f'ITER_{counter}'] - dct_metric[f'ITER_{counter - 1}']
+
+            best_col = best_model['TESTED']
+            dct_out[counter]['GAIN'] = flt_gain
+
+            if flt_gain <= ths_delta_gain:
+                logging.debug(
+                    f'STOPPING the loop at ITER {counter} - not provided at least {ths_delta_gain} for {scoring}'
+                )
+                dct_out[counter]['WINNER'] = None
                 bln_go = False
             else:
-                counter = counter + 1
+                logging.debug(f"ITER: {counter} - Winner: {best_col} - NEW {scoring}: {dct_metric[f'ITER_{counter}']}")
+                if solver == 'irls':
+                    i_best = lst_col_fit.index(best_col)
+                    lst_best = lst_res[i_best * len(dct_cv):(i_best + 1) * len(dct_cv)]
+                    dct_beta = {dct['ITER']: dct['COEF'] for dct in lst_best}
+                lst_col_sel.append(best_col)
+                lst_col_tst.remove(best_col)
+                dct_out[counter]['WINNER'] = best_col
+                if not lst_col_tst:
+                    bln_go = False
+                else:
+                    counter = counter + 1
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
     dct_out['COL_SELECT'] = lst_col_sel
     dct_out['COL_REMOVE'] = []
@@ -153,6 +653,8 @@ def stepwise_logit_back(
         bln_scale: bool = True,
         pvalue: float = 0.05,
         maxiter: int = 5000,
+        solver: str = 'statsmodels',
+        path_checkpoint: str = None,
 ):
     """
     Stepwise backward procedure for feature selection.
@@ -161,23 +663,52 @@ def stepwise_logit_back(
     The procedure stops when all pvalue are significant.
     :param X_train: train dataset.
     :param y_train: target variable for training.
-    :param dct_cv: dictionary with the indexes needed to create the folds during the cross validation phase.
+    :param dct_cv: dictionary with the indexes needed to create the folds during the cross validation phase, as
+        returned by split_data.
     :param bln_scale: if True, data are scaled via standard scaling approach.
     :param pvalue: significance level of the test.
     :param maxiter: maximum number of iterations.
+    :param solver: how to fit the logistic models. Allowed values are statsmodels (one Logit per fold) and irls (all
+        the folds fitted in batch, warm started from the previous iteration).
+    :param path_checkpoint: if set, the state of the procedure is saved in this file at the end of each iteration.
+        A run with the same inputs restarts from the last completed iteration, or returns directly the final result
+        when the procedure was already completed.
     :return: dictionary with the statistics of the model.
     """
 
+    if solver not in ['statsmodels', 'irls']:
+        raise ValueError("solver not in ['statsmodels', 'irls']")
+
     lst_col_rem = []
     lst_col_sel = sorted(X_train.columns.tolist())
 
     bln_go = True
     counter = 1
     dct_out = {}
+    dct_beta = {}
+
+    if path_checkpoint is not None:
+        str_hash = hash_content(X_train, y_train, dct_cv, [bln_scale, pvalue, maxiter, solver])
+        dct_ckpt = _load_checkpoint(path_checkpoint, str_hash)
+
+        if dct_ckpt is not None and dct_ckpt['COMPLETED']:
+            logging.info(f"CHECKPOINT - INPUTS UNCHANGED, COLUMNS SELECTED: {dct_ckpt['DCT_OUT']['COL_SELECT']}")
+            return dct_ckpt['DCT_OUT']
+
+        if dct_ckpt is not None:
+            logging.info(f"CHECKPOINT - RESUMING FROM ITER {dct_ckpt['COUNTER']}")
+            dct_out = dct_ckpt['DCT_OUT']
+            lst_col_sel = dct_ckpt['SELECTED']
+            lst_col_rem = dct_ckpt['REMOVED']
+            dct_beta = dct_ckpt['BETA']
+            counter = dct_ckpt['COUNTER']
 
     logging.info(f'MODEL - STARTING FEATURES: {len(lst_col_sel)}')
     logging.debug(f'MODEL - STARTING FEATURES: {lst_col_sel}')
 
+    # folds are scaled and turned to arrays once for all the iterations
+    dct_cache = _build_fold_cache(X_train=X_train, y_train=y_train, dct_cv=dct_cv, bln_scale=bln_scale)
+
     while bln_go:
 
         dct_out[counter] = {}
@@ -185,28 +716,12 @@ def stepwise_logit_back(
         dct_out[counter]['REMOVED'] = lst_col_rem
         dct_tmp = {}
 
-        for k, item in dct_cv.items():
-
-            idx_train = item['TRAIN']
-            idx_valid = item['VALIDATION']
-
-            X_train_tmp = X_train.iloc[idx_train].copy()
-            X_train_tmp = X_train_tmp[lst_col_sel].copy()
-            y_train_tmp = y_train.iloc[idx_train].copy()
-
-            X_test_tmp = X_train.iloc[idx_valid].copy()
-            # y_test_tmp = y_train.iloc[idx_valid].copy()
-
-            if bln_scale:
-                X_train_tmp, X_test_tmp = scaling_data(X_train=X_train_tmp, X_test=X_test_tmp)
-
-            try:
-                lgt_class = sm.Logit(y_train_tmp, X_train_tmp)
-                model = lgt_class.fit(disp=False, maxiter=maxiter)
-                dct_tmp[k] = model.pvalues
-            except Exception as e:
-                logging.error(f"CV ERROR - pvalues to nan - {e}")
-                dct_tmp[k] = [np.nan] * len(X_train_tmp.columns)
+        if solver == 'irls':
+            dct_tmp, dct_beta = _fit_irls_back(dct_cache, lst_col_sel, maxiter, dct_beta)
+        else:
+            for k in dct_cv:
+                # only the pvalues are needed: the model is not evaluated on the validation part
+                _, dct_tmp[k] = _fit_logit_pvalue(dct_cache, lst_col_sel, k, maxiter)
 
         dtf_sum = pd.DataFrame.from_dict(dct_tmp)
         dtf_sum['MEDIAN'] = dtf_sum.median(axis=1)
@@ -227,9 +742,23 @@ def stepwise_logit_back(
 
             counter = counter + 1
 
+        if path_checkpoint is not None and bln_go:
+            _save_checkpoint(path_checkpoint, {
+                'HASH': str_hash,
+                'COMPLETED': False,
+                'COUNTER': counter,
+                'SELECTED': lst_col_sel,
+                'REMOVED': lst_col_rem,
+                'BETA': dct_beta,
+                'DCT_OUT': dct_out,
+            })
+
     dct_out['COL_SELECT'] = lst_col_sel
     dct_out['COL_REMOVE'] = lst_col_rem
-    
+
+    if path_checkpoint is not None:
+        _save_checkpoint(path_checkpoint, {'HASH': str_hash, 'COMPLETED': True, 'DCT_OUT': dct_out})
+
     logging.info(f"P-VALUES ARE GOOD")
     logging.info(f"COLUMNS REMOVED: {lst_col_rem}")
     logging.info(f"COLUMNS SELECTED: {lst_col_sel}")
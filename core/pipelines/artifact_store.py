@@ -0,0 +1,191 @@
+import json
+import joblib
+import logging
+import numpy as np
+import os
+import pandas as pd
+import uuid
+
+from datetime import datetime
+
+from core.utils.files import write_json
+from core.utils.hashing import hash_content, hash_file
+
+
+MANIFEST = 'manifest.json'
+
+
+def new_run_id() -> str:
+    """
+    Identifier of a new training run: its start time, to sort the runs, and a random suffix, so that concurrent runs
+    never share it.
+    :return: the run id.
+    """
+
+    return f'{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}'
+
+
+def run_path(str_run_id: str) -> str:
+    """
+    Folder of the outputs of a run.
+    :param str_run_id: the run id.
+    :return: the path of the folder.
+    """
+
+    return os.environ['PATH_OUT_MOD'] + f'RUNS/{str_run_id}/'
+
+
+def save_frame(dtf_in, str_path: str) -> dict:
+    """
+    Store a dataframe (or a series) as one .npy file per column and one for the index, so that it can be loaded back
+    memory mapped, without reading nor copying the data. A string index (e.g. the zero-padded ID of HR) is stored as
+    fixed-width unicode, which needs no pickle either.
+    :param dtf_in: dataframe or series with numeric or boolean columns, and a numeric or string index.
+    :param str_path: folder of the files.
+    :return: the description of the stored frame, needed by load_frame.
+    """
+
+    bln_series = isinstance(dtf_in, pd.Series)
+    dtf_work = dtf_in.to_frame() if bln_series else dtf_in
+
+    lst_obj = [str(c) for c, t in dtf_work.dtypes.items() if not (pd.api.types.is_numeric_dtype(t) or t == bool)]
+    if lst_obj:
+        raise ValueError(f'ONLY NUMERIC COLUMNS CAN BE STORED: {lst_obj}')
+
+    idx = dtf_work.index
+    bln_str_index = not pd.api.types.is_numeric_dtype(idx.dtype)
+    if bln_str_index:
+        if isinstance(idx, pd.MultiIndex) or idx.hasnans or pd.api.types.infer_dtype(idx) != 'string':
+            raise ValueError(f'ONLY NUMERIC OR STRING INDEX WITHOUT MISSING VALUES CAN BE STORED: {idx.dtype}')
+        arr_index = idx.to_numpy(dtype=str)
+    else:
+        arr_index = idx.to_numpy()
+
+    os.makedirs(str_path, exist_ok=True)
+    np.save(str_path + 'INDEX.npy', arr_index)
+    for i in range(dtf_work.shape[1]):
+        np.save(str_path + f'{i:05d}.npy', dtf_work.iloc[:, i].to_numpy())
+
+    return {
+        'KIND': 'SERIES' if bln_series else 'FRAME',
+        'COLUMNS': dtf_work.columns.tolist(),
+        'INDEX': dtf_work.index.name,
+        'INDEX_KIND': 'STR' if bln_str_index else 'NUMERIC',
+        'SHAPE': list(dtf_work.shape),
+    }
+
+
+def load_frame(str_path: str, dct_meta: dict):
+    """
+    Load a dataframe (or a series) stored with save_frame. Columns are read-only memory mapped arrays: the file pages
+    are read only when used.
+    :param str_path: folder of the files.
+    :param dct_meta: description of the stored frame, as returned by save_frame.
+    :return: the dataframe or the series.
+    """
+
+    arr_index = np.load(str_path + 'INDEX.npy', mmap_mode='r')
+    if dct_meta.get('INDEX_KIND') == 'STR':
+        # pandas keeps strings as python objects: the fixed-width unicode index is read and converted
+        idx = pd.Index(arr_index.astype(object), name=dct_meta['INDEX'])
+    else:
+        idx = pd.Index(arr_index, name=dct_meta['INDEX'], copy=False)
+    dct_col = {
+        c: np.load(str_path + f'{i:05d}.npy', mmap_mode='r') for i, c in enumerate(dct_meta['COLUMNS'])
+    }
+
+    if dct_meta['KIND'] == 'SERIES':
+        c = dct_meta['COLUMNS'][0]
+        return pd.Series(dct_col[c], index=idx, name=c, copy=False)
+
+    return pd.DataFrame(dct_col, index=idx, columns=dct_meta['COLUMNS'], copy=False)
+
+
+def save_run(str_run_id: str, model, dct_data: dict, dct_info: dict) -> dict:
+    """
+    Store the outputs of a run in its folder and write its manifest. The manifest lists every file of the folder with
+    its content hash, so it also covers the files already written there during the run. It is written last and
+    atomically: a run without manifest is incomplete and never loaded. The run then becomes the latest one.
+    :param str_run_id: the run id.
+    :param model: the fitted model, stored with joblib.
+    :param dct_data: dataframes and series of the run (train and test sets, predictions), by name.
+    :param dct_info: json serializable information on the run (settings, model parameters).
+    :return: the manifest.
+    """
+
+    # checked before anything is written: a run whose manifest cannot be written is not stored at all
+    try:
+        json.dumps(dct_info)
+    except TypeError as e:
+        raise ValueError(f'RUN {str_run_id} - INFO NOT JSON SERIALIZABLE: {e}')
+
+    str_path = run_path(str_run_id)
+    os.makedirs(str_path, exist_ok=True)
+
+    dct_artifacts = {'model': {'KIND': 'MODEL', 'PATH': 'model.joblib'}}
+    joblib.dump(model, str_path + 'model.joblib')
+    for str_name, dtf_data in dct_data.items():
+        dct_artifacts[str_name] = {'PATH': f'{str_name}/', **save_frame(dtf_data, str_path + f'{str_name}/')}
+
+    dct_files = {}
+    for str_dir, _, lst_file in os.walk(str_path):
+        for str_file in lst_file:
+            str_rel = os.path.relpath(os.path.join(str_dir, str_file), str_path).replace(os.sep, '/')
+            if str_rel != MANIFEST:
+                dct_files[str_rel] = hash_file(os.path.join(str_dir, str_file))
+
+    dct_manifest = {
+        'RUN_ID': str_run_id,
+        'CREATED': datetime.now().isoformat(timespec='seconds'),
+        'CONTENT_HASH': hash_content(dct_files),
+        'INFO': dct_info,
+        'ARTIFACTS': dct_artifacts,
+        'FILES': dict(sorted(dct_files.items())),
+    }
+    write_json(dct_manifest, str_path + MANIFEST)
+    write_json({'RUN_ID': str_run_id}, os.environ['PATH_OUT_MOD'] + 'RUNS/LATEST.json')
+
+    logging.info(f'RUN {str_run_id} SAVED: {str_path}')
+
+    return dct_manifest
+
+
+def load_manifest(str_run_id: str = None) -> dict:
+    """
+    Manifest of a completed run.
+    :param str_run_id: the run id. None means the latest run.
+    :return: the manifest.
+    """
+
+    if str_run_id is None:
+        with open(os.environ['PATH_OUT_MOD'] + 'RUNS/LATEST.json', 'r') as fp:
+            str_run_id = json.load(fp)['RUN_ID']
+
+    with open(run_path(str_run_id) + MANIFEST, 'r') as fp:
+        return json.load(fp)
+
+
+def load_artifact(dct_manifest: dict, str_name: str, bln_verify: bool = False):
+    """
+    Load an output of a run: the model, memory mapped where possible, or a dataframe or series, memory mapped.
+    :param dct_manifest: manifest of the run, as returned by load_manifest.
+    :param str_name: name of the output.
+    :param bln_verify: if True, the files are checked against the content hashes of the manifest.
+    :return: the output.
+    """
+
+    if str_name not in dct_manifest['ARTIFACTS']:
+        raise KeyError(f'{str_name} NOT IN RUN {dct_manifest["RUN_ID"]}')
+
+    str_path = run_path(dct_manifest['RUN_ID'])
+    dct_meta = dct_manifest['ARTIFACTS'][str_name]
+
+    if bln_verify:
+        for str_rel, str_hash in dct_manifest['FILES'].items():
+            if str_rel.startswith(dct_meta['PATH']) and hash_file(str_path + str_rel) != str_hash:
+                raise ValueError(f'{str_rel} OF RUN {dct_manifest["RUN_ID"]} DOES NOT MATCH ITS HASH')
+
+    if dct_meta['KIND'] == 'MODEL':
+        return joblib.load(str_path + dct_meta['PATH'], mmap_mode='r')
+
+    return load_frame(str_path + dct_meta['PATH'], dct_meta)
@@ -0,0 +1,57 @@
+import logging
+import numpy as np
+import pandas as pd
+
+
+def compact_dtypes(dtf_in: pd.DataFrame, bln_float32: bool = False) -> dict:
+    """
+    Smallest dtypes able to store the columns of the dataset without loss:
+    - binary columns (only 0 and 1) are stored as uint8;
+    - integer columns are downcast to the smallest integer type containing their range;
+    - float columns are stored as float32 only if bln_float32 (lossy: about 7 significant digits are kept).
+    The forest casts its input to float32 anyway, so these dtypes leave the model unchanged.
+    :param dtf_in: the dataset to compact.
+    :param bln_float32: if True, float columns are stored as float32.
+    :return: mapping column -> dtype, for the columns whose dtype changes.
+    """
+
+    dct_dtype = {}
+
+    lst_int = dtf_in.select_dtypes(include=['integer', 'bool']).columns.tolist()
+    if lst_int:
+        # a single pass over the data for all the integer columns
+        ser_min = dtf_in[lst_int].min().astype(np.int64)
+        ser_max = dtf_in[lst_int].max().astype(np.int64)
+        for c in lst_int:
+            if ser_min[c] >= 0 and ser_max[c] <= 1:
+                dtype_new = np.dtype(np.uint8)
+            else:
+                dtype_new = np.promote_types(np.min_scalar_type(ser_min[c]), np.min_scalar_type(ser_max[c]))
+            if dtype_new != dtf_in[c].dtype:
+                dct_dtype[c] = dtype_new
+
+    if bln_float32:
+        for c in dtf_in.select_dtypes(include='float64').columns:
+            dct_dtype[c] = np.dtype(np.float32)
+
+    return dct_dtype
+
+
+def compact_data(dtf_in: pd.DataFrame, bln_float32: bool = False) -> pd.DataFrame:
+    """
+    Cast the columns of the dataset to the dtypes returned by compact_dtypes.
+    :param dtf_in: the dataset to compact.
+    :param bln_float32: if True, float columns are stored as float32.
+    :return: the compacted dataset.
+    """
+
+    dct_dtype = compact_dtypes(dtf_in=dtf_in, bln_float32=bln_float32)
+    if not dct_dtype:
+        return dtf_in
+
+    mem_in = dtf_in.memory_usage(index=False).sum()
+    dtf_out = dtf_in.astype(dct_dtype)
+    mem_out = dtf_out.memory_usage(index=False).sum()
+    logging.debug(f'COMPACTION - {len(dct_dtype)} COLUMNS CAST - MEMORY: {mem_in} -> {mem_out} BYTES')
+
+    return dtf_out
@@ -2,6 +2,50 @@ import os
 import pandas as pd
 import yaml
 
+from typing import Iterator
+
+
+def get_ingestion_config(str_source: str) -> dict:
+    """
+    Settings of the source requested, as defined in ingestion.yaml.
+    :param str_source: label of the dataset name to load.
+    :return: the settings of the source.
+    """
+
+    with open(os.path.abspath('config/ingestion.yaml'), 'r') as f:
+        dct_ing = yaml.safe_load(f)[str_source]
+
+    return dct_ing
+
+
+def get_source_path(str_source: str) -> str:
+    """
+    Path of the file of the dataset requested.
+    :param str_source: label of the dataset name to load.
+    :return: the path of the file.
+    """
+
+    dct_ing = get_ingestion_config(str_source)
+
+    return dct_ing['PATH_MAIN'] + dct_ing['INGESTION']['PATH_ING'] + dct_ing['INGESTION']['FILENAME']
+
+
+def get_dtypes(str_source: str) -> dict:
+    """
+    Dtypes declared for the columns of the source: DTYPES as they are, CATEGORIES as pandas categories.
+    Values outside the declared vocabulary of a categorical column are read as missing.
+    :param str_source: label of the dataset name to load.
+    :return: mapping column -> dtype, to be passed to read_csv.
+    """
+
+    dct_ing = get_ingestion_config(str_source)['INGESTION']
+
+    dct_dtype = dict(dct_ing.get('DTYPES') or {})
+    for c, lst_val in (dct_ing.get('CATEGORIES') or {}).items():
+        dct_dtype[c] = pd.CategoricalDtype(categories=lst_val)
+
+    return dct_dtype
+
 
 def ingestion(str_source: str) -> pd.DataFrame:
     """
@@ -10,14 +54,32 @@ def ingestion(str_source: str) -> pd.DataFrame:
     :return: the desired dataset.
     """
 
-    with open(os.path.abspath('config/ingestion.yaml'), 'r') as f:
-        dct_ing = yaml.safe_load(f)[str_source]
+    dct_ing = get_ingestion_config(str_source)
 
-    str_path = dct_ing['PATH_MAIN']
-    str_sub = dct_ing['INGESTION']['PATH_ING']
-    str_name = dct_ing['INGESTION']['FILENAME']
     str_sep = dct_ing['INGESTION']['SEP']
 
-    dtf_load = pd.read_csv(str_path + str_sub + str_name, sep=str_sep)
+    dtf_load = pd.read_csv(get_source_path(str_source), sep=str_sep, dtype=get_dtypes(str_source))
 
     return dtf_load
+
+
+def ingestion_chunks(str_source: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Load the dataset requested chunk by chunk, so that only chunk_size rows are in memory at once.
+    :param str_source: label of the dataset name to load.
+    :param chunk_size: number of rows of each chunk.
+    :return: iterator over the chunks of the desired dataset.
+    """
+
+    dct_ing = get_ingestion_config(str_source)
+
+    str_sep = dct_ing['INGESTION']['SEP']
+
+    with pd.read_csv(
+            get_source_path(str_source),
+            sep=str_sep,
+            dtype=get_dtypes(str_source),
+            chunksize=chunk_size,
+    ) as reader:
+        for dtf_chunk in reader:
+            yield dtf_chunk
@@ -1,24 +1,213 @@
+import logging
+import numpy as np
+import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+from core.utils.files import tmp_path
 
-def join_output(X_test: pd.DataFrame, y_test: pd.Series, y_pred: pd.Series) -> pd.DataFrame:
+
+def _aligned_values(values, idx: pd.Index) -> np.ndarray:
+    """
+    Values of a series aligned to an index, as a numpy array. Arrays are assumed to be already aligned.
+    :param values: series or array.
+    :param idx: index to align to.
+    :return: the aligned values.
+    """
+
+    if isinstance(values, pd.Series) and not values.index.equals(idx):
+        values = values.reindex(idx)
+
+    return np.asarray(values)
+
+
+def _score_key(values) -> np.ndarray:
+    """
+    Scores as float array, with missing scores ranked last.
+    :param values: scores.
+    :return: the scores to rank.
+    """
+
+    arr_score = np.asarray(values, dtype=np.float64)
+    if np.isnan(arr_score).any():
+        arr_score = np.where(np.isnan(arr_score), -np.inf, arr_score)
+
+    return arr_score
+
+
+def rank_positions(arr_score: np.ndarray, top_k: int = None) -> np.ndarray:
+    """
+    Positions of the instances sorted by decreasing score. Instances with the same score are in order of position.
+    With top_k, the top_k instances are found by partial selection and only them are sorted.
+    :param arr_score: scores of the instances.
+    :param top_k: number of instances to return. None means all of them.
+    :return: the positions.
+    """
+
+    arr_score = _score_key(arr_score)
+    n = arr_score.shape[0]
+
+    if top_k is not None and top_k <= 0:
+        raise ValueError('TOP_K MUST BE A POSITIVE INTEGER')
+
+    if top_k is None or top_k >= n:
+        arr_pos = np.arange(n)
+    else:
+        # score of the top_k-th instance: the ones above it, then the first ones equal to it
+        v = -np.partition(-arr_score, top_k - 1)[top_k - 1]
+        arr_gt = np.flatnonzero(arr_score > v)
+        arr_eq = np.flatnonzero(arr_score == v)[:top_k - arr_gt.shape[0]]
+        arr_pos = np.sort(np.concatenate([arr_gt, arr_eq]))
+
+    return arr_pos[np.argsort(-arr_score[arr_pos], kind='stable')]
+
+
+def _block_order(arr_score: np.ndarray, chunk_size: int) -> np.ndarray:
+    """
+    Positions of the instances split by partial selection in blocks of chunk_size consecutive ranks, as in
+    rank_positions: each block holds the instances of its ranks, in no particular order.
+    :param arr_score: scores of the instances, as returned by _score_key.
+    :param chunk_size: number of ranks of each block.
+    :return: the positions.
+    """
+
+    n = arr_score.shape[0]
+    arr_kth = np.arange(chunk_size, n, chunk_size)
+    if not arr_kth.shape[0]:
+        return np.arange(n)
+
+    arr_order = np.argpartition(-arr_score, arr_kth)
+
+    def has_value(lo, hi, v):
+        return bool((arr_score[arr_order[lo:hi]] == v).any())
+
+    # instances with the score found on a boundary may lie in any of the blocks around it: they are given back to
+    # those blocks in order of position
+    for b in arr_kth:
+        v = arr_score[arr_order[b]]
+        if not has_value(b - chunk_size, b, v):
+            continue
+        lo, hi = b - chunk_size, min(b + chunk_size, n)
+        while lo > 0 and has_value(lo - chunk_size, lo, v):
+            lo -= chunk_size
+        while hi < n and has_value(hi, hi + chunk_size, v):
+            hi = min(hi + chunk_size, n)
+        arr_seg = arr_order[lo:hi]
+        arr_tie = arr_score[arr_seg] == v
+        arr_seg[arr_tie] = np.sort(arr_seg[arr_tie])
+
+    return arr_order
+
+
+def _rank_frame(
+        X_test: pd.DataFrame, arr_target: np.ndarray, arr_score: np.ndarray, arr_pos: np.ndarray, rank_start: int
+) -> pd.DataFrame:
+    """
+    Rows of the ranking: the instances at the given positions, with their rank, score and target first.
+    :param X_test: test set.
+    :param arr_target: target variable in the test set.
+    :param arr_score: predicted score of the test set.
+    :param arr_pos: positions of the instances, in order of rank.
+    :param rank_start: rank of the first instance.
+    :return: the rows of the ranking.
+    """
+
+    dtf_rank = X_test.iloc[arr_pos]
+    dtf_rank.insert(0, 'TARGET_REAL', arr_target[arr_pos])
+    dtf_rank.insert(0, 'SCORE', arr_score[arr_pos])
+    dtf_rank.insert(0, 'RANK', np.arange(rank_start, rank_start + arr_pos.shape[0]))
+
+    # rounding for better understanding
+    lst_flt = dtf_rank.select_dtypes(include='float').columns.tolist()
+    if lst_flt:
+        dtf_rank[lst_flt] = dtf_rank[lst_flt].round(5)
+
+    return dtf_rank
+
+
+def join_output(X_test: pd.DataFrame, y_test: pd.Series, y_pred: pd.Series, top_k: int = None) -> pd.DataFrame:
     """
     join the test set with the target and the prediction. Then sort the instances by score and assign a rank.
     :param X_test: test set.
     :param y_test: target variable in the test set.
     :param y_pred: predicted target variable for the test set.
+    :param top_k: if set, only the top_k instances by score are returned, found without sorting the whole test set.
     :return: dataframe with the rank desired.
     """
 
-    dtf_rank = pd.concat([X_test, pd.Series(y_test, name='TARGET_REAL'), pd.Series(y_pred, name='SCORE')], axis=1)
-    dtf_rank.sort_values(by='SCORE', ascending=False, inplace=True)
-    dtf_rank['RANK'] = list(range(1, dtf_rank.shape[0] + 1))
+    arr_score = _aligned_values(y_pred, X_test.index).astype(np.float64, copy=False)
+    arr_pos = rank_positions(arr_score, top_k=top_k)
 
-    # sorting
-    lst_tmp = ['RANK', 'SCORE', 'TARGET_REAL']
-    dtf_rank = dtf_rank[lst_tmp + [c for c in dtf_rank if c not in lst_tmp]].copy()
+    return _rank_frame(
+        X_test=X_test,
+        arr_target=_aligned_values(y_test, X_test.index),
+        arr_score=arr_score,
+        arr_pos=arr_pos,
+        rank_start=1,
+    )
 
-    # rounding for better understanding
-    dtf_rank = dtf_rank.round(5)
 
-    return dtf_rank
+def write_ranking(
+        X_test: pd.DataFrame, y_test: pd.Series, y_pred: pd.Series, str_path: str, chunk_size: int = 1000000
+) -> None:
+    """
+    Write the full ranking of join_output chunk by chunk, in csv (';' separated) or parquet format according to the
+    extension of the path. The test set is split by partial selection in blocks of chunk_size consecutive ranks, and
+    each block is sorted only when written: only the scores, their order and one block of rows are held in memory.
+    The ranking is the same as the one of join_output.
+    The file is written to a temporary name and then renamed, so that a partial write is never read.
+    :param X_test: test set.
+    :param y_test: target variable in the test set.
+    :param y_pred: predicted target variable for the test set.
+    :param str_path: path of the file, ending with .csv or .parquet.
+    :param chunk_size: number of ranks written at once.
+    :return:
+    """
+
+    str_format = os.path.splitext(str_path)[1]
+    if str_format not in ['.csv', '.parquet']:
+        raise ValueError("FILE EXTENSION NOT IN ['.csv', '.parquet']")
+    if chunk_size <= 0:
+        raise ValueError('CHUNK_SIZE MUST BE A POSITIVE INTEGER')
+
+    arr_score = _aligned_values(y_pred, X_test.index).astype(np.float64, copy=False)
+    arr_target = _aligned_values(y_test, X_test.index)
+    n = arr_score.shape[0]
+    arr_key = _score_key(arr_score)
+    arr_order = _block_order(arr_key, chunk_size=chunk_size)
+
+    os.makedirs(os.path.dirname(str_path) or '.', exist_ok=True)
+    str_tmp = tmp_path(str_path)
+    writer = None
+    bln_done = False
+    try:
+        # an empty test set still gets a file with the header
+        for start in range(0, max(n, 1), chunk_size):
+            arr_pos = np.sort(arr_order[start:start + chunk_size])
+            arr_pos = arr_pos[np.argsort(-arr_key[arr_pos], kind='stable')]
+            dtf_chunk = _rank_frame(
+                X_test=X_test, arr_target=arr_target, arr_score=arr_score, arr_pos=arr_pos, rank_start=start + 1
+            )
+
+            if str_format == '.csv':
+                dtf_chunk.to_csv(str_tmp, sep=';', index=True, mode='w' if start == 0 else 'a', header=start == 0)
+            else:
+                if writer is None:
+                    tbl_chunk = pa.Table.from_pandas(dtf_chunk, preserve_index=True)
+                    writer = pq.ParquetWriter(str_tmp, tbl_chunk.schema)
+                else:
+                    tbl_chunk = pa.Table.from_pandas(dtf_chunk, schema=writer.schema, preserve_index=True)
+                writer.write_table(tbl_chunk)
+
+            logging.debug(f'RANKING: {min(start + chunk_size, n)}/{n} WRITTEN')
+        bln_done = True
+    finally:
+        if writer is not None:
+            writer.close()
+        if not bln_done and os.path.exists(str_tmp):
+            os.remove(str_tmp)
+
+    os.replace(str_tmp, str_path)
+
+    return
@@ -0,0 +1,146 @@
+import logging
+import numpy as np
+import os
+import yaml
+
+from concurrent.futures import ProcessPoolExecutor
+from imblearn.over_sampling import SMOTE
+from imblearn.over_sampling.base import BaseOverSampler
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.neighbors import NearestNeighbors
+
+
+def _smote_partition(arr_x: np.ndarray, n_new: int, k_neighbors: int, seed) -> np.ndarray:
+    """
+    SMOTE within a partition of the minority samples: each synthetic sample lies on the segment between a random sample
+    of the partition and one of its k nearest neighbours in the partition.
+    :param arr_x: minority samples of the partition.
+    :param n_new: number of synthetic samples to generate.
+    :param k_neighbors: number of nearest neighbours.
+    :param seed: seed of the partition.
+    :return: the synthetic samples.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # a partition with a single sample can only be replicated
+    if arr_x.shape[0] == 1:
+        return np.repeat(arr_x, n_new, axis=0)
+
+    k = min(k_neighbors, arr_x.shape[0] - 1)
+    arr_nn = NearestNeighbors(n_neighbors=k + 1).fit(arr_x).kneighbors(arr_x, return_distance=False)[:, 1:]
+
+    arr_row = rng.integers(0, arr_x.shape[0], n_new)
+    arr_col = arr_nn[arr_row, rng.integers(0, k, n_new)]
+    arr_gap = rng.random(n_new)[:, None]
+
+    return arr_x[arr_row] + arr_gap * (arr_x[arr_col] - arr_x[arr_row])
+
+
+def _smote_partition_worker(tpl_task: tuple) -> np.ndarray:
+    """
+    Wrapper of _smote_partition executed inside the workers of the process pool.
+    :param tpl_task: arguments of _smote_partition.
+    :return: the synthetic samples.
+    """
+
+    return _smote_partition(*tpl_task)
+
+
+class PartitionedSMOTE(BaseOverSampler):
+    """
+    SMOTE with an approximate nearest neighbours search, for training sets too large for the exact one.
+    The minority samples are split with k-means in partitions of about partition_size samples and the neighbours are
+    searched within each partition only: the cost grows linearly with the number of minority samples instead of
+    quadratically. Partitions are processed independently, optionally in parallel. Each one has its own seed derived
+    from random_state, so the result does not depend on n_jobs. With a single partition this is the exact SMOTE.
+    """
+
+    def __init__(
+            self,
+            sampling_strategy='auto',
+            random_state=None,
+            k_neighbors: int = 5,
+            partition_size: int = 50000,
+            n_jobs: int = 1,
+    ):
+        super().__init__(sampling_strategy=sampling_strategy)
+        self.random_state = random_state
+        self.k_neighbors = k_neighbors
+        self.partition_size = partition_size
+        self.n_jobs = n_jobs
+
+    def _fit_resample(self, X, y):
+
+        if self.n_jobs == 0 or self.n_jobs < -1:
+            raise ValueError('n_jobs must be a positive integer or -1')
+
+        arr_x = np.asarray(X)
+        arr_y = np.asarray(y)
+        seq = np.random.SeedSequence(self.random_state)
+
+        lst_x = [arr_x]
+        lst_y = [arr_y]
+        for cls, n_new in self.sampling_strategy_.items():
+            if n_new == 0:
+                continue
+
+            arr_min = arr_x[arr_y == cls].astype(np.float64)
+            seq_cls, seq_part = seq.spawn(2)
+
+            # partitions of about partition_size samples
+            n_part = int(np.ceil(arr_min.shape[0] / self.partition_size))
+            if n_part > 1:
+                arr_part = MiniBatchKMeans(
+                    n_clusters=n_part, random_state=int(seq_cls.generate_state(1)[0]), n_init=3
+                ).fit_predict(arr_min)
+            else:
+                arr_part = np.zeros(arr_min.shape[0], dtype=int)
+            lst_part = [arr_min[arr_part == p] for p in range(n_part) if (arr_part == p).any()]
+
+            # synthetic samples shared among the partitions proportionally to their size
+            arr_size = np.array([arr.shape[0] for arr in lst_part])
+            arr_new = np.random.default_rng(seq_cls).multinomial(n_new, arr_size / arr_size.sum())
+            lst_task = [
+                (arr, n, self.k_neighbors, s) for arr, n, s in zip(lst_part, arr_new, seq_part.spawn(len(lst_part)))
+                if n > 0
+            ]
+            logging.debug(f'OVERSAMPLING - CLASS {cls}: {n_new} SAMPLES FROM {len(lst_part)} PARTITIONS')
+
+            n_workers = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+            if n_workers > 1 and len(lst_task) > 1:
+                with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                    lst_new = list(executor.map(_smote_partition_worker, lst_task))
+            else:
+                lst_new = [_smote_partition(*tpl_task) for tpl_task in lst_task]
+
+            lst_x = lst_x + lst_new
+            lst_y.append(np.full(n_new, cls, dtype=arr_y.dtype))
+
+        return np.concatenate(lst_x, axis=0), np.concatenate(lst_y, axis=0)
+
+
+def get_oversampler(random_state: int = None, bln_in_fold: bool = False):
+    """
+    Oversampler set in param_oversampling.yaml.
+    :param random_state: seed to be set for reproducibility.
+    :param bln_in_fold: if True, the oversampler runs inside the cross validation, whose folds are already processed in
+        parallel: it is then run on a single process.
+    :return: the oversampler.
+    """
+
+    with open('config/param_oversampling.yaml') as f:
+        dct_param_os = yaml.safe_load(f)
+
+    str_engine = dct_param_os['ENGINE']
+    if str_engine not in ['SMOTE', 'PARTITIONED']:
+        raise ValueError("ENGINE not in ['SMOTE', 'PARTITIONED']")
+
+    if str_engine == 'SMOTE':
+        return SMOTE(random_state=random_state, **dct_param_os['COMMON'])
+
+    dct_partitioned = dct_param_os['PARTITIONED'].copy()
+    if bln_in_fold:
+        dct_partitioned['n_jobs'] = 1
+
+    return PartitionedSMOTE(random_state=random_state, **dct_param_os['COMMON'], **dct_partitioned)
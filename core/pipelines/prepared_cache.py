@@ -0,0 +1,87 @@
+import inspect
+import logging
+import os
+import pandas as pd
+import yaml
+
+from core.data import etl_preparation, etl_utils
+from core.data.etl_preparation import DataPreparation
+from core.pipelines import compaction, ingestion
+from core.pipelines.ingestion import get_source_path
+from core.utils.files import tmp_path
+from core.utils.hashing import hash_content, hash_file
+
+
+def prepared_cache_key(str_source: str, data_preparation) -> str:
+    """
+    Key of the prepared dataset: content hash of the source file, of its ingestion and preparation settings and of the
+    code producing it (the whole module defining the data preparation, the shared preparation modules and the reading
+    and dtype compaction of the source), so that any change to the data or to the ETL invalidates the cache.
+    :param str_source: label of the dataset.
+    :param data_preparation: data preparation method of the source, as returned by etl_factory.
+    :return: the key.
+    """
+
+    with open(os.path.abspath('config/ingestion.yaml'), 'r') as f:
+        dct_ing = yaml.safe_load(f)[str_source]
+
+    lst_module = [inspect.getmodule(data_preparation), etl_preparation, etl_utils, ingestion, compaction]
+    str_code = ''.join(inspect.getsource(module) for module in lst_module)
+
+    return hash_content(
+        str_source, hash_file(get_source_path(str_source)), dct_ing['INGESTION'], dct_ing.get('PREPARATION'), str_code
+    )
+
+
+def load_prepared(str_key: str):
+    """
+    Load the prepared dataset from the cache.
+    :param str_key: key of the prepared dataset.
+    :return: the prepared dataset, or None if not cached.
+    """
+
+    str_path = os.environ['PATH_OUT_CACHE'] + f'PREPARED/{str_key}.parquet'
+    if not os.path.exists(str_path):
+        return None
+
+    logging.info(f'PREPARED CACHE HIT: {str_path}')
+
+    return pd.read_parquet(str_path)
+
+
+def load_preparation(str_key: str, preparation: DataPreparation) -> DataPreparation:
+    """
+    Load from the cache the data preparation fit along with the prepared dataset.
+    :param str_key: key of the prepared dataset.
+    :param preparation: data preparation object of the source, as returned by preparation_factory.
+    :return: the fitted data preparation, or None if not cached.
+    """
+
+    str_path = os.environ['PATH_OUT_CACHE'] + f'PREPARED/{str_key}.json'
+    if not os.path.exists(str_path):
+        return None
+
+    return type(preparation).load(str_path)
+
+
+def save_prepared(dtf_main: pd.DataFrame, str_key: str, preparation: DataPreparation = None) -> None:
+    """
+    Store the prepared dataset in the cache, in parquet format, and the fitted data preparation, in json format. The
+    preparation is written first and the dataset last, so that a hit on the dataset always finds its preparation.
+    Files are written to a temporary name unique to the process and then renamed, so that a partial write is never
+    read, even when two trainings store the same key.
+    :param dtf_main: the prepared dataset.
+    :param str_key: key of the prepared dataset.
+    :param preparation: the fitted data preparation.
+    :return:
+    """
+
+    str_path = os.environ['PATH_OUT_CACHE'] + f'PREPARED/{str_key}.parquet'
+    os.makedirs(os.path.dirname(str_path), exist_ok=True)
+    if preparation is not None:
+        preparation.save(os.environ['PATH_OUT_CACHE'] + f'PREPARED/{str_key}.json')
+    str_tmp = tmp_path(str_path)
+    dtf_main.to_parquet(str_tmp, index=True)
+    os.replace(str_tmp, str_path)
+
+    return
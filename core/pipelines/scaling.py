@@ -1,49 +1,144 @@
+import json
 import logging
+import numpy as np
+import os
 import pandas as pd
 
 from sklearn.preprocessing import StandardScaler
 
+from core.utils.files import write_json
 
-def scaling_data(X_train, X_test):
+
+class FeatureScaler:
     """
-    Scaling train and test set by using the standard scaling approach. Boolean variables are not scaled.
-    :param X_train: train set to fit (and transform) the scaler.
-    :param X_test: test set to transform.
-    :return: train and test set scaled.
+    Standard scaling fit once on the train set and then applied as it is to any dataset: test set, folds, new data to
+    score. Binary variables (only 0 and 1 values in the train set) are not scaled.
+    The column order of the data is kept: only the scaled columns are replaced.
     """
 
-    lst_num = X_train.select_dtypes(include='number').columns.tolist()
-    if set(lst_num) != set(X_train):
-        raise KeyError('COLUMNS ARE NOT ALL NUMERIC')
+    def __init__(self):
+        self.columns_ = None
+        self.scale_columns_ = None
+        self.mean_ = None
+        self.scale_ = None
 
-    lst_bin = []
-    for c in lst_num:
-        if set(X_train[c]).issubset({0, 1}):
-            lst_bin.append(c)
-    lst_flt = [c for c in lst_num if c not in lst_bin]
+    def is_fitted(self) -> bool:
+        return self.columns_ is not None
 
-    if set(lst_bin + lst_flt) != set(X_train):
-        raise KeyError('WRONG Columns split')
+    def fit(self, X_train: pd.DataFrame):
+        """
+        Learn the columns to scale and their mean and standard deviation.
+        :param X_train: train set, with numeric columns only.
+        :return: the fitted scaler.
+        """
 
-    # Scaling only if there are features to scale. Condition necessary to avoid error
-    if lst_flt:
+        lst_num = X_train.select_dtypes(include='number').columns.tolist()
+        if len(lst_num) != X_train.shape[1]:
+            raise KeyError('COLUMNS ARE NOT ALL NUMERIC')
 
-        logging.debug(f'Scaling features: {lst_flt}')
+        ser_bin = X_train.isin([0, 1]).all(axis=0)
+        self.columns_ = X_train.columns.tolist()
+        self.scale_columns_ = ser_bin.index[~ser_bin.to_numpy()].tolist()
 
-        # fitting
-        sc = StandardScaler()
-        sc.fit(X_train[lst_flt])
+        self.mean_ = np.zeros(0)
+        self.scale_ = np.ones(0)
+        # fitting only if there are features to scale. Condition necessary to avoid error
+        if self.scale_columns_:
+            logging.debug(f'Scaling features: {self.scale_columns_}')
+            sc = StandardScaler().fit(X_train[self.scale_columns_].to_numpy(dtype=np.float64))
+            self.mean_, self.scale_ = sc.mean_, sc.scale_
 
-        # transforming
-        X_train = pd.concat(
-            [pd.DataFrame(sc.transform(X_train[lst_flt]), columns=lst_flt, index=X_train.index), X_train[lst_bin]],
-            axis=1,
-            verify_integrity=True
-        )
-        X_test = pd.concat(
-            [pd.DataFrame(sc.transform(X_test[lst_flt]), columns=lst_flt, index=X_test.index), X_test[lst_bin]],
-            axis=1,
-            verify_integrity=True
+        return self
+
+    def _check_columns(self, lst_col: list) -> None:
+
+        if not self.is_fitted():
+            raise ValueError('SCALER NOT FITTED')
+        if lst_col != self.columns_:
+            raise KeyError('COLUMNS DIFFER FROM THE ONES OF THE FIT')
+
+    def transform_array(self, arr_x: np.ndarray) -> np.ndarray:
+        """
+        Scale in place a float array whose columns are in the order of the fit.
+        :param arr_x: float array with one column per feature of the fit.
+        :return: the same array, scaled.
+        """
+
+        if not self.is_fitted():
+            raise ValueError('SCALER NOT FITTED')
+        if arr_x.shape[1] != len(self.columns_):
+            raise KeyError('COLUMNS DIFFER FROM THE ONES OF THE FIT')
+
+        if self.scale_columns_:
+            arr_pos = pd.Index(self.columns_).get_indexer(self.scale_columns_)
+            arr_x[:, arr_pos] -= self.mean_
+            arr_x[:, arr_pos] /= self.scale_
+
+        return arr_x
+
+    def transform(self, X_in: pd.DataFrame, dtype=np.float64) -> pd.DataFrame:
+        """
+        Scale a dataset with the fitted mean and standard deviation. Binary columns are left untouched.
+        :param X_in: dataset with the columns of the fit, in the same order.
+        :param dtype: float type of the scaled columns.
+        :return: the scaled dataset.
+        """
+
+        self._check_columns(X_in.columns.tolist())
+
+        X_out = X_in.copy(deep=False)
+        if self.scale_columns_:
+            arr_x = X_in[self.scale_columns_].to_numpy(dtype=np.float64, copy=True)
+            arr_x -= self.mean_
+            arr_x /= self.scale_
+            X_out[self.scale_columns_] = arr_x.astype(dtype, copy=False)
+
+        return X_out
+
+    def fit_transform(self, X_train: pd.DataFrame, dtype=np.float64) -> pd.DataFrame:
+        return self.fit(X_train).transform(X_train, dtype=dtype)
+
+    def save(self, str_path: str) -> None:
+        """
+        Store the fitted scaler in json format. The file is written to a temporary name and then renamed, so that a
+        partial write is never read.
+        :param str_path: path of the file.
+        :return:
+        """
+
+        if not self.is_fitted():
+            raise ValueError('SCALER NOT FITTED')
+
+        os.makedirs(os.path.dirname(str_path) or '.', exist_ok=True)
+        write_json(
+            {
+                'COLUMNS': self.columns_,
+                'SCALE_COLUMNS': self.scale_columns_,
+                'MEAN': self.mean_.tolist(),
+                'SCALE': self.scale_.tolist(),
+            },
+            str_path,
         )
 
-    return X_train, X_test
+        logging.debug(f'SCALER SAVED: {str_path}')
+
+        return
+
+    @classmethod
+    def load(cls, str_path: str):
+        """
+        Load a fitted scaler stored with save.
+        :param str_path: path of the file.
+        :return: the fitted scaler.
+        """
+
+        with open(str_path, 'r') as fp:
+            dct_sc = json.load(fp)
+
+        scaler = cls()
+        scaler.columns_ = dct_sc['COLUMNS']
+        scaler.scale_columns_ = dct_sc['SCALE_COLUMNS']
+        scaler.mean_ = np.array(dct_sc['MEAN'], dtype=np.float64)
+        scaler.scale_ = np.array(dct_sc['SCALE'], dtype=np.float64)
+
+        return scaler
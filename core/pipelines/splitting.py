@@ -1,28 +1,92 @@
 import logging
+import numpy as np
 import pandas as pd
 
-from imblearn.over_sampling import SMOTE
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import StratifiedGroupKFold, StratifiedKFold, train_test_split
+
+from core.pipelines.oversampling import get_oversampler
+
+
+def make_folds(y, n_folds: int, groups=None) -> dict:
+    """
+    Stratified folds for cross validation, as int32 positions in the train set.
+    With groups, rows of the same group (e.g. the same customer) never fall in both the training and the validation
+    part of a fold.
+    :param y: target variable of the train set.
+    :param n_folds: number of folds.
+    :param groups: group of each row of y. None means one group per row.
+    :return: dictionary fold -> {'TRAIN': positions, 'VALIDATION': positions}.
+    """
+
+    if groups is None:
+        iter_split = StratifiedKFold(n_splits=n_folds).split(np.zeros(len(y)), y)
+    else:
+        iter_split = StratifiedGroupKFold(n_splits=n_folds).split(np.zeros(len(y)), y, groups)
+
+    dct_cv = {}
+    for k, (arr_train, arr_valid) in enumerate(iter_split):
+        dct_cv[k] = {
+            'TRAIN': arr_train.astype(np.int32),
+            'VALIDATION': arr_valid.astype(np.int32),
+        }
+
+    return dct_cv
+
+
+def save_folds(dct_cv: dict, str_path: str) -> None:
+    """
+    Store the folds in a single .npz file.
+    :param dct_cv: folds, as returned by make_folds.
+    :param str_path: path of the file.
+    :return:
+    """
+
+    np.savez(str_path, **{f'{k}_{t}': item[t] for k, item in dct_cv.items() for t in ['TRAIN', 'VALIDATION']})
+
+    return
+
+
+def load_folds(str_path: str) -> dict:
+    """
+    Load the folds stored with save_folds.
+    :param str_path: path of the file.
+    :return: folds, as returned by make_folds.
+    """
+
+    dct_cv = {}
+    with np.load(str_path) as npz:
+        for str_key in npz.files:
+            k, t = str_key.rsplit('_', 1)
+            dct_cv.setdefault(int(k), {})[t] = npz[str_key]
+
+    return dict(sorted(dct_cv.items()))
 
 
 def split_data(
         dtf_in: pd.DataFrame,
         str_tgt: str = 'TARGET',
         split_strategy: str = None,
-        random_state: int = None
+        random_state: int = None,
+        n_folds: int = None,
+        str_group: str = None,
 ):
     """
     Split the input data in train and test set according to the strategy desired.
     From the train set, folds for cross validation to use in the model are also retrieved.
     :param dtf_in: the dataset to split
     :param str_tgt: name of the target variable
-    :param split_strategy: how to split the dataset in train and test set. Allowed values are None and OVERSAMPLING.
+    :param split_strategy: how to split the dataset in train and test set. Allowed values are None, OVERSAMPLING
+        (the whole train set is oversampled, the folds keep the actual rows only) and OVERSAMPLING_IN_FOLD (the train
+        set is left as it is: the oversampling is done later on the training part of each fold, see get_oversampler).
     :param random_state: seed to be set for reproducibility
-    :return: train and test set
+    :param n_folds: number of folds for cross validation. None means no folds.
+    :param str_group: name of the index level defining the groups of the folds (e.g. the customer). None means one
+        group per row.
+    :return: train and test set, and the folds of the train set (None if n_folds is None)
     """
 
-    if split_strategy not in [None, 'OVERSAMPLING']:
-        raise ValueError("split_strategy not in [None, 'OVERSAMPLING']")
+    if split_strategy not in [None, 'OVERSAMPLING', 'OVERSAMPLING_IN_FOLD']:
+        raise ValueError("split_strategy not in [None, 'OVERSAMPLING', 'OVERSAMPLING_IN_FOLD']")
 
     # SPLITTING
     X = dtf_in[[c for c in dtf_in if c != str_tgt]].copy()
@@ -34,8 +98,14 @@ def split_data(
     logging.info(f"SPLITTING_DATA - TARGET TRAIN: {round(y_train.value_counts(normalize=True)[1], 6)} %")
     logging.info(f"SPLITTING_DATA - TARGET TEST:  {round(y_test.value_counts(normalize=True)[1], 6)} %")
 
+    # folds are computed on the actual rows only. The synthetic rows of OVERSAMPLING are built from the whole train
+    # set, validation rows of every fold included: they are left out of the folds and only used by the final fit. To
+    # oversample inside the cross validation, use OVERSAMPLING_IN_FOLD.
+    n_real = X_train.shape[0]
+    groups = None if str_group is None else X_train.index.get_level_values(str_group)
+
     if split_strategy == 'OVERSAMPLING':
-        sm = SMOTE(sampling_strategy=0.25, random_state=random_state)
+        sm = get_oversampler(random_state=random_state)
         X_train, y_train = sm.fit_resample(X_train, y_train)
         logging.info(f"SPLITTING_DATA - TARGET TRAIN SMOTE: {round(y_train.value_counts(normalize=True)[1], 6)} %")
         # the shape of the train changes, the shape of the test not.
@@ -47,4 +117,10 @@ def split_data(
     if set(dtf_in) != set(X_test).union({'TARGET'}):
         raise ValueError('TEST columns not as expected')
 
-    return X_train, X_test, y_train, y_test
+    dct_cv = None
+    if n_folds is not None:
+        # the oversampling keeps the actual rows first, in the same order, and appends the synthetic ones
+        dct_cv = make_folds(y=y_train.iloc[:n_real], n_folds=n_folds, groups=groups)
+        logging.debug(f'SPLITTING DATA - FOLDS: {n_folds} - GROUP: {str_group}')
+
+    return X_train, X_test, y_train, y_test, dct_cv
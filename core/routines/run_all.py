@@ -1,7 +1,10 @@
-import pandas as pd
 import os
-import json
 
+from typing import Callable
+
+from core.pipelines.artifact_store import new_run_id, run_path, save_run
+from core.pipelines.oversampling import get_oversampler
+from core.pipelines.splitting import save_folds
 from core.routines.run_etl import run_etl
 from core.routines.run_model import run_model
 
@@ -11,44 +14,84 @@ def execute_main(
         split_strategy: str = None,
         bln_scale: bool = False,
         random_state: int = None,
+        fun_progress: Callable = None,
 ) -> dict:
     """
-    Loading data, preparing data and running the classification model
+    Loading data, preparing data and running the classification model.
+    Each call is a new run, with its own id and folder in the artifact store: concurrent trainings do not overwrite
+    each other's outputs.
     :param str_source: name of the source to consider. Allowed values are HR and CHURN.
-    :param split_strategy: how to split the dataset in train and test set. Allowed values are None and OVERSAMPLING.
+    :param split_strategy: how to split the dataset in train and test set. Allowed values are None, OVERSAMPLING and
+        OVERSAMPLING_IN_FOLD.
     :param bln_scale: if True, train and test set are scaled with normal scaling approach.
     :param random_state: seed to be set for reproducibility
-    :return: dictionary with the model parameters and the test dataframe with its predictions.
+    :param fun_progress: if set, called with the fraction done and the name of each step when it starts, and inside
+        the model training (search batches, out-of-bag growth, evaluation).
+    :return: dictionary with the run id and the model parameters.
     """
 
-    X_train, X_test, y_train, y_test = run_etl(
+    str_run_id = new_run_id()
+    str_path_out = run_path(str_run_id)
+    os.makedirs(str_path_out, exist_ok=True)
+
+    if fun_progress is not None:
+        fun_progress(0.0, 'ETL')
+
+    X_train, X_test, y_train, y_test, dct_cv = run_etl(
         str_source=str_source,
         split_strategy=split_strategy,
         bln_scale=bln_scale,
-        random_state=random_state
+        random_state=random_state,
+        str_path_out=str_path_out,
     )
 
+    # with OVERSAMPLING_IN_FOLD, the oversampling is done by the search, on the training part of each fold
+    sampler = None
+    if split_strategy == 'OVERSAMPLING_IN_FOLD':
+        sampler = get_oversampler(random_state=random_state, bln_in_fold=True)
+
+    if fun_progress is not None:
+        fun_progress(0.2, 'MODEL')
+
     model, test_set = run_model(
         X_train=X_train,
         X_test=X_test,
         y_train=y_train,
         y_test=y_test,
+        dct_cv=dct_cv,
+        sampler=sampler,
         random_state=random_state,
+        str_path_out=str_path_out,
+        fun_progress=None if fun_progress is None else lambda p, m: fun_progress(0.2 + 0.7 * p, f'MODEL - {m}'),
     )
 
     model_params = model.get_params()
 
-    with open(os.environ['PATH_OUT_MOD'] + 'model_params.json', 'w') as fp:
-        json.dump(model_params, fp, indent=4)
+    if fun_progress is not None:
+        fun_progress(0.9, 'SAVE')
 
-    pd.to_pickle(model, os.environ['PATH_OUT_MOD'] + 'model.pickle')
-    pd.to_pickle(X_train, os.environ['PATH_OUT_MOD'] + 'X_train.pickle')
-    pd.to_pickle(X_test, os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
-    pd.to_pickle(y_train, os.environ['PATH_OUT_MOD'] + 'y_train.pickle')
-    pd.to_pickle(y_test, os.environ['PATH_OUT_MOD'] + 'y_test.pickle')
-    test_set.to_csv(os.environ['PATH_OUT_MOD'] + 'test_set.csv', sep=';', index=True)
+    save_folds(dct_cv, str_path_out + 'folds.npz')
+    test_set.to_csv(str_path_out + 'test_set.csv', sep=';', index=True)
+    save_run(
+        str_run_id=str_run_id,
+        model=model,
+        dct_data={
+            'X_train': X_train,
+            'X_test': X_test,
+            'y_train': y_train,
+            'y_test': y_test,
+            'test_set': test_set,
+        },
+        dct_info={
+            'SOURCE': str_source,
+            'SPLIT_STRATEGY': split_strategy,
+            'BLN_SCALE': bln_scale,
+            'RANDOM_STATE': random_state,
+            'MODEL_PARAMS': model_params,
+        },
+    )
 
-    return model_params
+    return {'RUN_ID': str_run_id, 'MODEL_PARAMS': model_params}
 
 
 if __name__ == '__main__':
@@ -1,35 +1,106 @@
 import logging
+import numpy as np
+import os
+import pandas as pd
+import yaml
 
-from core.data.etl_factory import etl_factory
-from core.pipelines.ingestion import ingestion
-from core.pipelines.scaling import scaling_data
+from core.data.etl_factory import etl_factory, prepare_chunks, preparation_factory
+from core.pipelines.compaction import compact_data
+from core.pipelines.ingestion import get_ingestion_config, ingestion, ingestion_chunks
+from core.pipelines.prepared_cache import load_prepared, load_preparation, prepared_cache_key, save_prepared
+from core.pipelines.scaling import FeatureScaler
 from core.pipelines.splitting import split_data
 
 
-def run_etl(str_source: str, split_strategy: str, bln_scale: bool, random_state: int):
+def run_etl(
+        str_source: str,
+        split_strategy: str,
+        bln_scale: bool,
+        random_state: int,
+        bln_cache: bool = True,
+        bln_float32: bool = False,
+        str_path_out: str = None,
+):
     """
     Load the required dataset, apply data preparation and split the data in train and test sets.
     :param str_source: name of the source to load
-    :param split_strategy: strategy to use when creating train and test sets. None or OVERSAMPLING allowed.
+    :param split_strategy: strategy to use when creating train and test sets. None, OVERSAMPLING or
+        OVERSAMPLING_IN_FOLD allowed.
     :param bln_scale: if True, data are scaled via standard scaling approach
     :param random_state: seed to be set for reproducibility.
-    :return: train and test sets with the indexes needed to perform cross validation
+    :param bln_cache: if True, the prepared dataset is loaded from the cache when neither the source file nor the ETL
+        code changed, and stored in the cache otherwise.
+    :param bln_float32: if True, continuous features are stored as float32. Binary and integer features are always
+        stored in the smallest integer type containing them.
+    :param str_path_out: folder of the model, where the fitted data preparation and, when bln_scale is True, the
+        scaler fit on the train set are stored, to prepare new data to score in the same way. None means PATH_OUT_MOD.
+    :return: train and test sets, and the folds of the train set (positions) to perform cross validation
     """
 
-    dtf_load = ingestion(str_source=str_source)
+    if str_path_out is None:
+        str_path_out = os.environ['PATH_OUT_MOD']
 
     # ETL and SPLITTING
     data_preparation = etl_factory(str_source)
-    dtf_main = data_preparation(dtf_load=dtf_load)
+    preparation = preparation_factory(str_source)
 
-    X_train, X_test, y_train, y_test = split_data(
+    dtf_main = None
+    if bln_cache:
+        str_key = prepared_cache_key(str_source=str_source, data_preparation=data_preparation)
+        preparation_cached = load_preparation(str_key=str_key, preparation=preparation)
+        if preparation_cached is not None:
+            preparation = preparation_cached
+            dtf_main = load_prepared(str_key=str_key)
+
+    if dtf_main is None:
+        # with CHUNK_SIZE the file is read and prepared by chunks: only the prepared data are kept in memory
+        chunk_size = get_ingestion_config(str_source)['INGESTION'].get('CHUNK_SIZE')
+        if chunk_size:
+            logging.debug(f'INGESTION: CHUNK_SIZE={chunk_size}')
+            # first pass: the correlation statistics and the categorical values of the whole file, for the pruning and
+            # the vocabulary learnt when fitting the preparation on the first chunk
+            if not preparation.is_fitted():
+                for dtf_chunk in ingestion_chunks(str_source=str_source, chunk_size=chunk_size):
+                    preparation.update_stats(preparation.clean(dtf_chunk))
+            dtf_main = pd.concat(compact_data(dtf_chunk) for dtf_chunk in prepare_chunks(
+                iter_chunks=ingestion_chunks(str_source=str_source, chunk_size=chunk_size),
+                data_preparation=data_preparation,
+                preparation=preparation,
+            ))
+        else:
+            dtf_load = ingestion(str_source=str_source)
+            dtf_main = data_preparation(dtf_load=dtf_load, preparation=preparation)
+        # lossless compaction, before the prepared dataset is cached
+        dtf_main = compact_data(dtf_main)
+        if bln_cache:
+            save_prepared(dtf_main=dtf_main, str_key=str_key, preparation=preparation)
+
+    preparation.save(str_path_out + 'preparation.json')
+
+    if bln_float32:
+        dtf_main = compact_data(dtf_main, bln_float32=True)
+
+    with open('config/param_cv.yaml') as f:
+        dct_param_cv = yaml.safe_load(f)
+
+    X_train, X_test, y_train, y_test, dct_cv = split_data(
         dtf_in=dtf_main,
         split_strategy=split_strategy,
         random_state=random_state,
+        n_folds=dct_param_cv['COMMON']['cv'],
+        str_group=dct_param_cv['FOLDS']['GROUP'],
     )
 
+    str_scaler = str_path_out + 'scaler.json'
     if bln_scale:
         logging.debug(f'MODEL: bln_scale={bln_scale}')
-        X_train, X_test = scaling_data(X_train=X_train, X_test=X_test)
+        # scaled features come back as float64, unless float32 is required
+        dtype = np.float32 if bln_float32 else np.float64
+        scaler = FeatureScaler().fit(X_train)
+        X_train, X_test = scaler.transform(X_train, dtype=dtype), scaler.transform(X_test, dtype=dtype)
+        scaler.save(str_scaler)
+    elif os.path.exists(str_scaler):
+        # a scaler of a previous run does not apply to this model
+        os.remove(str_scaler)
 
-    return X_train, X_test, y_train, y_test
+    return X_train, X_test, y_train, y_test, dct_cv
@@ -1,5 +1,8 @@
 import numpy as np
 import pandas as pd
+import yaml
+
+from typing import Callable
 
 from core.models.evaluation import evaluation
 from core.models.forest import run_random_forest
@@ -10,7 +13,11 @@ def run_model(
         X_test: pd.DataFrame,
         y_train: pd.Series,
         y_test: pd.Series,
-        random_state: int = None
+        dct_cv: dict = None,
+        sampler=None,
+        random_state: int = None,
+        str_path_out: str = None,
+        fun_progress: Callable = None,
 ) -> tuple:
     """
     Run the model and predict the values for the test set.
@@ -20,7 +27,12 @@ def run_model(
     :param X_test: test dataset
     :param y_train: target variable for training
     :param y_test:  target variable for testing.
+    :param dct_cv: folds of the train set (positions), as returned by split_data. None means the cv of param_cv.yaml.
+    :param sampler: if set, oversampler applied to the training part of each fold and then to the whole train set.
     :param random_state: seed to be set for reproducibility
+    :param str_path_out: folder where the evaluation of the model is saved. None means PATH_OUT_MOD.
+    :param fun_progress: if set, called with the fraction done and the current step, during the search and before the
+        evaluation.
     :return: dictionary with the model parameters and the predictions
     """
 
@@ -31,18 +43,33 @@ def run_model(
     model = run_random_forest(
         X_train=X_train,
         y_train=y_train,
-        random_state=random_state
+        dct_cv=dct_cv,
+        sampler=sampler,
+        random_state=random_state,
+        fun_progress=None if fun_progress is None else lambda p, m: fun_progress(0.9 * p, m),
     )
 
+    if fun_progress is not None:
+        fun_progress(0.9, 'EVALUATION')
+
     # testing overfitting
     y_pred_train = model.predict(X_train)
     y_pred_proba_train = model.predict_proba(X_train)
-    evaluation(y_train, y_pred_train, y_pred_proba_train, tpe='TRAIN', bln_save=True)
+    evaluation(
+        y_train, y_pred_train, y_pred_proba_train, tpe='TRAIN', bln_save=True, str_path_out=str_path_out
+    )
 
     # predicting on test
     y_pred = model.predict(X_test)
     y_pred_proba = model.predict_proba(X_test)
-    evaluation(y_test, y_pred, y_pred_proba, tpe='TEST', bln_save=True)
+    # confidence intervals of the test metrics, as set in param_evaluation.yaml
+    with open('config/param_evaluation.yaml') as f:
+        dct_param_boot = yaml.safe_load(f)['BOOTSTRAP']
+
+    evaluation(
+        y_test, y_pred, y_pred_proba, tpe='TEST', bln_save=True, random_state=random_state, str_path_out=str_path_out,
+        **dct_param_boot,
+    )
 
     test_set = pd.concat(
         [
@@ -9,6 +9,7 @@ from safeaipackage.check_explainability import Explainability
 from safeaipackage.check_fairness import Fairness
 from safeaipackage.check_robustness import Robustness
 
+from core.pipelines.artifact_store import load_artifact, load_manifest
 from setting.environment import set_env
 from setting.logger import set_logger
 
@@ -18,11 +19,13 @@ from setting.logger import set_logger
 set_env()
 set_logger(level='INFO')
 
-model = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'model.pickle')
-X_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_train.pickle')
-X_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'X_test.pickle')
-y_train = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'y_train.pickle')
-y_test = pd.read_pickle(os.environ['PATH_OUT_MOD'] + 'y_test.pickle')
+# latest run
+dct_manifest = load_manifest()
+model = load_artifact(dct_manifest, 'model')
+X_train = load_artifact(dct_manifest, 'X_train')
+X_test = load_artifact(dct_manifest, 'X_test')
+y_train = load_artifact(dct_manifest, 'y_train')
+y_test = load_artifact(dct_manifest, 'y_test')
 
 scores = {}
 
@@ -0,0 +1,34 @@
+import json
+import os
+import uuid
+
+
+def tmp_path(str_path: str) -> str:
+    """
+    Temporary name to write a file to before renaming it to its path. The name is unique to the process and to the
+    call, so that concurrent writers of the same file never share it.
+    :param str_path: path of the file.
+    :return: the temporary path, in the same folder.
+    """
+
+    return str_path + f'.{os.getpid()}_{uuid.uuid4().hex[:8]}.tmp'
+
+
+def write_json(dct_in: dict, str_path: str) -> None:
+    """
+    Write a dictionary in json format, to a temporary name then renamed, so that a partial write is never read.
+    :param dct_in: the dictionary.
+    :param str_path: path of the file.
+    :return:
+    """
+
+    str_tmp = tmp_path(str_path)
+    try:
+        with open(str_tmp, 'w') as fp:
+            json.dump(dct_in, fp, indent=4)
+        os.replace(str_tmp, str_path)
+    finally:
+        if os.path.exists(str_tmp):
+            os.remove(str_tmp)
+
+    return
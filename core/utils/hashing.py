@@ -0,0 +1,69 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def _update_hash(hsh, obj) -> None:
+    """
+    Feed an object to a hashlib object. Containers are walked recursively, dictionaries regardless of the key order.
+    :param hsh: hashlib object to update.
+    :param obj: object to hash. Allowed are pandas objects, numpy arrays, dictionaries, lists, tuples and scalars.
+    :return:
+    """
+
+    if isinstance(obj, pd.DataFrame):
+        hsh.update(b'DTF')
+        _update_hash(hsh, [str(c) for c in obj.columns])
+        _update_hash(hsh, [str(t) for t in obj.dtypes])
+        hsh.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Series):
+        hsh.update(b'SER')
+        _update_hash(hsh, [str(obj.name), str(obj.dtype)])
+        hsh.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        hsh.update(b'ARR')
+        _update_hash(hsh, [str(obj.dtype), obj.shape])
+        hsh.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        hsh.update(b'DCT')
+        for k in sorted(obj, key=repr):
+            _update_hash(hsh, k)
+            _update_hash(hsh, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        hsh.update(b'LST')
+        for item in obj:
+            _update_hash(hsh, item)
+    else:
+        hsh.update(repr(obj).encode('utf-8'))
+
+    return
+
+
+def hash_content(*args) -> str:
+    """
+    Content hash of the objects passed: equal contents give equal hashes, across processes and runs.
+    :param args: objects to hash. Allowed are pandas objects, numpy arrays, dictionaries, lists, tuples and scalars.
+    :return: hexadecimal sha256 digest.
+    """
+
+    hsh = hashlib.sha256()
+    for obj in args:
+        _update_hash(hsh, obj)
+
+    return hsh.hexdigest()
+
+
+def hash_file(str_path: str, chunk_size: int = 2 ** 20) -> str:
+    """
+    Content hash of a file, read in chunks.
+    :param str_path: path of the file.
+    :param chunk_size: number of bytes read at once.
+    :return: hexadecimal sha256 digest.
+    """
+
+    hsh = hashlib.sha256()
+    with open(str_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hsh.update(chunk)
+
+    return hsh.hexdigest()
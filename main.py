@@ -1,11 +1,14 @@
 import logging
 
+from api.artifact_cache import preload_artifact_cache
 from api.exceptionhandlers import register_exception_handlers
+from api.jobs import shutdown_job_engine
 from api.routers import register_routers
 from fastapi import FastAPI
 from fastapi.openapi.docs import (get_swagger_ui_html, get_swagger_ui_oauth2_redirect_html)
 from starlette.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
+from setting.environment import set_env
 
 
 tags_metadata = [
@@ -13,6 +16,7 @@ tags_metadata = [
     {'name': 'LIME', 'description': 'Get xAI with LIME'},
     {'name': 'SHAP', 'description': 'Get xAI with SHAP'},
     {'name': 'SAFE', 'description': 'Get xAI with SAFE'},
+    {'name': 'Jobs', 'description': 'Follow the background jobs of the long APIs'},
     {'name': 'Internal', 'description': 'Reserved APIs'}
 ]
 
@@ -54,12 +58,15 @@ async def swagger_ui_redirect() -> HTMLResponse:
 
 @app.on_event("startup")
 async def startup_event() -> None:
-    pass
+    # model and data of the latest run are in memory before the first request
+    set_env()
+    preload_artifact_cache()
 
 
 @app.on_event("shutdown")
 def shutdown_event() -> None:
-    pass
+    # pending jobs are cancelled, running ones are waited for
+    shutdown_job_engine()
 
 
 register_exception_handlers(app)
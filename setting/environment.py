@@ -12,5 +12,7 @@ def set_env():
     os.environ['PATH_OUT_LIME'] = dct_ing['PATH_MAIN'] + dct_ing['LIME']['PATH_LIME']
     os.environ['PATH_OUT_SHAP'] = dct_ing['PATH_MAIN'] + dct_ing['SHAP']['PATH_SHAP']
     os.environ['PATH_OUT_SAFE'] = dct_ing['PATH_MAIN'] + dct_ing['SAFE']['PATH_SAFE']
+    os.environ['PATH_OUT_CACHE'] = dct_ing['PATH_MAIN'] + dct_ing['CACHE']['PATH_CACHE']
+    os.environ['PATH_OUT_JOBS'] = dct_ing['PATH_MAIN'] + dct_ing['JOBS']['PATH_JOBS']
 
     return